@@ -0,0 +1 @@
+"""Python backend shared by the annotation and checker webview apps."""
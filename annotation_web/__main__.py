@@ -0,0 +1,5 @@
+import sys
+
+from annotation_web.cli import main
+
+sys.exit(main())
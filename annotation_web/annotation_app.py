@@ -1,5 +1,13 @@
-import webview
 import os
+import sys
+
+if __package__ in (None, ''):
+    # Allow running as a plain script: python annotation_web/annotation_app.py
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from annotation_web import collab_server
+from annotation_web.assets import window_source
+from annotation_web.backend import DatasetAPI
 
 # HTML content embedding the React app
 HTML_CONTENT = '''
@@ -17,133 +25,622 @@ HTML_CONTENT = '''
 <body>
     <div id="root"></div>
     
+    <script type="text/babel" data-shared></script>
     <script type="text/babel">
         const { useState, useRef, useEffect } = React;
-        const { Upload, Download, Trash2, Square, Circle, Tag, Save, ZoomIn, ZoomOut, Move } = {
+        const { Upload, Download, Trash2, Square, Circle, Polygon, Tag, Save, ZoomIn, ZoomOut, Move, Pointer } = {
             Upload: () => <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2"><path d="M21 15v4a2 2 0 0 1-2 2H5a2 2 0 0 1-2-2v-4M17 8l-5-5-5 5M12 3v12"/></svg>,
             Download: () => <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2"><path d="M21 15v4a2 2 0 0 1-2 2H5a2 2 0 0 1-2-2v-4M7 10l5 5 5-5M12 15V3"/></svg>,
             Trash2: () => <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2"><polyline points="3 6 5 6 21 6"/><path d="M19 6v14a2 2 0 0 1-2 2H7a2 2 0 0 1-2-2V6m3 0V4a2 2 0 0 1 2-2h4a2 2 0 0 1 2 2v2"/><line x1="10" y1="11" x2="10" y2="17"/><line x1="14" y1="11" x2="14" y2="17"/></svg>,
             Square: () => <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2"><rect x="3" y="3" width="18" height="18" rx="2" ry="2"/></svg>,
             Circle: () => <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2"><circle cx="12" cy="12" r="10"/></svg>,
+            Polygon: () => <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2"><polygon points="12 2 22 9 18 21 6 21 2 9"/></svg>,
             Tag: () => <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2"><path d="M20.59 13.41l-7.17 7.17a2 2 0 0 1-2.83 0L2 12V2h10l8.59 8.59a2 2 0 0 1 0 2.82z"/><line x1="7" y1="7" x2="7.01" y2="7"/></svg>,
             ZoomIn: () => <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2"><circle cx="11" cy="11" r="8"/><line x1="21" y1="21" x2="16.65" y2="16.65"/><line x1="11" y1="8" x2="11" y2="14"/><line x1="8" y1="11" x2="14" y2="11"/></svg>,
             ZoomOut: () => <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2"><circle cx="11" cy="11" r="8"/><line x1="21" y1="21" x2="16.65" y2="16.65"/><line x1="8" y1="11" x2="14" y2="11"/></svg>,
-            Move: () => <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2"><polyline points="5 9 2 12 5 15"/><polyline points="9 5 12 2 15 5"/><polyline points="15 19 12 22 9 19"/><polyline points="19 9 22 12 19 15"/><line x1="2" y1="12" x2="22" y2="12"/><line x1="12" y1="2" x2="12" y2="22"/></svg>
+            Move: () => <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2"><polyline points="5 9 2 12 5 15"/><polyline points="9 5 12 2 15 5"/><polyline points="15 19 12 22 9 19"/><polyline points="19 9 22 12 19 15"/><line x1="2" y1="12" x2="22" y2="12"/><line x1="12" y1="2" x2="12" y2="22"/></svg>,
+            Pointer: () => <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2"><path d="M3 3l7.07 16.97 2.51-7.39 7.39-2.51L3 3z"/><path d="M13 13l6 6"/></svg>
+        };
+
+        const TILE_STRIDE = 96;
+        const TILE_OVERSCAN = 5;
+
+        // Horizontally virtualized filmstrip: only the tiles inside the
+        // scrolled viewport, plus a small overscan, are mounted.
+        const Filmstrip = ({ imageList, currentIndex, onSelect }) => {
+          const stripRef = useRef(null);
+          const [viewport, setViewport] = useState({ left: 0, width: 1200 });
+
+          const first = Math.max(0, Math.floor(viewport.left / TILE_STRIDE) - TILE_OVERSCAN);
+          const last = Math.min(
+            imageList.total,
+            Math.ceil((viewport.left + viewport.width) / TILE_STRIDE) + TILE_OVERSCAN
+          );
+
+          const handleScroll = () => {
+            const strip = stripRef.current;
+            setViewport({ left: strip.scrollLeft, width: strip.clientWidth });
+          };
+
+          useEffect(() => {
+            handleScroll();
+          }, []);
+
+          useEffect(() => {
+            imageList.ensureRange(first, last);
+          }, [first, last, imageList.total]);
+
+          const tiles = [];
+          for (let idx = first; idx < last; idx++) {
+            const img = imageList.getImage(idx);
+            tiles.push(
+              <div
+                key={idx}
+                onClick={() => onSelect(idx)}
+                style={{ position: 'absolute', left: idx * TILE_STRIDE }}
+                className={`cursor-pointer border-2 rounded p-1 ${idx === currentIndex ? 'border-blue-500' : 'border-gray-700'}`}
+              >
+                {img ? (
+                  <img
+                    src={img.thumb || img.src}
+                    alt={img.name}
+                    decoding="async"
+                    className="w-20 h-20 object-cover"
+                  />
+                ) : (
+                  <div className="w-20 h-20 bg-gray-700" />
+                )}
+                <div className="text-xs truncate w-20 mt-1">{img ? img.name : ''}</div>
+              </div>
+            );
+          }
+
+          return (
+            <div ref={stripRef} onScroll={handleScroll} className="overflow-x-auto">
+              <div className="relative" style={{ width: imageList.total * TILE_STRIDE, height: 116 }}>
+                {tiles}
+              </div>
+            </div>
+          );
+        };
+
+        const drawShape = (ctx, ann) => {
+          if (ann.type === 'box') {
+            ctx.fillRect(ann.x, ann.y, ann.width, ann.height);
+            ctx.strokeRect(ann.x, ann.y, ann.width, ann.height);
+          } else if (ann.type === 'circle') {
+            ctx.beginPath();
+            ctx.arc(ann.x + ann.width / 2, ann.y + ann.height / 2, Math.max(Math.abs(ann.width), Math.abs(ann.height)) / 2, 0, 2 * Math.PI);
+            ctx.fill();
+            ctx.stroke();
+          } else if (ann.type === 'polygon') {
+            ctx.beginPath();
+            ann.points.forEach(([x, y], i) => (i ? ctx.lineTo(x, y) : ctx.moveTo(x, y)));
+            ctx.closePath();
+            ctx.fill();
+            ctx.stroke();
+          } else if (ann.type === 'point') {
+            ctx.beginPath();
+            ctx.arc(ann.x, ann.y, 2 * ctx.lineWidth, 0, 2 * Math.PI);
+            ctx.fill();
+            ctx.stroke();
+          }
+        };
+
+        // Polygons share the annotation model's shape: [x, y] points inside
+        // their bounding box, so picking, culling and export treat them like boxes
+        const polygonAnnotation = (points, label) => {
+          const xs = points.map(p => p[0]);
+          const ys = points.map(p => p[1]);
+          const x = Math.min(...xs);
+          const y = Math.min(...ys);
+          return { type: 'polygon', label, points, x, y, width: Math.max(...xs) - x, height: Math.max(...ys) - y };
+        };
+
+        // Frames actually presented per second, sampled with requestAnimationFrame
+        const useFrameRate = () => {
+          const [fps, setFps] = useState(0);
+          useEffect(() => {
+            let frames = 0;
+            let windowStart = performance.now();
+            let handle = requestAnimationFrame(function tick(now) {
+              frames += 1;
+              if (now - windowStart >= 1000) {
+                setFps(Math.round(frames * 1000 / (now - windowStart)));
+                frames = 0;
+                windowStart = now;
+              }
+              handle = requestAnimationFrame(tick);
+            });
+            return () => cancelAnimationFrame(handle);
+          }, []);
+          return fps;
         };
 
+        const TILE_CACHE_SIZE = 512;
+        const LOCAL_HISTORY_LIMIT = 10000;
+
+        // Annotations live in a Map of per-image arrays held in a ref. An edit
+        // replaces only the edited image's array and bumps a version counter,
+        // so it costs O(boxes on that image) however many images were
+        // visited, and untouched arrays are shared between versions.
+        // Without the desktop bridge the store also keeps the undo/redo
+        // command stacks; in the desktop app Python's EditHistory is the
+        // source of truth and undo results are written back with setImage.
+        const useAnnotationStore = () => {
+          const mapRef = useRef(new Map());
+          const undoRef = useRef([]);
+          const redoRef = useRef([]);
+          const [version, setVersion] = useState(0);
+
+          const get = (image) => mapRef.current.get(image);
+
+          const setImage = (image, list) => {
+            mapRef.current.set(image, list);
+            setVersion(v => v + 1);
+          };
+
+          const load = (image, list) => {
+            if (!mapRef.current.has(image)) setImage(image, list);
+          };
+
+          const applyLocal = (image, op, annotation, index) => {
+            const list = mapRef.current.get(image) || [];
+            if (op === 'add') {
+              const next = list.slice();
+              next.splice(index ?? next.length, 0, annotation);
+              setImage(image, next);
+            } else {
+              setImage(image, list.filter(ann => ann.id !== annotation.id));
+            }
+          };
+
+          // op is 'add' or 'delete'; the command keeps the position so an
+          // undone delete puts the box back where it was drawn
+          const execute = (image, op, annotation) => {
+            const list = mapRef.current.get(image) || [];
+            const index = op === 'add' ? list.length : list.findIndex(ann => ann.id === annotation.id);
+            applyLocal(image, op, annotation, index);
+            undoRef.current.push({ image, op, annotation, index });
+            if (undoRef.current.length > LOCAL_HISTORY_LIMIT) undoRef.current.shift();
+            redoRef.current = [];
+          };
+
+          const undoLocal = () => {
+            const command = undoRef.current.pop();
+            if (!command) return;
+            applyLocal(command.image, command.op === 'add' ? 'delete' : 'add', command.annotation, command.index);
+            redoRef.current.push(command);
+          };
+
+          const redoLocal = () => {
+            const command = redoRef.current.pop();
+            if (!command) return;
+            applyLocal(command.image, command.op, command.annotation, command.index);
+            undoRef.current.push(command);
+          };
+
+          const clear = () => {
+            mapRef.current = new Map();
+            undoRef.current = [];
+            redoRef.current = [];
+            setVersion(v => v + 1);
+          };
+
+          // Dropped images are fetched again from Python when next visited
+          const forget = (images) => {
+            images.forEach(image => mapRef.current.delete(image));
+            setVersion(v => v + 1);
+          };
+
+          return {
+            version, get, load, setImage, execute, undoLocal, redoLocal, clear, forget,
+            toObject: () => Object.fromEntries(mapRef.current),
+            localHistory: () => ({ undo: undoRef.current.length, redo: redoRef.current.length })
+          };
+        };
+
+        // Shared so an image without annotations keeps a stable dependency
+        const EMPTY_ANNOTATIONS = [];
+
+        const newAnnotationId = () =>
+          Date.now().toString(36) + Math.random().toString(36).slice(2, 8);
+
         const ImageAnnotationTool = () => {
-          const [images, setImages] = useState([]);
+          const imageList = useImagePages();
           const [currentImageIndex, setCurrentImageIndex] = useState(0);
-          const [annotations, setAnnotations] = useState({});
+          const annotationStore = useAnnotationStore();
+          const [history, setHistory] = useState({ undo: 0, redo: 0 });
           const [currentTool, setCurrentTool] = useState('box');
-          const [isDrawing, setIsDrawing] = useState(false);
-          const [startPoint, setStartPoint] = useState(null);
-          const [currentAnnotation, setCurrentAnnotation] = useState(null);
           const [selectedLabel, setSelectedLabel] = useState('');
           const [labels, setLabels] = useState(['person', 'car', 'object']);
           const [newLabel, setNewLabel] = useState('');
+          const [exportFormat, setExportFormat] = useState('json');
           const [zoom, setZoom] = useState(1);
           const [pan, setPan] = useState({ x: 0, y: 0 });
           const [isPanning, setIsPanning] = useState(false);
           const [panStart, setPanStart] = useState({ x: 0, y: 0 });
+          const [visibleAnnotations, setVisibleAnnotations] = useState([]);
+          const [selectedAnnotationId, setSelectedAnnotationId] = useState(null);
+          const [trackFrames, setTrackFrames] = useState(100);
+          const [trackStart, setTrackStart] = useState(null);
+          const [interpolationMethod, setInterpolationMethod] = useState('linear');
+          const [sequenceStatus, setSequenceStatus] = useState('');
+          // Bumped once a write has reached the Python index, so the viewport
+          // query never races the add/delete it should reflect
+          const [spatialVersion, setSpatialVersion] = useState(0);
+          const bumpSpatial = () => setSpatialVersion(v => v + 1);
+          const afterWrite = () => {
+            bumpSpatial();
+            window.pywebview?.api.get_history().then(setHistory);
+          };
+          const reloadImage = (image) => window.pywebview.api.get_annotations(image).then(saved => {
+            annotationStore.setImage(image, saved);
+            bumpSpatial();
+          });
+          // A refused write (e.g. the image is leased to someone else on a
+          // shared server) is rolled back to what Python actually saved
+          const writeFailed = (image) => (error) => {
+            reloadImage(image);
+            alert(error.message);
+          };
           
+          const backgroundRef = useRef(null);
+          const annotationLayerRef = useRef(null);
           const canvasRef = useRef(null);
+          const scaledImageRef = useRef({ key: null, canvas: null });
+          // The box being drawn lives in a ref, not state, so dragging does
+          // not re-render the component on every mouse move
+          const draftRef = useRef(null);
+          const dirtyRectRef = useRef(null);
+          const rafRef = useRef(0);
+          const fps = useFrameRate();
+          const tileCacheRef = useRef(new Map());
+          const tileRedrawRef = useRef(0);
+          const drawBackgroundRef = useRef(null);
+          const [tileInfo, setTileInfo] = useState(null);
+          const [duplicates, setDuplicates] = useState(null);
           const imageRef = useRef(null);
           const fileInputRef = useRef(null);
+          const navigationStartRef = useRef(0);
+          const viewportRequestRef = useRef(0);
+
+          const currentImage = imageList.getImage(currentImageIndex);
+          // Desktop records carry a content ID so identical files share annotations
+          const imageKey = currentImage ? (currentImage.key || currentImage.name) : undefined;
+          const currentImageAnnotations = annotationStore.get(imageKey) || EMPTY_ANNOTATIONS;
+          const tiled = Boolean(currentImage?.tiled);
 
-          const currentImage = images[currentImageIndex];
-          const currentImageAnnotations = annotations[currentImage?.name] || [];
+          // Where annotation space sits on the unpanned, unzoomed canvas.
+          // Ordinary images are annotated in canvas units; tiled images in
+          // full-resolution pixels, placed fitted and centred like the image.
+          const imageTransform = () => {
+            if (!tiled) return { scale: 1, x: 0, y: 0 };
+            const scale = Math.min(800 / currentImage.width, 600 / currentImage.height);
+            return {
+              scale,
+              x: (800 / zoom - currentImage.width * scale) / 2,
+              y: (600 / zoom - currentImage.height * scale) / 2
+            };
+          };
+
+          const applyView = (ctx) => {
+            const t = imageTransform();
+            ctx.translate(pan.x, pan.y);
+            ctx.scale(zoom, zoom);
+            ctx.translate(t.x, t.y);
+            ctx.scale(t.scale, t.scale);
+            return zoom * t.scale;
+          };
+
+          const viewportRect = () => {
+            const t = imageTransform();
+            return [
+              (-pan.x / zoom - t.x) / t.scale,
+              (-pan.y / zoom - t.y) / t.scale,
+              ((800 - pan.x) / zoom - t.x) / t.scale,
+              ((600 - pan.y) / zoom - t.y) / t.scale
+            ];
+          };
+
+          useEffect(() => {
+            imageList.ensureRange(currentImageIndex, currentImageIndex + 1);
+          }, [currentImageIndex, imageList.total]);
 
           useEffect(() => {
-            drawCanvas();
-          }, [currentImageIndex, annotations, zoom, pan, currentAnnotation]);
+            // Start decoding the neighbours before the user asks for them
+            navigationStartRef.current = performance.now();
+            window.pywebview?.api.prefetch(currentImageIndex);
+          }, [currentImageIndex]);
+
+          const handleImageLoad = () => {
+            drawBackground();
+            window.pywebview?.api.report_display_time(performance.now() - navigationStartRef.current);
+          };
+
+          useEffect(() => {
+            // Saved annotations are loaded per image as it is visited
+            if (!window.pywebview || !currentImage || annotationStore.get(imageKey)) return;
+            const imageName = imageKey;
+            window.pywebview.api.get_annotations(imageName).then(saved => {
+              annotationStore.load(imageName, saved);
+            });
+          }, [imageKey]);
+
+          useEffect(() => {
+            setDuplicates(null);
+            if (!window.pywebview || !currentImage) return;
+            const imagePath = currentImage.path;
+            window.pywebview.api.find_duplicates(imagePath).then(found => {
+              setDuplicates({ ...found, path: imagePath });
+            });
+          }, [currentImage?.path]);
+
+          useEffect(() => {
+            // Only the boxes inside the visible canvas rectangle are drawn;
+            // the Python grid index answers the query without a full scan.
+            if (!window.pywebview || !currentImage) {
+              setVisibleAnnotations(currentImageAnnotations);
+              return;
+            }
+            const request = ++viewportRequestRef.current;
+            window.pywebview.api.query_viewport(imageKey, ...viewportRect())
+              .then(visible => {
+                if (request === viewportRequestRef.current) setVisibleAnnotations(visible);
+              });
+          }, [imageKey, currentImageAnnotations, spatialVersion, zoom, pan]);
+
+          useEffect(() => {
+            setSelectedAnnotationId(null);
+          }, [currentImage?.name]);
+
+          useEffect(() => {
+            // Building the pyramid of a new mosaic can take a while; tiles are
+            // only requested once it exists
+            setTileInfo(null);
+            if (!tiled || !window.pywebview) return;
+            const imagePath = currentImage.path;
+            window.pywebview.api.get_tile_info(imagePath).then(info => {
+              if (!info) return;
+              setTileInfo({ ...info, path: imagePath });
+              window.pywebview.api.report_display_time(performance.now() - navigationStartRef.current);
+            }, error => alert(error.message));
+          }, [currentImage?.path]);
+
+          useEffect(() => {
+            const started = performance.now();
+            drawBackground();
+            recordTiming('draw_background', started);
+          }, [currentImage?.name, tileInfo, zoom, pan]);
+
+          useEffect(() => {
+            const started = performance.now();
+            drawAnnotations();
+            recordTiming('draw_annotations', started);
+          }, [visibleAnnotations, selectedAnnotationId, zoom, pan]);
+
+          useEffect(() => {
+            scheduleInteraction();
+          }, [zoom, pan]);
+
+          const handleOpenFolder = async () => {
+            // Inside the desktop app images are streamed by the Python side,
+            // so only a URL per image ever reaches the webview.
+            if (!window.pywebview) {
+              fileInputRef.current?.click();
+              return;
+            }
+            const result = await window.pywebview.api.choose_directory();
+            if (!result) return;
+            imageList.reset(result.total);
+            annotationStore.clear();
+            setHistory(await window.pywebview.api.get_history());
+            setCurrentImageIndex(0);
+          };
+
+          useEffect(() => {
+            const server = window.ANNOTATION_SERVER;
+            if (!server) return;
+            // Served to several annotators (annotation_web.collab_server): the
+            // dataset is already open and other people's edits arrive as events
+            handleOpenFolder();
+            const onEvent = (e) => {
+              const event = JSON.parse(e.data);
+              if (event.type !== 'annotations' || event.client === server.client) return;
+              if (annotationStore.get(event.image)) reloadImage(event.image);
+            };
+            server.events.addEventListener('message', onEvent);
+            return () => server.events.removeEventListener('message', onEvent);
+          }, []);
 
           const handleFileUpload = (e) => {
             const files = Array.from(e.target.files);
             const imageFiles = files.filter(f => f.type.startsWith('image/'));
             
-            imageFiles.forEach(file => {
-              const reader = new FileReader();
-              reader.onload = (event) => {
-                setImages(prev => [...prev, { name: file.name, src: event.target.result }]);
-              };
-              reader.readAsDataURL(file);
-            });
+            imageList.appendLocal(
+              imageFiles.map(file => ({ name: file.name, src: URL.createObjectURL(file) }))
+            );
           };
 
-          const drawCanvas = () => {
-            const canvas = canvasRef.current;
+          // The canvas is three stacked layers: the image, the committed
+          // annotations and the box being drawn. Mouse moves only touch the
+          // interaction layer; the two below repaint when what they show changes.
+          const drawBackground = () => {
+            const canvas = backgroundRef.current;
             const image = imageRef.current;
-            if (!canvas || !image || !currentImage) return;
-
+            if (!canvas) return;
             const ctx = canvas.getContext('2d');
-            canvas.width = 800;
-            canvas.height = 600;
-
             ctx.clearRect(0, 0, canvas.width, canvas.height);
-            ctx.save();
-            
-            ctx.translate(pan.x, pan.y);
-            ctx.scale(zoom, zoom);
-            
-            const scale = Math.min(canvas.width / image.width, canvas.height / image.height);
-            const x = (canvas.width / zoom - image.width * scale) / 2;
-            const y = (canvas.height / zoom - image.height * scale) / 2;
-            
-            ctx.drawImage(image, x, y, image.width * scale, image.height * scale);
+            if (tiled) {
+              drawTiles(ctx);
+              return;
+            }
+            if (!image || !currentImage || !image.complete || !image.naturalWidth) return;
 
-            currentImageAnnotations.forEach((ann, idx) => {
-              ctx.strokeStyle = idx === currentImageAnnotations.length - 1 ? '#00ff00' : '#ff0000';
-              ctx.lineWidth = 2 / zoom;
-              ctx.fillStyle = 'rgba(255, 0, 0, 0.1)';
+            // Resampling a large frame is the expensive part, so the image is
+            // scaled once per zoom level and panning only blits the result
+            const scale = Math.min(canvas.width / image.naturalWidth, canvas.height / image.naturalHeight);
+            const key = `${image.src}|${zoom}`;
+            if (scaledImageRef.current.key !== key) {
+              const scaled = document.createElement('canvas');
+              scaled.width = Math.max(1, Math.round(image.naturalWidth * scale * zoom));
+              scaled.height = Math.max(1, Math.round(image.naturalHeight * scale * zoom));
+              scaled.getContext('2d').drawImage(image, 0, 0, scaled.width, scaled.height);
+              scaledImageRef.current = { key, canvas: scaled };
+            }
+            const x = (canvas.width / zoom - image.naturalWidth * scale) / 2;
+            const y = (canvas.height / zoom - image.naturalHeight * scale) / 2;
+            ctx.drawImage(scaledImageRef.current.canvas, pan.x + x * zoom, pan.y + y * zoom);
+          };
+
+          drawBackgroundRef.current = drawBackground;
+
+          const getTile = (url) => {
+            const cache = tileCacheRef.current;
+            let tile = cache.get(url);
+            if (tile) {
+              cache.delete(url);
+              cache.set(url, tile);
+              return tile;
+            }
+            tile = new Image();
+            // Tiles arrive in bursts; repaint at most once per frame
+            tile.onload = () => {
+              if (!tileRedrawRef.current) {
+                tileRedrawRef.current = requestAnimationFrame(() => {
+                  tileRedrawRef.current = 0;
+                  drawBackgroundRef.current?.();
+                });
+              }
+            };
+            tile.src = url;
+            cache.set(url, tile);
+            if (cache.size > TILE_CACHE_SIZE) cache.delete(cache.keys().next().value);
+            return tile;
+          };
+
+          const drawTiles = (ctx) => {
+            const info = tileInfo;
+            if (!info || info.path !== currentImage.path) return;
+            const t = imageTransform();
+            const pixel = zoom * t.scale;
+            const toScreenX = (ix) => pan.x + zoom * (t.x + t.scale * ix);
+            const toScreenY = (iy) => pan.y + zoom * (t.y + t.scale * iy);
 
-              if (ann.type === 'box') {
-                ctx.fillRect(ann.x, ann.y, ann.width, ann.height);
-                ctx.strokeRect(ann.x, ann.y, ann.width, ann.height);
-              } else if (ann.type === 'circle') {
-                ctx.beginPath();
-                ctx.arc(ann.x + ann.width / 2, ann.y + ann.height / 2, Math.max(Math.abs(ann.width), Math.abs(ann.height)) / 2, 0, 2 * Math.PI);
-                ctx.fill();
-                ctx.stroke();
+            const drawTile = (level, tx, ty) => {
+              const tile = getTile(`${currentImage.tiles}?level=${level}&x=${tx}&y=${ty}`);
+              if (!tile.complete || !tile.naturalWidth) return;
+              const span = info.tile_size * 2 ** level;
+              // Round outwards so neighbouring tiles meet without seams
+              const x0 = Math.floor(toScreenX(tx * span));
+              const y0 = Math.floor(toScreenY(ty * span));
+              const x1 = Math.ceil(toScreenX(tx * span + tile.naturalWidth * 2 ** level));
+              const y1 = Math.ceil(toScreenY(ty * span + tile.naturalHeight * 2 ** level));
+              ctx.drawImage(tile, x0, y0, x1 - x0, y1 - y0);
+            };
+
+            // The coarsest level is one tile; it fills in while detail loads
+            drawTile(info.levels - 1, 0, 0);
+            const level = Math.max(0, Math.min(info.levels - 1, Math.floor(Math.log2(1 / pixel))));
+            const span = info.tile_size * 2 ** level;
+            const [ix0, iy0, ix1, iy1] = viewportRect();
+            const tx0 = Math.max(0, Math.floor(ix0 / span));
+            const ty0 = Math.max(0, Math.floor(iy0 / span));
+            const tx1 = Math.min(Math.ceil(info.width / span) - 1, Math.floor(ix1 / span));
+            const ty1 = Math.min(Math.ceil(info.height / span) - 1, Math.floor(iy1 / span));
+            for (let ty = ty0; ty <= ty1; ty++) {
+              for (let tx = tx0; tx <= tx1; tx++) {
+                if (level !== info.levels - 1) drawTile(level, tx, ty);
               }
+            }
+          };
+
+          const drawAnnotations = () => {
+            const canvas = annotationLayerRef.current;
+            if (!canvas) return;
+            const ctx = canvas.getContext('2d');
+            ctx.clearRect(0, 0, canvas.width, canvas.height);
+            ctx.save();
+            const pixel = applyView(ctx);
+            ctx.lineWidth = 2 / pixel;
+            ctx.font = `${14 / pixel}px Arial`;
 
+            const lastId = currentImageAnnotations[currentImageAnnotations.length - 1]?.id;
+            visibleAnnotations.forEach((ann) => {
+              ctx.strokeStyle = ann.id === selectedAnnotationId ? '#ffff00' : ann.id === lastId ? '#00ff00' : '#ff0000';
+              ctx.fillStyle = 'rgba(255, 0, 0, 0.1)';
+              // Tracked, interpolated and predicted boxes await review
+              ctx.setLineDash(ann.verified === false ? [6 / pixel, 4 / pixel] : []);
+              drawShape(ctx, ann);
               ctx.fillStyle = '#ff0000';
-              ctx.font = `${14 / zoom}px Arial`;
-              ctx.fillText(ann.label, ann.x, ann.y - 5 / zoom);
+              ctx.fillText(ann.label, ann.x, ann.y - 5 / pixel);
             });
+            ctx.restore();
+          };
 
-            if (currentAnnotation) {
-              ctx.strokeStyle = '#00ff00';
-              ctx.lineWidth = 2 / zoom;
-              ctx.fillStyle = 'rgba(0, 255, 0, 0.1)';
-
-              if (currentTool === 'box') {
-                ctx.fillRect(currentAnnotation.x, currentAnnotation.y, currentAnnotation.width, currentAnnotation.height);
-                ctx.strokeRect(currentAnnotation.x, currentAnnotation.y, currentAnnotation.width, currentAnnotation.height);
-              } else if (currentTool === 'circle') {
-                ctx.beginPath();
-                ctx.arc(
-                  currentAnnotation.x + currentAnnotation.width / 2,
-                  currentAnnotation.y + currentAnnotation.height / 2,
-                  Math.max(Math.abs(currentAnnotation.width), Math.abs(currentAnnotation.height)) / 2,
-                  0, 2 * Math.PI
-                );
-                ctx.fill();
-                ctx.stroke();
-              }
+          const drawInteraction = () => {
+            rafRef.current = 0;
+            const canvas = canvasRef.current;
+            if (!canvas) return;
+            const ctx = canvas.getContext('2d');
+            const dirty = dirtyRectRef.current;
+            if (dirty) {
+              ctx.clearRect(dirty.x, dirty.y, dirty.width, dirty.height);
+              dirtyRectRef.current = null;
             }
+            const draft = draftRef.current?.annotation;
+            if (!draft) return;
 
+            ctx.save();
+            const pixel = applyView(ctx);
+            ctx.strokeStyle = '#00ff00';
+            ctx.lineWidth = 2 / pixel;
+            ctx.fillStyle = 'rgba(0, 255, 0, 0.1)';
+            drawShape(ctx, draft);
             ctx.restore();
+
+            // Remember the screen area touched (plus the stroke) for the next clear
+            const radius = draft.type === 'circle' ? Math.max(draft.width, draft.height) / 2 : 0;
+            const cx = draft.x + draft.width / 2;
+            const cy = draft.y + draft.height / 2;
+            const halfW = Math.max(draft.width / 2, radius);
+            const halfH = Math.max(draft.height / 2, radius);
+            const t = imageTransform();
+            dirtyRectRef.current = {
+              x: Math.floor(pan.x + (t.x + (cx - halfW) * t.scale) * zoom) - 3,
+              y: Math.floor(pan.y + (t.y + (cy - halfH) * t.scale) * zoom) - 3,
+              width: Math.ceil(halfW * 2 * pixel) + 6,
+              height: Math.ceil(halfH * 2 * pixel) + 6
+            };
+          };
+
+          const scheduleInteraction = () => {
+            if (!rafRef.current) rafRef.current = requestAnimationFrame(drawInteraction);
           };
 
           const getCanvasCoordinates = (e) => {
             const canvas = canvasRef.current;
             const rect = canvas.getBoundingClientRect();
-            const x = ((e.clientX - rect.left - pan.x) / zoom);
-            const y = ((e.clientY - rect.top - pan.y) / zoom);
+            const t = imageTransform();
+            const x = ((e.clientX - rect.left - pan.x) / zoom - t.x) / t.scale;
+            const y = ((e.clientY - rect.top - pan.y) / zoom - t.y) / t.scale;
             return { x, y };
           };
 
+          const selectAnnotationAt = async (point) => {
+            if (!currentImage) return;
+            if (window.pywebview) {
+              const hit = await window.pywebview.api.pick_annotation(imageKey, point.x, point.y);
+              setSelectedAnnotationId(hit ? hit.id : null);
+              return;
+            }
+            // Browser mode: later annotations are drawn on top, so search backwards
+            const hit = [...currentImageAnnotations].reverse().find(ann =>
+              point.x >= Math.min(ann.x, ann.x + ann.width) && point.x <= Math.max(ann.x, ann.x + ann.width) &&
+              point.y >= Math.min(ann.y, ann.y + ann.height) && point.y <= Math.max(ann.y, ann.y + ann.height));
+            setSelectedAnnotationId(hit ? hit.id : null);
+          };
+
           const handleMouseDown = (e) => {
             if (currentTool === 'pan') {
               setIsPanning(true);
@@ -151,15 +648,57 @@ HTML_CONTENT = '''
               return;
             }
 
+            if (currentTool === 'select') {
+              selectAnnotationAt(getCanvasCoordinates(e));
+              return;
+            }
+
             if (!selectedLabel) {
               alert('Please select a label first');
               return;
             }
 
             const point = getCanvasCoordinates(e);
-            setIsDrawing(true);
-            setStartPoint(point);
-            setCurrentAnnotation({ x: point.x, y: point.y, width: 0, height: 0, type: currentTool, label: selectedLabel });
+            if (currentTool === 'polygon') {
+              addPolygonPoint(point);
+              return;
+            }
+            draftRef.current = {
+              start: point,
+              annotation: { x: point.x, y: point.y, width: 0, height: 0, type: currentTool, label: selectedLabel }
+            };
+          };
+
+          // Each click adds a vertex; clicking near the first one closes the shape
+          const addPolygonPoint = (point) => {
+            const draft = draftRef.current;
+            if (!draft?.points) {
+              draftRef.current = { points: [[point.x, point.y]], annotation: polygonAnnotation([[point.x, point.y]], selectedLabel) };
+              scheduleInteraction();
+              return;
+            }
+            const [fx, fy] = draft.points[0];
+            const snap = 10 / (zoom * imageTransform().scale);
+            if (draft.points.length >= 3 && Math.hypot(point.x - fx, point.y - fy) < snap) {
+              saveDraft(polygonAnnotation(draft.points, selectedLabel));
+              return;
+            }
+            draft.points.push([point.x, point.y]);
+            draft.annotation = polygonAnnotation(draft.points, selectedLabel);
+            scheduleInteraction();
+          };
+
+          const saveDraft = (currentAnnotation) => {
+            const imageName = imageKey;
+            // zoom is kept so exporters can map the box back to image pixels;
+            // boxes on tiled images are already in pixels
+            const annotation = tiled
+              ? { ...currentAnnotation, id: newAnnotationId(), space: 'image' }
+              : { ...currentAnnotation, id: newAnnotationId(), zoom };
+            annotationStore.execute(imageName, 'add', annotation);
+            window.pywebview?.api.add_annotation(imageName, annotation).then(afterWrite, writeFailed(imageName));
+            draftRef.current = null;
+            scheduleInteraction();
           };
 
           const handleMouseMove = (e) => {
@@ -168,17 +707,25 @@ HTML_CONTENT = '''
               return;
             }
 
-            if (!isDrawing || !startPoint) return;
+            const draft = draftRef.current;
+            if (!draft) return;
 
             const point = getCanvasCoordinates(e);
-            setCurrentAnnotation({
-              x: Math.min(startPoint.x, point.x),
-              y: Math.min(startPoint.y, point.y),
-              width: Math.abs(point.x - startPoint.x),
-              height: Math.abs(point.y - startPoint.y),
+            if (draft.points) {
+              // The edge to the cursor previews where the next vertex goes
+              draft.annotation = polygonAnnotation([...draft.points, [point.x, point.y]], selectedLabel);
+              scheduleInteraction();
+              return;
+            }
+            draft.annotation = {
+              x: Math.min(draft.start.x, point.x),
+              y: Math.min(draft.start.y, point.y),
+              width: Math.abs(point.x - draft.start.x),
+              height: Math.abs(point.y - draft.start.y),
               type: currentTool,
               label: selectedLabel
-            });
+            };
+            scheduleInteraction();
           };
 
           const handleMouseUp = () => {
@@ -187,27 +734,121 @@ HTML_CONTENT = '''
               return;
             }
 
-            if (isDrawing && currentAnnotation && currentAnnotation.width > 5 && currentAnnotation.height > 5) {
-              const imageName = currentImage.name;
-              setAnnotations(prev => ({
-                ...prev,
-                [imageName]: [...(prev[imageName] || []), currentAnnotation]
-              }));
+            if (draftRef.current?.points) return;
+            const currentAnnotation = draftRef.current?.annotation;
+            const minSize = 5 / imageTransform().scale;
+            if (currentAnnotation && currentAnnotation.width > minSize && currentAnnotation.height > minSize) {
+              saveDraft(currentAnnotation);
+              return;
             }
-            setIsDrawing(false);
-            setStartPoint(null);
-            setCurrentAnnotation(null);
+            draftRef.current = null;
+            scheduleInteraction();
           };
 
+          useEffect(() => {
+            // An unfinished polygon is dropped when the tool or image changes
+            draftRef.current = null;
+            scheduleInteraction();
+          }, [currentTool, imageKey]);
+
           const deleteLastAnnotation = () => {
             if (currentImageAnnotations.length === 0) return;
-            const imageName = currentImage.name;
-            setAnnotations(prev => ({
-              ...prev,
-              [imageName]: prev[imageName].slice(0, -1)
-            }));
+            const imageName = imageKey;
+            const last = currentImageAnnotations[currentImageAnnotations.length - 1];
+            annotationStore.execute(imageName, 'delete', last);
+            window.pywebview?.api.delete_annotation(imageName, last.id).then(afterWrite, writeFailed(imageName));
+          };
+
+          const deleteSelectedAnnotation = () => {
+            if (!selectedAnnotationId || !currentImage) return;
+            const imageName = imageKey;
+            const selected = currentImageAnnotations.find(ann => ann.id === selectedAnnotationId);
+            if (!selected) return;
+            annotationStore.execute(imageName, 'delete', selected);
+            window.pywebview?.api.delete_annotation(imageName, selectedAnnotationId).then(afterWrite, writeFailed(imageName));
+            setSelectedAnnotationId(null);
+          };
+
+          // Tracking and interpolation write boxes on many frames at once:
+          // the current frame is reloaded and the rest refetched when visited
+          const applySequenceResult = (result, changed) => {
+            annotationStore.forget(changed.filter(image => image !== imageKey));
+            reloadImage(imageKey);
+            afterWrite();
+          };
+
+          const sequenceFailed = (error) => {
+            setSequenceStatus('');
+            alert(error.message);
+          };
+
+          const trackForward = () => {
+            if (!window.pywebview || !currentImage) return;
+            const ids = selectedAnnotationId ? [selectedAnnotationId] : null;
+            setSequenceStatus('Tracking...');
+            window.pywebview.api.track_boxes(imageKey, ids, trackFrames).then(result => {
+              if (!result) return setSequenceStatus('');
+              applySequenceResult(result, result.images);
+              setSequenceStatus(`Tracked ${result.tracks} box(es) over ${result.frames} frame(s) at ${result.fps} fps`);
+            }, sequenceFailed);
+          };
+
+          const markTrackStart = () => {
+            if (!selectedAnnotationId) return;
+            setTrackStart({ image: imageKey, id: selectedAnnotationId, name: currentImage.name });
+          };
+
+          const interpolateToHere = () => {
+            if (!trackStart || !selectedAnnotationId) return;
+            window.pywebview.api.interpolate_boxes(
+              trackStart.image, trackStart.id, imageKey, selectedAnnotationId, interpolationMethod
+            ).then(result => {
+              if (!result) return;
+              applySequenceResult(result, [...result.images, trackStart.image]);
+              setSequenceStatus(`Interpolated ${result.frames} frame(s) between ${result.keyframes} keyframes`);
+            }, sequenceFailed);
+          };
+
+          const applyHistoryResult = (result) => {
+            if (!result) return;
+            annotationStore.setImage(result.image, result.annotations);
+            setHistory(result.history);
+            bumpSpatial();
+          };
+
+          const undo = () => {
+            if (window.pywebview) window.pywebview.api.undo().then(applyHistoryResult);
+            else annotationStore.undoLocal();
+          };
+
+          const redo = () => {
+            if (window.pywebview) window.pywebview.api.redo().then(applyHistoryResult);
+            else annotationStore.redoLocal();
           };
 
+          useEffect(() => {
+            const onKeyDown = (e) => {
+              if (e.key === 'Escape' && draftRef.current) {
+                draftRef.current = null;
+                scheduleInteraction();
+                return;
+              }
+              if (!(e.ctrlKey || e.metaKey) || ['INPUT', 'SELECT', 'TEXTAREA'].includes(e.target.tagName)) return;
+              const key = e.key.toLowerCase();
+              if (key === 'z' && !e.shiftKey) {
+                e.preventDefault();
+                undo();
+              } else if (key === 'y' || (key === 'z' && e.shiftKey)) {
+                e.preventDefault();
+                redo();
+              }
+            };
+            window.addEventListener('keydown', onKeyDown);
+            return () => window.removeEventListener('keydown', onKeyDown);
+          });
+
+          const historyCounts = window.pywebview ? history : annotationStore.localHistory();
+
           const addLabel = () => {
             if (newLabel && !labels.includes(newLabel)) {
               setLabels([...labels, newLabel]);
@@ -215,8 +856,15 @@ HTML_CONTENT = '''
             }
           };
 
-          const exportAnnotations = () => {
-            const data = JSON.stringify(annotations, null, 2);
+          const exportAnnotations = async () => {
+            if (exportFormat !== 'json') {
+              const counts = await window.pywebview.api.export_dataset(exportFormat);
+              if (counts) alert(`Exported ${counts.annotations} annotations on ${counts.images} images`);
+              return;
+            }
+            // Only visited images are loaded into React; the journal has them all
+            const saved = window.pywebview ? await window.pywebview.api.get_all_annotations() : annotationStore.toObject();
+            const data = JSON.stringify(saved, null, 2);
             const blob = new Blob([data], { type: 'application/json' });
             const url = URL.createObjectURL(blob);
             const a = document.createElement('a');
@@ -239,10 +887,10 @@ HTML_CONTENT = '''
                     <div className="bg-gray-800 rounded-lg p-4 mb-4">
                       <div className="flex flex-wrap gap-2 mb-4">
                         <button
-                          onClick={() => fileInputRef.current?.click()}
+                          onClick={handleOpenFolder}
                           className="flex items-center gap-2 px-4 py-2 bg-blue-600 hover:bg-blue-700 rounded"
                         >
-                          <Upload /> Upload Images
+                          <Upload /> Open Images
                         </button>
                         <input
                           ref={fileInputRef}
@@ -266,6 +914,14 @@ HTML_CONTENT = '''
                         >
                           <Circle /> Circle
                         </button>
+
+                        <button
+                          onClick={() => setCurrentTool('polygon')}
+                          title="Click to add vertices, click the first vertex to close, Esc to cancel"
+                          className={`flex items-center gap-2 px-4 py-2 rounded ${currentTool === 'polygon' ? 'bg-green-600' : 'bg-gray-700 hover:bg-gray-600'}`}
+                        >
+                          <Polygon /> Polygon
+                        </button>
                         
                         <button
                           onClick={() => setCurrentTool('pan')}
@@ -273,6 +929,13 @@ HTML_CONTENT = '''
                         >
                           <Move /> Pan
                         </button>
+
+                        <button
+                          onClick={() => setCurrentTool('select')}
+                          className={`flex items-center gap-2 px-4 py-2 rounded ${currentTool === 'select' ? 'bg-green-600' : 'bg-gray-700 hover:bg-gray-600'}`}
+                        >
+                          <Pointer /> Select
+                        </button>
                         
                         <button
                           onClick={() => handleZoom(0.1)}
@@ -294,36 +957,85 @@ HTML_CONTENT = '''
                         >
                           <Trash2 /> Delete Last
                         </button>
+
+                        <button
+                          onClick={undo}
+                          disabled={historyCounts.undo === 0}
+                          title="Undo (Ctrl+Z)"
+                          className="flex items-center gap-2 px-4 py-2 bg-gray-700 hover:bg-gray-600 rounded disabled:opacity-50"
+                        >
+                          Undo
+                        </button>
+
+                        <button
+                          onClick={redo}
+                          disabled={historyCounts.redo === 0}
+                          title="Redo (Ctrl+Shift+Z)"
+                          className="flex items-center gap-2 px-4 py-2 bg-gray-700 hover:bg-gray-600 rounded disabled:opacity-50"
+                        >
+                          Redo
+                        </button>
+
+                        <button
+                          onClick={deleteSelectedAnnotation}
+                          disabled={!selectedAnnotationId}
+                          className="flex items-center gap-2 px-4 py-2 bg-red-600 hover:bg-red-700 rounded disabled:opacity-50"
+                        >
+                          <Trash2 /> Delete Selected
+                        </button>
                         
+                        {window.pywebview && (
+                          <select
+                            value={exportFormat}
+                            onChange={(e) => setExportFormat(e.target.value)}
+                            className="px-2 py-2 bg-gray-700 rounded"
+                          >
+                            <option value="json">JSON</option>
+                            <option value="coco">COCO</option>
+                            <option value="yolo">YOLO</option>
+                            <option value="voc">Pascal VOC</option>
+                          </select>
+                        )}
                         <button
                           onClick={exportAnnotations}
                           className="flex items-center gap-2 px-4 py-2 bg-purple-600 hover:bg-purple-700 rounded"
                         >
-                          <Download /> Export JSON
+                          <Download /> Export {exportFormat.toUpperCase()}
                         </button>
                       </div>
 
                       {currentImage && (
                         <>
-                          <img
-                            ref={imageRef}
-                            src={currentImage.src}
-                            alt="annotation"
-                            className="hidden"
-                            onLoad={drawCanvas}
-                          />
-                          <canvas
-                            ref={canvasRef}
-                            width={800}
-                            height={600}
-                            onMouseDown={handleMouseDown}
-                            onMouseMove={handleMouseMove}
-                            onMouseUp={handleMouseUp}
-                            onMouseLeave={handleMouseUp}
-                            className="w-full border-2 border-gray-700 rounded cursor-crosshair bg-gray-900"
-                          />
+                          {!tiled && (
+                            <img
+                              ref={imageRef}
+                              src={currentImage.display || currentImage.src}
+                              alt="annotation"
+                              className="hidden"
+                              onLoad={handleImageLoad}
+                            />
+                          )}
+                          <div className="relative border-2 border-gray-700 rounded bg-gray-900">
+                            <canvas ref={backgroundRef} width={800} height={600} className="block w-full" />
+                            <canvas ref={annotationLayerRef} width={800} height={600} className="absolute inset-0 w-full h-full pointer-events-none" />
+                            <canvas
+                              ref={canvasRef}
+                              width={800}
+                              height={600}
+                              onMouseDown={handleMouseDown}
+                              onMouseMove={handleMouseMove}
+                              onMouseUp={handleMouseUp}
+                              onMouseLeave={handleMouseUp}
+                              className="absolute inset-0 w-full h-full cursor-crosshair"
+                            />
+                          </div>
                           <div className="mt-2 text-sm text-gray-400">
-                            Zoom: {(zoom * 100).toFixed(0)}% | Annotations: {currentImageAnnotations.length}
+                            Zoom: {(zoom * 100).toFixed(0)}% | Annotations: {currentImageAnnotations.length} | FPS: {fps}
+                            {tiled && (tileInfo ? ` | Tiled ${currentImage.width}x${currentImage.height}` : ' | Building tile pyramid...')}
+                            {duplicates?.path === currentImage.path && duplicates.exact.length > 0 &&
+                              ` | Shared with ${duplicates.exact.length} identical file(s)`}
+                            {duplicates?.path === currentImage.path && duplicates.near.length > 0 &&
+                              ` | ${duplicates.near.length} near-duplicate(s)`}
                           </div>
                         </>
                       )}
@@ -336,19 +1048,12 @@ HTML_CONTENT = '''
                     </div>
 
                     <div className="bg-gray-800 rounded-lg p-4">
-                      <h3 className="font-semibold mb-2">Images ({images.length})</h3>
-                      <div className="flex gap-2 overflow-x-auto">
-                        {images.map((img, idx) => (
-                          <div
-                            key={idx}
-                            onClick={() => setCurrentImageIndex(idx)}
-                            className={`cursor-pointer border-2 rounded p-1 flex-shrink-0 ${idx === currentImageIndex ? 'border-blue-500' : 'border-gray-700'}`}
-                          >
-                            <img src={img.src} alt={img.name} className="w-20 h-20 object-cover" />
-                            <div className="text-xs truncate w-20 mt-1">{img.name}</div>
-                          </div>
-                        ))}
-                      </div>
+                      <h3 className="font-semibold mb-2">Images ({imageList.total})</h3>
+                      <Filmstrip
+                        imageList={imageList}
+                        currentIndex={currentImageIndex}
+                        onSelect={setCurrentImageIndex}
+                      />
                     </div>
                   </div>
 
@@ -387,6 +1092,57 @@ HTML_CONTENT = '''
                       </div>
                     </div>
 
+                    {window.pywebview && currentImage && (
+                      <div className="bg-gray-800 rounded-lg p-4 mb-4">
+                        <h3 className="font-semibold mb-2">Sequence</h3>
+                        <div className="flex gap-2 mb-2">
+                          <button
+                            onClick={trackForward}
+                            title="Follow the selected box, or every box, through the next frames"
+                            className="flex-1 px-3 py-2 bg-blue-600 hover:bg-blue-700 rounded"
+                          >
+                            Track {selectedAnnotationId ? 'Selected' : 'All'} →
+                          </button>
+                          <input
+                            type="number"
+                            min="1"
+                            value={trackFrames}
+                            onChange={(e) => setTrackFrames(Math.max(1, parseInt(e.target.value) || 1))}
+                            title="Frames to track"
+                            className="w-20 px-2 py-2 bg-gray-700 rounded text-white"
+                          />
+                        </div>
+                        <div className="flex gap-2 mb-2">
+                          <button
+                            onClick={markTrackStart}
+                            disabled={!selectedAnnotationId}
+                            className="flex-1 px-3 py-2 bg-gray-700 hover:bg-gray-600 rounded disabled:opacity-50"
+                          >
+                            Mark Start
+                          </button>
+                          <button
+                            onClick={interpolateToHere}
+                            disabled={!trackStart || !selectedAnnotationId}
+                            className="flex-1 px-3 py-2 bg-gray-700 hover:bg-gray-600 rounded disabled:opacity-50"
+                          >
+                            Interpolate to Here
+                          </button>
+                          <select
+                            value={interpolationMethod}
+                            onChange={(e) => setInterpolationMethod(e.target.value)}
+                            className="px-2 py-2 bg-gray-700 rounded"
+                          >
+                            <option value="linear">Linear</option>
+                            <option value="spline">Spline</option>
+                          </select>
+                        </div>
+                        <div className="text-sm text-gray-400">
+                          {trackStart ? `Start: ${trackStart.name}` : 'Select a box and mark it as the start'}
+                          {sequenceStatus && <div>{sequenceStatus}</div>}
+                        </div>
+                      </div>
+                    )}
+
                     <div className="bg-gray-800 rounded-lg p-4">
                       <h3 className="font-semibold mb-2">Current Annotations</h3>
                       <div className="space-y-2 max-h-96 overflow-y-auto">
@@ -395,6 +1151,7 @@ HTML_CONTENT = '''
                             <div className="font-semibold">{ann.label}</div>
                             <div className="text-gray-400">
                               {ann.type} | {Math.round(ann.width)}×{Math.round(ann.height)}
+                              {ann.source && ` | ${ann.source}`}
                             </div>
                           </div>
                         ))}
@@ -411,23 +1168,41 @@ HTML_CONTENT = '''
         };
 
         ReactDOM.render(<ImageAnnotationTool />, document.getElementById('root'));
+
+        // Tell the backend the first render has committed (startup benchmarks)
+        announceReady();
     </script>
 </body>
 </html>
 '''
 
-def main():
-    # Create a window with the HTML content
+class API(DatasetAPI):
+    """Backend API exposed to the annotation UI through js_api"""
+
+def main(argv=None):
+    args = collab_server.parse_args('Image Annotation Tool', argv)
+    if args.serve:
+        return collab_server.serve(API, HTML_CONTENT, args)
+
+    # Imported here so the backend modules stay usable without a GUI
+    import webview
+
+    api = API()
+
+    # Create a window with the bundled frontend, or the HTML content if unbuilt
     window = webview.create_window(
         'Image Annotation Tool',
-        html=HTML_CONTENT,
+        js_api=api,
+        **window_source('annotation_app', HTML_CONTENT, api._server),
         width=1400,
         height=900,
         resizable=True,
         fullscreen=False
     )
+    api._window = window
     
     webview.start()
+    api._shutdown()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
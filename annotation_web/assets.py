@@ -0,0 +1,42 @@
+"""Locate the precompiled frontend and tell webview where to load it from.
+
+When annotation_web/frontend/dist/ has been built, each app's page, its
+minified JS, purged CSS and vendored React are served from the local image
+server, so startup needs no network and no in-webview Babel pass. Without a
+build, or with ANNOTATION_FRONTEND=cdn, the embedded HTML_CONTENT is used as
+before.
+
+Code both apps share lives once in frontend/shared.jsx. Each HTML_CONTENT
+marks where it goes with SHARED_TAG; inline_shared() fills that in for the
+embedded pages, and the build compiles it to dist/shared.js, which every
+bundled page loads before its own script.
+"""
+import os
+
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'frontend')
+DIST_DIR = os.path.join(FRONTEND_DIR, 'dist')
+SHARED_JSX = os.path.join(FRONTEND_DIR, 'shared.jsx')
+SHARED_TAG = '<script type="text/babel" data-shared></script>'
+
+
+def _serve_dist(relpath, query):
+    full = os.path.realpath(os.path.join(DIST_DIR, relpath))
+    if os.path.commonpath([full, DIST_DIR]) != DIST_DIR or not os.path.isfile(full):
+        return None
+    return full
+
+
+def inline_shared(html):
+    """Return html with SHARED_TAG replaced by the contents of shared.jsx"""
+    with open(SHARED_JSX, encoding='utf-8') as f:
+        script = '<script type="text/babel" data-shared>\n%s</script>' % f.read()
+    return html.replace(SHARED_TAG, script, 1)
+
+
+def window_source(name, html, image_server):
+    """Return create_window keyword arguments for the app bundle called name"""
+    page = os.path.join(DIST_DIR, name + '.html')
+    if os.environ.get('ANNOTATION_FRONTEND') == 'cdn' or not os.path.exists(page):
+        return {'html': inline_shared(html)}
+    image_server.add_route('app', _serve_dist)
+    return {'url': '%s/app/%s.html' % (image_server.base_url, name)}
@@ -0,0 +1,856 @@
+"""js_api methods shared by the annotation tool and the dataset checker."""
+import json
+import os
+import threading
+import time
+
+from annotation_web.dataset_index import DatasetIndex
+from annotation_web.dedup import (
+    DEFAULT_RADIUS, build_tree, exact_duplicates, hash_images, near_duplicates,
+)
+from annotation_web.folder_labels import infer_labels
+from annotation_web.history import EditHistory
+from annotation_web.exporters import (
+    annotation_records, canvas_to_pixels, classification_records, export, index_size_lookup,
+    pixels_to_canvas,
+)
+from annotation_web.image_server import ImageServer
+from annotation_web.instrumentation import (
+    RECORDER, SamplingProfiler, instrument_methods, record_ready,
+)
+from annotation_web.journal import AnnotationJournal, project_dir
+from annotation_web.label_stats import LabelStats
+from annotation_web.model import normalize_annotation
+from annotation_web.prelabel import (
+    BATCH_SIZE, PredictionCache, Prelabeler, load_model, prediction_events,
+)
+from annotation_web.prefetch import Prefetcher
+from annotation_web.review_queue import (
+    BoxCountStats, ReviewQueue, review_priority, review_signals,
+)
+from annotation_web.spatial_index import GridIndex
+from annotation_web.validation import validate_annotation
+from annotation_web.thumbnails import ThumbnailService
+from annotation_web.tiles import TileService, level_count, needs_tiling
+from annotation_web import tracking
+from annotation_web.video import split_frame_path
+
+
+@instrument_methods
+class DatasetAPI:
+    """Dataset-facing part of the js_api bridge
+
+    Each app subclasses this as its own API class; the webview window is
+    attached after creation so folder dialogs can be opened from the UI.
+    Every public method, including those a subclass adds, is timed under
+    api.<name> by annotation_web.instrumentation.
+    """
+
+    # The annotation tool keys boxes by content ID, so it needs hashes as soon
+    # as a folder opens; apps that only label by path can hash lazily
+    hash_on_open = True
+
+    def __init__(self, image_server=None):
+        self._server = image_server or ImageServer().start()
+        self._thumbnails = ThumbnailService(self._server, content_key=self._thumbnail_key)
+        self._prefetcher = Prefetcher(self._server)
+        self._tiles = TileService(self._server)
+        # Lets the shared server hand out the labels export as a download
+        self._server.add_route('labels', self._serve_labels)
+        self._index = None
+        self._journal = None
+        self._history = None
+        self._stats = None
+        self._spatial = {}
+        self._dup_tree = None
+        self._inferred = {}
+        self._review = None
+        self._review_mode = None
+        self._review_keys = {}
+        self._box_stats = None
+        self._prelabeler = None
+        self._prelabel_thread = None
+        self._prelabel_error = None
+        self._profiler = SamplingProfiler()
+        self._window = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        instrument_methods(cls)
+
+    def choose_directory(self):
+        """Ask for a dataset folder and open it"""
+        import webview
+
+        result = self._window.create_file_dialog(webview.FOLDER_DIALOG)
+        if not result:
+            return None
+        return self.open_directory(result[0])
+
+    def open_directory(self, path):
+        """Index the folder at path and return the scan summary"""
+        self._shutdown()
+        self._index = DatasetIndex(path)
+        summary = self._index.scan()
+        if self.hash_on_open:
+            summary['hashed'] = hash_images(self._index, workers=8, processes=False)
+        self._journal = AnnotationJournal(project_dir(self._index.root))
+        self._history = EditHistory(self._journal.directory)
+        self._rekey_annotations()
+        paths = self._index.paths()
+        # Folder names and sidecar files give every image a provisional,
+        # unverified label; labels saved in the journal take precedence
+        self._inferred = infer_labels(paths, self._index.root)
+        labels = {path: {'label': label, 'verified': False}
+                  for path, label in self._inferred.items()}
+        labels.update(self._journal.labels())
+        self._stats = LabelStats(paths)
+        self._stats.load_labels(labels)
+        for image, anns in self._journal.all_annotations().items():
+            for ann in anns:
+                self._stats.add_box(image, ann)
+        self._server.set_root(self._index.root)
+        return {'summary': summary, 'total': summary['total']}
+
+    def _rekey_annotations(self):
+        """Move annotations saved under a file name onto the file's content ID"""
+        annotated = self._journal.all_annotations()
+        if not annotated:
+            return
+        content_ids = self._index.content_ids()
+        stale = {key: anns for key, anns in annotated.items() if key not in content_ids}
+        if not stale:
+            return
+        by_name = {}
+        for path in self._index.paths():
+            by_name.setdefault(os.path.basename(path), []).append(path)
+        for key, anns in stale.items():
+            row = self._index.get(key)
+            if row is None and len(by_name.get(key, ())) == 1:
+                row = self._index.get(by_name[key][0])
+            if row is None or not row['content_id']:
+                continue
+            for ann in anns:
+                self._journal.append({'op': 'add', 'image': row['content_id'], 'annotation': ann})
+                self._journal.append({'op': 'delete', 'image': key, 'id': ann['id']})
+
+    def list_images(self, offset=0, limit=100, filter=None):
+        """Return one window of image records for the virtualized lists"""
+        if self._index is None:
+            return {'total': 0, 'offset': offset, 'images': []}
+        limit = max(0, min(int(limit), 1000))
+        rows = self._index.list_images(int(offset), limit, filter)
+        return {
+            'total': self._index.count(filter),
+            'offset': offset,
+            'images': [self._image_record(row) for row in rows],
+        }
+
+    def mark_ready(self):
+        """Called by the frontend once its first render has committed
+
+        With ANNOTATION_EXIT_WHEN_READY set the window closes immediately,
+        which is how benchmarks/startup.py measures time-to-interactive.
+        """
+        exit_when_ready = bool(os.environ.get('ANNOTATION_EXIT_WHEN_READY'))
+        record_ready(announce=exit_when_ready)
+        if exit_when_ready:
+            self._window.destroy()
+
+    def prefetch(self, index, filter=None):
+        """Decode the neighbours of image number index in the background"""
+        if self._index is None:
+            return
+        radius = self._prefetcher.radius
+        start = max(0, int(index) - radius)
+        rows = self._index.list_images(start, 2 * radius + 1, filter)
+        current = int(index) - start
+        # Nearest first, favouring the forward direction
+        order = sorted(range(len(rows)), key=lambda i: (abs(i - current), i < current))
+        # Tiled images are never decoded whole, so there is nothing to prefetch
+        self._prefetcher.schedule(rows[i]['path'] for i in order if i != current
+                                  and not needs_tiling(rows[i]['width'], rows[i]['height']))
+
+    def report_display_time(self, milliseconds):
+        """Record how long the frontend took to show a navigated-to image"""
+        self._prefetcher.record_display(milliseconds)
+        self._observe_frontend('ui.display', milliseconds)
+
+    def get_prefetch_metrics(self):
+        """Return prefetch hit rate and serve/display latency percentiles"""
+        return self._prefetcher.metrics()
+
+    def _observe_frontend(self, name, milliseconds):
+        duration_ns = int(float(milliseconds) * 1e6)
+        RECORDER.observe(name, time.perf_counter_ns() - duration_ns, duration_ns, 'ui')
+
+    def report_timings(self, samples):
+        """Record a batch of [name, milliseconds] render timings from the frontend"""
+        for name, milliseconds in samples:
+            self._observe_frontend('ui.' + str(name), milliseconds)
+
+    def get_metrics(self):
+        """Return latency percentiles per js_api method and stage, and counters"""
+        return dict(RECORDER.summary(), profiling=self._profiler.running)
+
+    def export_metrics(self, fmt='prometheus'):
+        """Return the metrics as Prometheus text or a Chrome trace JSON string"""
+        if fmt == 'prometheus':
+            return RECORDER.prometheus_text()
+        if fmt == 'trace':
+            return json.dumps(RECORDER.chrome_trace())
+        raise ValueError('unknown metrics format: %s' % fmt)
+
+    def reset_metrics(self):
+        RECORDER.reset()
+
+    def start_profiler(self, interval_ms=5):
+        """Start sampling every thread's stack until stop_profiler()"""
+        self._profiler.interval = max(1, float(interval_ms)) / 1000
+        self._profiler.start()
+        return self._profiler.report()
+
+    def stop_profiler(self):
+        """Stop sampling and return the hottest functions and collapsed stacks"""
+        return self._profiler.stop()
+
+    def get_stats(self):
+        """Return class distribution, verified count and box statistics"""
+        return self._stats.summary() if self._stats else None
+
+    def _thumbnail_key(self, path, st):
+        """Return the indexed content ID of path while its size and mtime match"""
+        index = self._index
+        if index is None:
+            return None
+        row = index.get(os.path.relpath(path, index.root))
+        if row is None or (row['size'], row['mtime_ns']) != (st.st_size, st.st_mtime_ns):
+            return None
+        return row['content_id']
+
+    def _image_record(self, row):
+        saved = self._journal.label(row['path']) if self._journal else None
+        record = {
+            'id': row['id'],
+            # Annotations are keyed by content, so copies of a file share them
+            'key': row['content_id'] or row['path'],
+            'name': os.path.basename(row['path']),
+            'path': row['path'],
+            'src': self._server.url_for(row['path']),
+            'thumb': self._server.url_for(row['path'], route='thumbs') + '?size=128',
+            'display': self._server.url_for(row['path'], route='display'),
+            'width': row['width'],
+            'height': row['height'],
+            'label': saved['label'] if saved else self._inferred.get(row['path'], 'Unknown'),
+            'verified': bool(saved and saved['verified']),
+            'confidence': saved.get('confidence') if saved else None,
+            # Frames are decoded from their video, never cut into tiles
+            'tiled': (needs_tiling(row['width'], row['height'])
+                      and split_frame_path(row['path']) is None),
+        }
+        frame = split_frame_path(row['path'])
+        if frame is not None:
+            record.update({
+                'name': os.path.join(os.path.basename(frame[0]), record['name']),
+                'video': frame[0],
+                'frame': frame[1],
+            })
+        if record['tiled']:
+            # The top pyramid level is a single tile that doubles as thumbnail
+            levels = level_count(row['width'], row['height'], self._tiles.tile_size)
+            tiles = self._server.url_for(row['path'], route='tiles')
+            record.update({
+                'display': None,
+                'tiles': tiles,
+                'tile_size': self._tiles.tile_size,
+                'levels': levels,
+                'thumb': '%s?level=%d&x=0&y=0' % (tiles, levels - 1),
+            })
+        return record
+
+    def get_tile_info(self, image):
+        """Build the tile pyramid of image if needed and return its layout"""
+        path = self._server.resolve(image)
+        if path is None:
+            return None
+        return self._tiles.info(path)
+
+    def get_annotations(self, image):
+        """Return the saved annotations of one image"""
+        return self._journal.annotations(image) if self._journal else []
+
+    def get_all_annotations(self):
+        """Return {path: [annotation, ...]} for the whole project"""
+        if not self._journal:
+            return {}
+        # Content IDs mean nothing outside this index; export under a path
+        paths = self._index.content_ids()
+        return {paths.get(key, key): anns for key, anns in self._journal.all_annotations().items()}
+
+    def _ensure_hashed(self):
+        if not self.hash_on_open and hash_images(self._index, workers=8, processes=False):
+            self._dup_tree = None
+
+    def find_duplicates(self, path, radius=DEFAULT_RADIUS):
+        """Return the byte-identical copies and near-duplicates of one image"""
+        if self._index is None:
+            return {'exact': [], 'near': []}
+        self._ensure_hashed()
+        row = self._index.get(path)
+        if row is None or not row['content_id']:
+            return {'exact': [], 'near': []}
+        exact = [p for p in self._index.paths_for_content(row['content_id']) if p != path]
+        near = []
+        if row['phash'] is not None:
+            if self._dup_tree is None:
+                self._dup_tree = build_tree(self._index)
+            near = [{'path': other, 'distance': distance}
+                    for distance, other in self._dup_tree.search(row['phash'], int(radius))
+                    if other != path and other not in exact]
+        return {'exact': exact, 'near': near}
+
+    def get_duplicate_groups(self, radius=DEFAULT_RADIUS):
+        """Return exact and near-duplicate clusters across the dataset"""
+        if self._index is None:
+            return {'exact': [], 'near': []}
+        self._ensure_hashed()
+        if self._dup_tree is None:
+            self._dup_tree = build_tree(self._index)
+        return {
+            'exact': exact_duplicates(self._index),
+            'near': near_duplicates(self._index, int(radius), self._dup_tree),
+        }
+
+    def add_annotation(self, image, annotation):
+        """Persist a new annotation; its id is chosen by the frontend"""
+        annotation = normalize_annotation(annotation)
+        errors = validate_annotation(annotation)
+        if errors:
+            raise ValueError('Invalid annotation: ' + '; '.join(errors))
+        event = {'op': 'add', 'image': image, 'annotation': annotation}
+        self._apply(event)
+        self._history.record(image, [event],
+                             [{'op': 'delete', 'image': image, 'id': annotation['id']}])
+
+    def update_annotation(self, image, annotation_id, changes):
+        """Persist a partial update of one annotation
+
+        The merged annotation is normalized and validated like a new one, and
+        only the keys that end up different are written. Unknown IDs are
+        ignored, as the journal would.
+        """
+        old = self._journal.annotation(image, annotation_id)
+        if old is None:
+            return
+        merged = dict(old)
+        merged.update(changes)
+        merged['id'] = annotation_id
+        merged = normalize_annotation(merged)
+        errors = validate_annotation(merged)
+        if errors:
+            raise ValueError('Invalid annotation: ' + '; '.join(errors))
+        changes = {key: value for key, value in merged.items() if old.get(key) != value}
+        if not changes:
+            return
+        event = {'op': 'update', 'image': image, 'id': annotation_id, 'changes': changes}
+        self._apply(event)
+        self._history.record(image, [event], [{
+            'op': 'update', 'image': image, 'id': annotation_id,
+            'changes': {key: old.get(key) for key in changes}}])
+
+    def delete_annotation(self, image, annotation_id):
+        """Persist the removal of one annotation"""
+        old = self._journal.annotation(image, annotation_id)
+        event = {'op': 'delete', 'image': image, 'id': annotation_id}
+        self._apply(event)
+        if old is not None:
+            self._history.record(image, [event],
+                                 [{'op': 'add', 'image': image, 'annotation': old}])
+
+    def _apply(self, event):
+        """Write one annotation event and keep stats and spatial indexes in step"""
+        image = event['image']
+        old = None
+        if event['op'] != 'add':
+            old = self._journal.annotation(image, event['id'])
+        self._journal.append(event)
+        if old is not None:
+            self._stats.remove_box(image, old)
+        new = None
+        if event['op'] == 'add':
+            new = self._journal.annotation(image, event['annotation']['id'])
+        elif event['op'] == 'update' and old is not None:
+            new = self._journal.annotation(image, event['id'])
+        if new is not None:
+            self._stats.add_box(image, new)
+        spatial = self._spatial.get(image)
+        if spatial is not None:
+            if new is not None:
+                spatial.insert(new)
+            elif event['op'] == 'delete':
+                spatial.remove(event['id'])
+        # Box counts feed the review order; updates leave them unchanged
+        added = event['op'] == 'add' and old is None
+        if self._review is not None and (added or event['op'] == 'delete' and old is not None):
+            count = len(self._journal.annotations(image))
+            self._box_stats.change(count - 1 if added else count + 1, count)
+            self._update_review(self._index.paths_for_content(image) or [image])
+
+    def _replay_command(self, command, key):
+        if command is None:
+            return None
+        for event in command[key]:
+            self._apply(event)
+        return {'image': command['image'],
+                'annotations': self.get_annotations(command['image']),
+                'history': self._history.counts()}
+
+    def undo(self):
+        """Revert the latest annotation edit; returns the image's new annotations"""
+        return self._replay_command(self._history.undo(), 'undo') if self._history else None
+
+    def redo(self):
+        """Re-apply the latest undone edit; returns the image's new annotations"""
+        return self._replay_command(self._history.redo(), 'do') if self._history else None
+
+    def get_history(self):
+        """Return how many edits can be undone and redone"""
+        return self._history.counts() if self._history else {'undo': 0, 'redo': 0, 'bytes': 0}
+
+    def _spatial_index(self, image):
+        index = self._spatial.get(image)
+        if index is None:
+            index = self._spatial[image] = GridIndex(self.get_annotations(image))
+        return index
+
+    def pick_annotation(self, image, x, y):
+        """Return the topmost annotation under a canvas point, or None"""
+        return self._spatial_index(image).pick(x, y)
+
+    def query_viewport(self, image, x0, y0, x1, y1):
+        """Return only the annotations intersecting the visible rectangle"""
+        return self._spatial_index(image).query(x0, y0, x1, y1)
+
+    def find_overlaps(self, image, min_iou=0.0):
+        """Return [[id_a, id_b, iou]] for overlapping annotation pairs"""
+        return [list(pair) for pair in self._spatial_index(image).overlaps(min_iou)]
+
+    def get_labels(self):
+        """Return {image: {'label', 'verified'}} for every labeled image"""
+        return self._journal.labels() if self._journal else {}
+
+    def set_label(self, image, label, verified=True):
+        """Persist the label of one image and return the updated stats"""
+        self._journal.append({'op': 'label', 'image': image, 'label': label,
+                              'verified': verified})
+        self._stats.set_label(image, label, verified)
+        self._update_review([image])
+        return self._stats.summary()
+
+    def _select_paths(self, selection):
+        """Resolve a batch selection to indexed image paths
+
+        selection is one of {'paths': [...]}, {'glob': pattern},
+        {'folder': relpath} or {'cluster': path, 'radius': bits}, the last
+        meaning the image plus its exact and near duplicates.
+        """
+        if 'paths' in selection:
+            return self._index.existing_paths(selection['paths'])
+        if 'glob' in selection:
+            return self._index.paths(selection['glob'])
+        if 'folder' in selection:
+            return self._index.paths_under(selection['folder'])
+        if 'cluster' in selection:
+            path = selection['cluster']
+            found = self.find_duplicates(path, selection.get('radius', DEFAULT_RADIUS))
+            return self._index.existing_paths(
+                [path] + found['exact'] + [entry['path'] for entry in found['near']])
+        raise ValueError('Unknown selection: %r' % (selection,))
+
+    def count_selection(self, selection):
+        """Return how many images a batch selection covers"""
+        return len(self._select_paths(selection)) if self._index else 0
+
+    def apply_label(self, selection, label, verified=True):
+        """Label every image in selection in one journal write
+
+        Returns {'count', 'delta', 'stats'}, so the UI refreshes once with
+        the change instead of once per image.
+        """
+        if not isinstance(label, str) or not label:
+            raise ValueError('label must be a non-empty string')
+        paths = self._select_paths(selection)
+        if paths:
+            self._journal.append({'op': 'labels', 'images': paths, 'label': label,
+                                  'verified': bool(verified)})
+        delta = self._stats.set_labels(paths, label, bool(verified))
+        self._update_review(paths)
+        return {
+            'count': len(paths),
+            'delta': delta,
+            'stats': self._stats.summary(),
+        }
+
+    def _build_review(self, mode):
+        labels = self._journal.labels()
+        boxes = {key: len(anns) for key, anns in self._journal.all_annotations().items()}
+        self._review_keys = {row['path']: row['content_id'] or row['path']
+                             for row in self._index.iter_images()}
+        self._box_stats = BoxCountStats(boxes.values(), len(self._review_keys))
+        self._review_mode = mode
+        items = []
+        for path, key in self._review_keys.items():
+            entry = labels.get(path)
+            if entry and entry['verified']:
+                continue
+            signals = review_signals(entry, self._inferred.get(path), boxes.get(key, 0),
+                                     self._box_stats)
+            items.append((path, review_priority(signals, mode)))
+        self._review = ReviewQueue(items)
+
+    def _review_signals(self, path):
+        key = self._review_keys.get(path, path)
+        return review_signals(self._journal.label(path), self._inferred.get(path),
+                              len(self._journal.annotations(key)), self._box_stats)
+
+    def _update_review(self, paths):
+        """Requeue or drop images whose labels or boxes just changed"""
+        if self._review is None:
+            return
+        for path in paths:
+            entry = self._journal.label(path)
+            if entry and entry['verified']:
+                self._review.discard(path)
+            elif path in self._review_keys:
+                self._review.push(path, review_priority(self._review_signals(path),
+                                                        self._review_mode))
+
+    def next_for_review(self, mode='combined'):
+        """Hand out the unverified image most worth reviewing next
+
+        Returns {'path', 'position', 'priority', 'signals', 'remaining'}, or
+        None once everything is verified. The queue is built on first use
+        or when mode changes and is then kept up to date by every edit.
+        """
+        if self._index is None:
+            return None
+        if self._review is None or mode != self._review_mode:
+            self._build_review(mode)
+        top = self._review.pop()
+        if top is None:
+            return None
+        path, priority = top
+        return {
+            'path': path,
+            'position': self._index.position(path),
+            'priority': priority,
+            'signals': self._review_signals(path),
+            'remaining': len(self._review),
+        }
+
+    def reset_review(self):
+        """Put images handed out but not verified back in the review queue"""
+        self._review = None
+
+    def choose_model(self):
+        """Ask for an ONNX model file and return its path"""
+        import webview
+
+        result = self._window.create_file_dialog(
+            webview.OPEN_DIALOG, file_types=('ONNX models (*.onnx)', 'All files (*.*)'))
+        if not result:
+            return None
+        return result[0] if isinstance(result, (list, tuple)) else result
+
+    def start_prelabel(self, model, labels=None, batch_size=BATCH_SIZE):
+        """Run model over the dataset in the background and return its progress
+
+        model is an .onnx path, a 'module:function' spec or a model object
+        (see annotation_web.prelabel). Predictions are saved as unverified
+        labels and boxes as they arrive, so annotators only have to confirm
+        them.
+        """
+        if self._index is None:
+            return None
+        if self._prelabel_thread is not None and self._prelabel_thread.is_alive():
+            return self.get_prelabel_status()
+        if isinstance(model, str):
+            model = load_model(model, labels)
+        self._prelabeler = Prelabeler(model, PredictionCache(), int(batch_size))
+        self._prelabel_error = None
+        self._prelabel_thread = threading.Thread(
+            target=self._run_prelabel, args=(self._prelabeler,), name='prelabel', daemon=True)
+        self._prelabel_thread.start()
+        return self.get_prelabel_status()
+
+    def _run_prelabel(self, prelabeler):
+        try:
+            self._ensure_hashed()
+            version = prelabeler.model.version
+            for row, prediction, _ in prelabeler.run(self._index.root, self._index.iter_images()):
+                events, rejected = prediction_events(row, prediction, version, self._journal)
+                prelabeler.reject(rejected)
+                for event in events:
+                    if event['op'] == 'label':
+                        self._journal.append(event)
+                        self._stats.set_label(event['image'], event['label'], False)
+                        self._update_review([event['image']])
+                    else:
+                        self._apply(event)
+        except Exception as e:
+            self._prelabel_error = '%s: %s' % (type(e).__name__, e)
+        finally:
+            prelabeler.cache.close()
+
+    def get_prelabel_status(self):
+        """Return pre-labeling progress and throughput, or None if never run"""
+        if self._prelabeler is None:
+            return None
+        # Alive also covers hashing before the first batch starts
+        return dict(self._prelabeler.progress(), error=self._prelabel_error,
+                    running=self._prelabel_thread.is_alive())
+
+    def cancel_prelabel(self):
+        """Stop pre-labeling after the batches already in flight"""
+        if self._prelabeler is not None:
+            self._prelabeler.cancel()
+
+    def _row_for_key(self, key):
+        """Return the manifest row an annotation key (content ID or path) names"""
+        row = self._index.get(key)
+        if row is None:
+            paths = self._index.paths_for_content(key)
+            row = self._index.get(paths[0]) if paths else None
+        return row
+
+    def _sequence(self, image):
+        """Return (rows, position of image) for the frames or folder holding image"""
+        row = self._row_for_key(image)
+        if row is None:
+            return [], None
+        rows = self._index.siblings(row['path'])
+        return rows, next(i for i, other in enumerate(rows) if other['path'] == row['path'])
+
+    @staticmethod
+    def _row_key(row):
+        return row['content_id'] or row['path']
+
+    def _track_id(self, image, ann):
+        """Return the track ID of ann, giving it one named after itself if needed"""
+        if not ann.get('track'):
+            self._apply({'op': 'update', 'image': image, 'id': ann['id'],
+                         'changes': {'track': ann['id']}})
+        return ann.get('track') or ann['id']
+
+    @staticmethod
+    def _is_keyframe(ann, track_id):
+        return ann.get('track') == track_id and (
+            ann.get('source') not in tracking.SOURCES or ann.get('verified'))
+
+    def _keyframes(self, track_id):
+        """Return {image: hand-drawn box} for one track, in one table query"""
+        keyframes = {}
+        for image, ann in self._journal.find(track=track_id):
+            if self._is_keyframe(ann, track_id):
+                keyframes.setdefault(image, ann)
+        return keyframes
+
+    @staticmethod
+    def _pixel_box(ann, row):
+        x, y, w, h = canvas_to_pixels(ann, row['width'], row['height'])
+        return x, y, x + w, y + h
+
+    def _replace_generated(self, row, track_id, seed, box, source):
+        """Swap the generated box of track_id on row for one at pixel box (or none)"""
+        image = self._row_key(row)
+        for ann in self._journal.annotations(image):
+            if ann.get('track') == track_id and not self._is_keyframe(ann, track_id):
+                self._apply({'op': 'delete', 'image': image, 'id': ann['id']})
+        if box is None:
+            return
+        bbox = (box[0], box[1], box[2] - box[0], box[3] - box[1])
+        ann = {'id': '%s-auto' % track_id, 'type': 'box', 'label': seed['label'],
+               'track': track_id, 'source': source, 'verified': False}
+        if seed.get('space') == 'image':
+            ann['space'] = 'image'
+        else:
+            bbox = pixels_to_canvas(bbox, row['width'], row['height'])
+        ann.update(zip(('x', 'y', 'width', 'height'), (round(float(v), 2) for v in bbox)))
+        if ann['width'] > 0 and ann['height'] > 0:
+            self._apply({'op': 'add', 'image': image, 'annotation': ann})
+
+    def track_boxes(self, image, annotation_ids=None, frames=tracking.TRACK_FRAMES):
+        """Follow boxes on image through the next frames of its video or folder
+
+        Each box becomes a track; generated boxes are written unverified to
+        every following frame until the object is lost or the track's next
+        hand-drawn box. Undo does not cover them; tracking again replaces
+        them.
+        """
+        if self._index is None:
+            return None
+        rows, position = self._sequence(image)
+        if position is None or not rows[position]['width']:
+            return None
+        seeds = [ann for ann in self._journal.annotations(image)
+                 if ann.get('type') == 'box'
+                 and (annotation_ids is None or ann['id'] in annotation_ids)]
+        following = rows[position:position + 1 + max(int(frames), 0)]
+        result = {'tracks': len(seeds), 'frames': 0, 'boxes': 0, 'fps': 0.0, 'images': []}
+        if not seeds or len(following) < 2:
+            return result
+
+        track_ids = [self._track_id(image, ann) for ann in seeds]
+        # A track stops short of the next frame where it was drawn by hand
+        limits = []
+        for track_id in track_ids:
+            keyframes = self._keyframes(track_id)
+            limits.append(next((step for step, row in enumerate(following[1:], 1)
+                                if self._row_key(row) in keyframes), len(following)))
+        end = max(limits)
+        paths = [os.path.join(self._index.root, row['path']) for row in following[:end]]
+        boxes = [self._pixel_box(ann, rows[position]) for ann in seeds]
+
+        changed = set()
+        started = time.perf_counter()
+        for step, tracked, alive in tracking.track(paths, boxes):
+            row = following[step]
+            result['frames'] = step
+            for i, (seed, track_id) in enumerate(zip(seeds, track_ids)):
+                if step >= limits[i]:
+                    continue
+                box = tracked[i] if alive[i] else None
+                self._replace_generated(row, track_id, seed, box, 'tracked')
+                changed.add(self._row_key(row))
+                result['boxes'] += box is not None
+        elapsed = time.perf_counter() - started
+        result['fps'] = round(result['frames'] / elapsed, 1) if elapsed > 0 else 0.0
+        result['images'] = sorted(changed)
+        return result
+
+    def interpolate_boxes(self, start_image, start_id, end_image, end_id, method='linear'):
+        """Fill the frames between two boxes of one object by interpolation
+
+        The end box joins the start box's track, and every hand-drawn box of
+        that track between the two becomes a keyframe; the frames in between
+        get unverified 'interpolated' boxes, replacing earlier generated ones.
+        """
+        if self._index is None:
+            return None
+        if method not in tracking.METHODS:
+            raise ValueError('unknown interpolation method: %s' % method)
+        rows, start = self._sequence(start_image)
+        end_row = self._row_for_key(end_image)
+        if start is None or end_row is None:
+            return None
+        end = next((i for i, row in enumerate(rows) if row['path'] == end_row['path']), None)
+        if end is None:
+            raise ValueError('both boxes must be in the same video or folder')
+        seed = self._journal.annotation(start_image, start_id)
+        last = self._journal.annotation(end_image, end_id)
+        if seed is None or last is None:
+            raise ValueError('annotation not found')
+        track_id = self._track_id(start_image, seed)
+        if last.get('track') != track_id:
+            self._apply({'op': 'update', 'image': end_image, 'id': end_id,
+                         'changes': {'track': track_id}})
+
+        low, high = min(start, end), max(start, end)
+        drawn = self._keyframes(track_id)
+        keyframes = {i: self._pixel_box(drawn[self._row_key(rows[i])], rows[i])
+                     for i in range(low, high + 1) if self._row_key(rows[i]) in drawn}
+        between = [i for i in range(low + 1, high) if i not in keyframes]
+        changed = []
+        if between and len(keyframes) >= 2:
+            for i, box in zip(between, tracking.interpolate(keyframes, between, method)):
+                self._replace_generated(rows[i], track_id, seed, box, 'interpolated')
+                changed.append(self._row_key(rows[i]))
+        return {'track': track_id, 'keyframes': len(keyframes), 'frames': len(changed),
+                'images': changed}
+
+    def export_dataset(self, fmt, kind='detection'):
+        """Ask for a destination and export the project as COCO/YOLO/VOC"""
+        import webview
+
+        if fmt == 'coco':
+            result = self._window.create_file_dialog(
+                webview.SAVE_DIALOG, save_filename='annotations_coco.json')
+        else:
+            result = self._window.create_file_dialog(webview.FOLDER_DIALOG)
+        if not result:
+            return None
+        if isinstance(result, (list, tuple)):
+            result = result[0]
+        return self.export_to(fmt, result, kind)
+
+    def export_to(self, fmt, target, kind='detection'):
+        """Export boxes (kind='detection') or image labels to target"""
+        self.flush()
+        lookup = index_size_lookup(self._index)
+        if kind == 'classification':
+            entries = [{'filename': path, 'label': entry['label']}
+                       for path, entry in self._journal.labels().items()]
+            records = classification_records(entries, lookup)
+        else:
+            records = annotation_records(self._journal.table(), lookup)
+        # Per-image writes stay in-process; a pool would fork the webview
+        return export(records, fmt, target, workers=1)
+
+    def export_labels(self):
+        """Ask for a destination and save every image's label as JSON"""
+        import webview
+
+        result = self._window.create_file_dialog(
+            webview.SAVE_DIALOG, save_filename='annotations.json')
+        if not result:
+            return None
+        if isinstance(result, (list, tuple)):
+            result = result[0]
+        return self.export_labels_to(result)
+
+    def export_labels_to(self, target):
+        """Write [{'filename', 'label', 'verified'}] for every image to target"""
+        with open(target, 'wb') as f:
+            f.write(self._labels_document())
+        return len(self._index)
+
+    def _labels_document(self):
+        entries = []
+        for row in self._index.iter_images():
+            record = self._image_record(row)
+            entries.append({'filename': record['name'], 'label': record['label'],
+                            'verified': record['verified']})
+        return json.dumps(entries, indent=2).encode('utf-8')
+
+    def _serve_labels(self, relpath, query):
+        if self._index is None:
+            return None
+        return self._labels_document(), 'application/json'
+
+    def flush(self):
+        """Force pending edits to disk"""
+        if self._journal is not None:
+            self._journal.flush()
+
+    def _shutdown(self):
+        if self._prelabel_thread is not None:
+            self.cancel_prelabel()
+            self._prelabel_thread.join()
+            self._prelabel_thread = None
+        self._prelabeler = None
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if self._history is not None:
+            self._history.close()
+            self._history = None
+        self._stats = None
+        self._spatial = {}
+        self._dup_tree = None
+        self._inferred = {}
+        self._review = None
+        self._review_keys = {}
+        self._box_stats = None
+        if self._index is not None:
+            self._index.close()
+            self._index = None
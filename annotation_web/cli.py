@@ -0,0 +1,249 @@
+"""Headless command line for batch jobs: python -m annotation_web <command>
+
+Commands share the modules the desktop apps use, but nothing here imports
+webview, and each command imports only what it needs so batch jobs start
+quickly.
+
+    index     scan a dataset folder into the persistent index
+    validate  check an annotation JSON file against the schema
+    stats     print counts and the label distribution of an annotation file
+    convert   export an annotation file as COCO, YOLO or Pascal VOC
+    import    load an annotation file into a dataset's project journal
+    dedup     hash a dataset and report exact and near-duplicate images
+    prelabel  run a model over a dataset and save its predictions unverified
+"""
+import argparse
+import json
+import os
+import sys
+import uuid
+
+
+def _load_json(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def cmd_index(args):
+    from annotation_web.dataset_index import DatasetIndex
+
+    index = DatasetIndex(args.root)
+    try:
+        summary = index.scan()
+    finally:
+        index.close()
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+def _problems(data):
+    from annotation_web.validation import validate_document
+
+    try:
+        return list(validate_document(data))
+    except ValueError as e:
+        return [('document', str(e))]
+
+
+def _refuse(action, problems):
+    location, message = problems[0]
+    print('Refusing to %s invalid file (%d problem(s), first: %s: %s)'
+          % (action, len(problems), location, message), file=sys.stderr)
+    return 1
+
+
+def cmd_validate(args):
+    errors = 0
+    for location, message in _problems(_load_json(args.annotations)):
+        errors += 1
+        if errors <= args.max_errors:
+            print('%s: %s' % (location, message))
+    if errors > args.max_errors:
+        print('... %d more' % (errors - args.max_errors))
+    print('%d problem(s) found' % errors if errors else 'OK')
+    return 1 if errors else 0
+
+
+def cmd_stats(args):
+    from annotation_web.stats import summarize
+
+    data = _load_json(args.annotations)
+    problems = _problems(data)
+    if problems:
+        return _refuse('summarize', problems)
+    summary = summarize(data)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return 0
+    for key, value in summary.items():
+        if key != 'distribution':
+            print('%-18s %s' % (key, value))
+    print('distribution:')
+    for label, count in summary['distribution'].items():
+        print('  %-16s %d' % (label, count))
+    return 0
+
+
+def cmd_convert(args):
+    from annotation_web import exporters
+
+    return exporters.run(args)
+
+
+def cmd_import(args):
+    from annotation_web.journal import AnnotationJournal, project_dir
+    from annotation_web.model import normalize_annotation
+    from annotation_web.validation import document_kind, expand_document
+
+    data, _ = expand_document(_load_json(args.annotations))
+    if isinstance(data, dict):
+        # Checked and stored in the shape the apps write, as js_api edits are
+        data = {image: [normalize_annotation(ann) if isinstance(ann, dict) else ann
+                        for ann in anns] if isinstance(anns, list) else anns
+                for image, anns in data.items()}
+    problems = _problems(data)
+    if problems:
+        return _refuse('import', problems)
+
+    journal = AnnotationJournal(project_dir(os.path.realpath(args.root)))
+    count = 0
+    try:
+        if document_kind(data) == 'classification':
+            for entry in data:
+                journal.append({'op': 'label', 'image': entry['filename'],
+                                'label': entry['label'],
+                                'verified': entry.get('verified', False)})
+                count += 1
+        else:
+            for image, anns in data.items():
+                for ann in anns:
+                    ann = dict(ann, id=ann.get('id') or uuid.uuid4().hex)
+                    journal.append({'op': 'add', 'image': image, 'annotation': ann})
+                    count += 1
+    finally:
+        journal.close()
+    print('Imported %d record(s) into %s' % (count, journal.directory))
+    return 0
+
+
+def cmd_dedup(args):
+    from annotation_web import dedup
+    from annotation_web.dataset_index import DatasetIndex
+
+    index = DatasetIndex(args.root)
+    try:
+        index.scan()
+        hashed = dedup.hash_images(index, workers=args.workers)
+        report = {
+            'hashed': hashed,
+            'exact': dedup.exact_duplicates(index),
+            'near': dedup.near_duplicates(index, args.radius),
+        }
+    finally:
+        index.close()
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print('hashed %d new or changed file(s)' % hashed)
+    for kind in ('exact', 'near'):
+        print('%d %s-duplicate group(s)' % (len(report[kind]), kind))
+        for group in report[kind]:
+            print('  ' + '  '.join(group))
+    return 0
+
+
+def cmd_prelabel(args):
+    from annotation_web import dedup, prelabel
+    from annotation_web.dataset_index import DatasetIndex
+    from annotation_web.journal import AnnotationJournal, project_dir
+
+    model = prelabel.load_model(args.model, args.labels, args.threads)
+    index = DatasetIndex(args.root)
+    cache = prelabel.PredictionCache()
+    journal = None
+    try:
+        index.scan()
+        dedup.hash_images(index)
+        journal = AnnotationJournal(project_dir(index.root))
+        runner = prelabel.Prelabeler(model, cache, args.batch_size, args.workers)
+        written = 0
+        for row, prediction, _ in runner.run(index.root, index.iter_images()):
+            events, rejected = prelabel.prediction_events(row, prediction, model.version,
+                                                          journal)
+            runner.reject(rejected)
+            for event in events:
+                journal.append(event)
+                written += 1
+    finally:
+        if journal is not None:
+            journal.close()
+        cache.close()
+        index.close()
+    progress = runner.progress()
+    print('%(predicted)d predicted, %(cached)d from cache, %(failed)d failed '
+          'in %(seconds).2fs (%(images_per_second).1f img/s)' % progress)
+    print('wrote %d event(s) with model %s' % (written, model.version))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m annotation_web',
+        description='Batch tools for the annotation datasets.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('index', help='scan a dataset folder into the index')
+    p.add_argument('root')
+    p.set_defaults(func=cmd_index)
+
+    p = commands.add_parser('validate', help='check an annotation file')
+    p.add_argument('annotations')
+    p.add_argument('--max-errors', type=int, default=50)
+    p.set_defaults(func=cmd_validate)
+
+    p = commands.add_parser('stats', help='summarize an annotation file')
+    p.add_argument('annotations')
+    p.add_argument('--json', action='store_true', help='print machine-readable JSON')
+    p.set_defaults(func=cmd_stats)
+
+    p = commands.add_parser('convert', help='export to COCO, YOLO or Pascal VOC')
+    # Lazily built so the exporters module is only imported for this command
+    p.set_defaults(func=cmd_convert)
+
+    p = commands.add_parser('import', help="load annotations into a dataset's journal")
+    p.add_argument('annotations')
+    p.add_argument('--root', required=True, help='dataset folder the annotations belong to')
+    p.set_defaults(func=cmd_import)
+
+    p = commands.add_parser('dedup', help='find exact and near-duplicate images')
+    p.add_argument('root')
+    p.add_argument('--radius', type=int, default=6,
+                   help='max differing bits between perceptual hashes (default: 6)')
+    p.add_argument('--workers', type=int, default=None, help='hashing processes')
+    p.add_argument('--json', action='store_true', help='print machine-readable JSON')
+    p.set_defaults(func=cmd_dedup)
+
+    p = commands.add_parser('prelabel', help='pre-label a dataset with a model')
+    p.add_argument('root')
+    p.add_argument('--model', required=True,
+                   help='an .onnx classifier or a module:function callable')
+    p.add_argument('--labels', help='class names, one per line (ONNX models)')
+    p.add_argument('--batch-size', type=int, default=32)
+    p.add_argument('--workers', type=int, default=None, help='batches run concurrently')
+    p.add_argument('--threads', type=int, default=None, help='ONNX Runtime threads per batch')
+    p.set_defaults(func=cmd_prelabel)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = build_parser()
+    if argv and argv[0] == 'convert':
+        from annotation_web.exporters import build_parser as build_convert_parser
+
+        args = build_convert_parser(argparse.ArgumentParser(
+            prog='python -m annotation_web convert')).parse_args(argv[1:])
+        args.func = cmd_convert
+    else:
+        args = parser.parse_args(argv)
+    return args.func(args)
@@ -0,0 +1,646 @@
+"""Serve an app's UI to several browsers that share one dataset.
+
+    python annotation_web/annotation_app.py --serve DATASET [--host H] [--port P]
+    python test_model.py --serve DATASET
+
+One asyncio process owns the dataset's index and journal and serves:
+
+  * GET /            the app page, with window.pywebview.api replaced by a
+                     shim that POSTs each call to /api/<method>
+  * POST /api/<name> one js_api call; the JSON body is the argument list
+  * GET /events      Server-Sent Events announcing other clients' edits
+  * GET /images/...  the image, thumbnail and tile routes of ImageServer
+
+js_api calls run on a thread pool. Writes take a lock per image (row), so
+edits to different images proceed in parallel while two edits to one image
+are applied one after the other; a batch label locks all of its rows in a
+fixed order, and so do tracking and interpolation, which lock every frame
+they may write. Work is handed out with leases: next_for_review and
+acquire_work lease images to the calling client, and other clients' writes
+to a leased image are refused until the lease is released, completed by a
+verified label, or expires.
+
+Undo history and file dialogs belong to a single desktop user, so undo,
+redo and the dialog-backed calls are not served. Metrics and the sampling
+profiler are process-wide: every client may read and download the metrics,
+but resetting them and starting or stopping the profiler are refused.
+
+There are no user accounts. Listening anywhere but loopback requires a
+session token (--token, or a random one printed in the URL): the page is
+opened as /?token=..., which sets a cookie that the shim's calls, the
+event stream and the image requests then carry. Requests without it get
+401.
+"""
+import argparse
+import asyncio
+import hmac
+import ipaddress
+import itertools
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.cookies import CookieError, SimpleCookie
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from annotation_web.assets import inline_shared
+from annotation_web.instrumentation import span
+from annotation_web.tracking import TRACK_FRAMES
+
+DEFAULT_PORT = 8765
+LEASE_SECONDS = 300
+SWEEP_INTERVAL = 5
+HEARTBEAT_INTERVAL = 15
+MAX_BODY_BYTES = 16 * 1024 * 1024
+TOKEN_COOKIE = 'annotation_token'
+
+log = logging.getLogger(__name__)
+EVENT_QUEUE_SIZE = 1024
+# Batch label events list their images only up to this many
+EVENT_IMAGE_LIMIT = 1000
+
+# js_api calls that edit one image; the first argument is the image key
+ROW_WRITES = ('add_annotation', 'update_annotation', 'delete_annotation', 'set_label')
+# Reads of per-image structures that writes mutate in place
+ROW_READS = ('get_annotations', 'pick_annotation', 'query_viewport', 'find_overlaps')
+OPEN_CALLS = (
+    'list_images', 'get_all_annotations', 'get_stats', 'get_labels', 'get_tile_info',
+    'find_duplicates', 'get_duplicate_groups', 'count_selection', 'get_prelabel_status',
+    'prefetch', 'report_display_time', 'get_prefetch_metrics',
+    'report_timings', 'get_metrics', 'export_metrics',
+)
+
+SHIM = '''<script>
+(() => {
+  const client = sessionStorage.getItem('annotation-client') ||
+    Math.random().toString(36).slice(2) + Date.now().toString(36);
+  sessionStorage.setItem('annotation-client', client);
+  const call = (method, args) => fetch('/api/' + method, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'X-Client-Id': client },
+    body: JSON.stringify(args)
+  }).then(async response => {
+    const body = await response.json();
+    if (!response.ok) throw new Error(body.error);
+    return body.result;
+  });
+  window.pywebview = { api: new Proxy({}, { get: (_, method) => (...args) => call(method, args) }) };
+  window.ANNOTATION_SERVER = { client, events: new EventSource('/events?client=' + client) };
+  setInterval(() => call('renew_leases', []), %(renew_ms)d);
+})();
+</script>
+'''
+
+
+class LeaseConflict(Exception):
+    """A write touched an image leased to another client"""
+
+
+class RowLocks:
+    """One lock per row key, created on demand and dropped when unused"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [lock, number of holders and waiters]
+        self._rows = {}
+
+    @contextmanager
+    def hold(self, keys):
+        # A fixed order keeps batch writes from deadlocking each other
+        keys = sorted(set(keys))
+        with self._lock:
+            entries = []
+            for key in keys:
+                entry = self._rows.setdefault(key, [threading.Lock(), 0])
+                entry[1] += 1
+                entries.append(entry)
+        for entry in entries:
+            entry[0].acquire()
+        try:
+            yield
+        finally:
+            for entry in reversed(entries):
+                entry[0].release()
+            with self._lock:
+                for key, entry in zip(keys, entries):
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del self._rows[key]
+
+
+class LeaseManager:
+    """Time-limited claims of work items by clients
+
+    A lease is granted on an image path and also covers the image's other
+    keys (its content ID), so writes keyed either way are checked.
+    """
+
+    def __init__(self, seconds=LEASE_SECONDS):
+        self.seconds = seconds
+        self._lock = threading.Lock()
+        # path -> {'client', 'keys', 'expires'}
+        self._leases = {}
+        self._by_key = {}
+
+    def grant(self, client, path, keys=()):
+        with self._lock:
+            lease = {'client': client, 'keys': {path, *keys},
+                     'expires': time.time() + self.seconds}
+            self._leases[path] = lease
+            for key in lease['keys']:
+                self._by_key[key] = path
+            return lease['expires']
+
+    def holder(self, key):
+        """Return the client holding key, or None"""
+        with self._lock:
+            path = self._by_key.get(key)
+            return self._leases[path]['client'] if path is not None else None
+
+    def check(self, keys, client):
+        """Raise LeaseConflict if another client holds any of keys"""
+        with self._lock:
+            for key in keys:
+                path = self._by_key.get(key)
+                if path is not None and self._leases[path]['client'] != client:
+                    raise LeaseConflict('%s is leased to another annotator' % key)
+
+    def renew(self, client):
+        """Extend every lease of client and return how many there are"""
+        expires = time.time() + self.seconds
+        with self._lock:
+            mine = [lease for lease in self._leases.values() if lease['client'] == client]
+            for lease in mine:
+                lease['expires'] = expires
+            return len(mine)
+
+    def release(self, client, key=None):
+        """Drop the lease on key (or all leases) of client; returns the paths"""
+        with self._lock:
+            if key is not None:
+                path = self._by_key.get(key)
+                paths = [path] if path is not None and self._leases[path]['client'] == client else []
+            else:
+                paths = [path for path, lease in self._leases.items() if lease['client'] == client]
+            for path in paths:
+                self._drop(path)
+            return paths
+
+    def expire(self):
+        """Drop and return the paths whose leases ran out"""
+        now = time.time()
+        with self._lock:
+            paths = [path for path, lease in self._leases.items() if lease['expires'] <= now]
+            for path in paths:
+                self._drop(path)
+            return paths
+
+    def _drop(self, path):
+        for key in self._leases.pop(path)['keys']:
+            if self._by_key.get(key) == path:
+                del self._by_key[key]
+
+    def __len__(self):
+        return len(self._leases)
+
+
+class CollabServer:
+    """asyncio HTTP front end multiplexing several clients onto one DatasetAPI"""
+
+    def __init__(self, api, html, lease_seconds=LEASE_SECONDS, workers=16, token=None):
+        self.api = api
+        self.token = token
+        self.leases = LeaseManager(lease_seconds)
+        self.locks = RowLocks()
+        self._page = self._inject_shim(html, lease_seconds)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='collab')
+        # The review queue hands each image to one client; pops are serialized
+        self._work_lock = threading.Lock()
+        self._subscribers = set()
+        self._event_ids = itertools.count(1)
+        self._loop = None
+        self._server = None
+
+    @staticmethod
+    def _inject_shim(html, lease_seconds):
+        shim = SHIM % {'renew_ms': max(1, lease_seconds // 3) * 1000}
+        # The shim must run before the app script reads window.pywebview
+        html = inline_shared(html)
+        return html.replace('</head>', shim + '</head>', 1).encode('utf-8')
+
+    # -- js_api dispatch (runs on the thread pool) --
+
+    def call(self, client, method, args):
+        """Run one js_api call on behalf of client and return its result"""
+        handler = getattr(self, '_call_' + method, None)
+        if handler is not None:
+            return handler(client, *args)
+        if method in ROW_WRITES + ROW_READS and not args:
+            raise TypeError('%s takes the image as its first argument' % method)
+        if method in ROW_WRITES:
+            image = args[0]
+            with self.locks.hold([image]):
+                self.leases.check([image], client)
+                result = getattr(self.api, method)(*args)
+            if method == 'set_label':
+                verified = args[2] if len(args) > 2 else True
+                # A verified label completes the work item
+                if verified:
+                    self.leases.release(client, image)
+                self.publish({'type': 'labels', 'images': [image], 'client': client})
+            else:
+                self.publish({'type': 'annotations', 'image': image, 'client': client})
+            return result
+        if method in ROW_READS:
+            with self.locks.hold([args[0]]):
+                return getattr(self.api, method)(*args)
+        if method in OPEN_CALLS:
+            return getattr(self.api, method)(*args)
+        raise PermissionError('%s is not available in server mode' % method)
+
+    def _call_apply_label(self, client, selection, label, verified=True):
+        while True:
+            paths = self.api._select_paths(selection) if self.api._index is not None else []
+            with self.locks.hold(paths):
+                # Resolved again under the locks: if a rescan changed the
+                # selection in between, lock the new set instead
+                current = (self.api._select_paths(selection)
+                           if self.api._index is not None else [])
+                if current != paths:
+                    continue
+                self.leases.check(paths, client)
+                result = self.api.apply_label({'paths': paths}, label, verified)
+            break
+        self.publish({'type': 'labels', 'client': client, 'count': len(paths),
+                      'images': paths if len(paths) <= EVENT_IMAGE_LIMIT else None})
+        return result
+
+    def _frame_keys(self, rows, *images):
+        """Return images plus the path and content ID of every row"""
+        keys = set(images)
+        for row in rows:
+            keys.add(row['path'])
+            if row['content_id']:
+                keys.add(row['content_id'])
+        return keys
+
+    def _sequence_write(self, client, keys, write, images):
+        """Run write holding keys, then announce the images it changed"""
+        with self.locks.hold(keys):
+            self.leases.check(keys, client)
+            result = write()
+        for image in dict.fromkeys(list(images) + list((result or {}).get('images', ()))):
+            self.publish({'type': 'annotations', 'image': image, 'client': client})
+        return result
+
+    def _call_track_boxes(self, client, image, annotation_ids=None, frames=TRACK_FRAMES):
+        rows, position = ([], None) if self.api._index is None else self.api._sequence(image)
+        following = rows[position:position + 1 + max(int(frames), 0)] if position is not None else []
+        return self._sequence_write(
+            client, self._frame_keys(following, image),
+            lambda: self.api.track_boxes(image, annotation_ids, frames), [image])
+
+    def _call_interpolate_boxes(self, client, start_image, start_id, end_image, end_id,
+                                method='linear'):
+        between = []
+        if self.api._index is not None:
+            rows, start = self.api._sequence(start_image)
+            end_row = self.api._row_for_key(end_image)
+            end = next((i for i, row in enumerate(rows)
+                        if end_row is not None and row['path'] == end_row['path']), None)
+            if start is not None and end is not None:
+                between = rows[min(start, end):max(start, end) + 1]
+        return self._sequence_write(
+            client, self._frame_keys(between, start_image, end_image),
+            lambda: self.api.interpolate_boxes(start_image, start_id, end_image, end_id, method),
+            [start_image, end_image])
+
+    def _call_choose_directory(self, client):
+        # Every client works on the dataset the server was started with
+        total = self.api._index.count() if self.api._index is not None else 0
+        return {'summary': {'total': total}, 'total': total}
+
+    def _call_mark_ready(self, client):
+        # Closing the window on first render is for desktop startup benchmarks
+        return None
+
+    def _call_get_history(self, client):
+        return {'undo': 0, 'redo': 0, 'bytes': 0}
+
+    def _call_undo(self, client):
+        return None
+
+    def _call_redo(self, client):
+        return None
+
+    def _call_next_for_review(self, client, mode='combined'):
+        items = self._call_acquire_work(client, 1, mode)
+        return items[0] if items else None
+
+    def _call_acquire_work(self, client, count=1, mode='combined'):
+        """Lease up to count of the most valuable unverified images to client"""
+        items = []
+        with self._work_lock:
+            while len(items) < int(count):
+                item = self.api.next_for_review(mode)
+                if item is None:
+                    break
+                if self.leases.holder(item['path']) not in (None, client):
+                    continue
+                row = self.api._index.get(item['path'])
+                keys = [row['content_id']] if row and row['content_id'] else []
+                item['lease_expires'] = self.leases.grant(client, item['path'], keys)
+                items.append(item)
+        if items:
+            self.publish({'type': 'leases', 'client': client,
+                          'images': [item['path'] for item in items]})
+        return items
+
+    def _call_renew_leases(self, client):
+        return self.leases.renew(client)
+
+    def _call_release_work(self, client, path=None):
+        paths = self.leases.release(client, path)
+        self._requeue(paths)
+        return paths
+
+    def _requeue(self, paths):
+        if paths:
+            # Unfinished images go back into the review queue for others
+            self.api._update_review(paths)
+            self.publish({'type': 'leases', 'client': None, 'images': paths, 'released': True})
+
+    # -- push updates --
+
+    def publish(self, event):
+        """Queue event for every connected client; safe from any thread"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._publish, event)
+
+    def _publish(self, event):
+        event['id'] = next(self._event_ids)
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A stalled client is cut off; EventSource reconnects and the
+                # UI refetches what it shows
+                self._subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            expired = self.leases.expire()
+            if expired:
+                await self._loop.run_in_executor(self._executor, self._requeue, expired)
+
+    # -- HTTP --
+
+    async def start(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self._loop.create_task(self._sweep())
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                keep_alive = await self._dispatch(writer, *request)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        method, target, _ = line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError('request body too large')
+        body = await reader.readexactly(length) if length else b''
+        return method, target, headers, body
+
+    async def _respond(self, writer, status, body, content_type='application/json',
+                       keep_alive=True, extra_headers=''):
+        writer.write(('HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n'
+                      'Cache-Control: no-store\r\nConnection: %s\r\n%s\r\n' % (
+                          status, content_type, len(body),
+                          'keep-alive' if keep_alive else 'close',
+                          extra_headers)).encode('latin-1'))
+        writer.write(body)
+        await writer.drain()
+        return keep_alive
+
+    def _authorized(self, headers, query):
+        """True when no token is set or the request carries it"""
+        if self.token is None:
+            return True
+        supplied = query.get('token', [None])[0]
+        if supplied is None:
+            cookie = SimpleCookie()
+            try:
+                cookie.load(headers.get('cookie', ''))
+            except CookieError:
+                pass
+            if TOKEN_COOKIE in cookie:
+                supplied = cookie[TOKEN_COOKIE].value
+        return supplied is not None and hmac.compare_digest(
+            supplied.encode('utf-8'), self.token.encode('utf-8'))
+
+    async def _dispatch(self, writer, method, target, headers, body):
+        parts = urlsplit(target)
+        path = unquote(parts.path)
+        query = parse_qs(parts.query)
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        if not self._authorized(headers, query):
+            return await self._respond(writer, '401 Unauthorized',
+                                       b'{"error": "missing or wrong token"}', keep_alive=False)
+        if method == 'POST' and path.startswith('/api/'):
+            return await self._api_call(writer, path[5:], headers, body, keep_alive)
+        if method != 'GET':
+            return await self._respond(writer, '405 Method Not Allowed', b'{}', keep_alive=False)
+        if path in ('/', '/index.html'):
+            cookie = ''
+            if self.token is not None:
+                cookie = 'Set-Cookie: %s=%s; Path=/; HttpOnly; SameSite=Strict\r\n' % (
+                    TOKEN_COOKIE, self.token)
+            return await self._respond(writer, '200 OK', self._page, 'text/html; charset=utf-8',
+                                       keep_alive, cookie)
+        if path == '/events':
+            return await self._events(writer)
+        route, _, rest = path.lstrip('/').partition('/')
+        handler = self.api._server.routes.get(route)
+        if route == 'app':
+            handler = None
+        result = None
+        if handler is not None:
+            result = await self._loop.run_in_executor(
+                self._executor, handler, rest, query)
+        if result is None:
+            return await self._respond(writer, '404 Not Found', b'{}', keep_alive=keep_alive)
+        if isinstance(result, tuple):
+            return await self._respond(writer, '200 OK', result[0], result[1], keep_alive)
+        return await self._send_file(writer, result, keep_alive)
+
+    async def _api_call(self, writer, name, headers, body, keep_alive):
+        client = headers.get('x-client-id') or 'anonymous'
+        try:
+            args = json.loads(body or b'[]')
+            if not isinstance(args, list):
+                raise ValueError('arguments must be a JSON list')
+            # Includes the wait for a pool thread, unlike the api.* timings
+            with span('server.api', 'server'):
+                result = await self._loop.run_in_executor(
+                    self._executor, self.call, client, name, args)
+            status, payload = '200 OK', {'result': result}
+        except LeaseConflict as e:
+            status, payload = '409 Conflict', {'error': str(e)}
+        except PermissionError as e:
+            status, payload = '403 Forbidden', {'error': str(e)}
+        except (ValueError, TypeError, KeyError) as e:
+            status, payload = '400 Bad Request', {'error': '%s: %s' % (type(e).__name__, e)}
+        except Exception as e:
+            # Keep-alive clients and the fetch shim always get an answer
+            log.exception('Error in %s', name)
+            status, payload = '500 Internal Server Error', {
+                'error': '%s: %s' % (type(e).__name__, e)}
+        try:
+            data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        except (TypeError, ValueError) as e:
+            status = '500 Internal Server Error'
+            data = json.dumps({'error': 'result is not JSON: %s' % e}).encode('utf-8')
+        return await self._respond(writer, status, data, keep_alive=keep_alive)
+
+    async def _send_file(self, writer, path, keep_alive):
+        import mimetypes
+
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return await self._respond(writer, '404 Not Found', b'{}', keep_alive=keep_alive)
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            writer.write(('HTTP/1.1 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\n'
+                          'Cache-Control: private, max-age=3600\r\n\r\n' % (
+                              content_type, size)).encode('latin-1'))
+            await writer.drain()
+            await self._loop.sendfile(writer.transport, f)
+        return keep_alive
+
+    async def _events(self, writer):
+        queue = asyncio.Queue(EVENT_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                     b'Cache-Control: no-store\r\nConnection: close\r\n\r\n')
+        try:
+            await writer.drain()
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    writer.write(b': ping\n\n')
+                else:
+                    # Send everything queued behind it in the same write
+                    events = [event]
+                    while not queue.empty():
+                        events.append(queue.get_nowait())
+                    if None in events:
+                        break
+                    writer.write(b''.join(b'data: %s\n\n' % json.dumps(event).encode('utf-8')
+                                          for event in events))
+                await writer.drain()
+        finally:
+            self._subscribers.discard(queue)
+        return False
+
+
+def add_arguments(parser):
+    """Add the --serve options to an app's command line"""
+    parser.add_argument('--serve', metavar='DATASET',
+                        help='serve the UI over HTTP to several annotators instead of '
+                             'opening a window')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (0.0.0.0 for the whole network)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--token', default=os.environ.get('ANNOTATION_SERVER_TOKEN'),
+                        help='session token clients must present (default: '
+                             '$ANNOTATION_SERVER_TOKEN; generated off loopback)')
+    parser.add_argument('--lease-seconds', type=int, default=LEASE_SECONDS,
+                        help='how long a handed-out image stays reserved')
+    return parser
+
+
+def is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def serve(api_class, html, args):
+    """Open args.serve with a fresh api_class and serve html until interrupted"""
+    from annotation_web.image_server import ImageServer
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    token = args.token
+    if token is None and not is_loopback(args.host):
+        # Anyone who can reach the port could otherwise edit the dataset
+        token = secrets.token_urlsafe(16)
+
+    # Routes are dispatched by CollabServer itself; URLs stay relative so
+    # they resolve against whatever host the browser connected to
+    image_server = ImageServer()
+    image_server.public_base = ''
+    api = api_class(image_server)
+    api.open_directory(args.serve)
+    server = CollabServer(api, html, args.lease_seconds, token=token)
+
+    async def run():
+        host, port = await server.start(args.host, args.port)
+        url = 'http://%s:%d' % (host, port)
+        if token is not None:
+            url += '/?token=' + quote(token)
+        print('Serving %s on %s' % (api._index.root, url), flush=True)
+        await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api._shutdown()
+        image_server.stop()
+    return 0
+
+
+def parse_args(description, argv=None):
+    return add_arguments(argparse.ArgumentParser(description=description)).parse_args(argv)
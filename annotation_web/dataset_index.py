@@ -0,0 +1,511 @@
+"""Persistent index of the images under a dataset root.
+
+The index is an SQLite manifest recording path, size, mtime and pixel
+dimensions for every image. Opening a folder again only stats the tree and
+re-reads headers of files whose size or mtime changed, so a 500k-image
+dataset reopens in seconds instead of being re-enumerated by the browser.
+Content and perceptual hashes (see annotation_web.dedup) are stored on the
+same rows and cleared whenever a file changes.
+
+Videos are listed one row per frame (see annotation_web.video). A videos
+table remembers each video's size, mtime and frame count, so unchanged
+videos are neither demuxed nor re-listed on a rescan.
+"""
+import hashlib
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from annotation_web.image_server import is_image_file
+from annotation_web.video import frame_path, is_video_file, video_index
+
+BATCH_SIZE = 1024
+# Page cursors remembered by list_images before the memo is reset
+MAX_CURSORS = 4096
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    content_id TEXT,
+    phash INTEGER
+);
+CREATE TABLE IF NOT EXISTS videos (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    frames INTEGER NOT NULL
+);
+'''
+
+# Columns added after the first release; older manifests are migrated in place
+_ADDED_COLUMNS = (('content_id', 'TEXT'), ('phash', 'INTEGER'))
+
+_UPSERT = ('INSERT INTO images (path, size, mtime_ns, width, height) '
+           'VALUES (?, ?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET '
+           'size=excluded.size, mtime_ns=excluded.mtime_ns, '
+           'width=excluded.width, height=excluded.height, '
+           'content_id=NULL, phash=NULL')
+
+_COLUMNS = ('id', 'path', 'size', 'mtime_ns', 'width', 'height', 'content_id', 'phash')
+_SELECT = 'SELECT ' + ', '.join(_COLUMNS) + ' FROM images'
+
+
+def _to_signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value is not None and value >= 1 << 63 else value
+
+
+def _to_unsigned(value):
+    return value & ((1 << 64) - 1) if value is not None else None
+
+
+def default_cache_dir(*parts):
+    """Return (and create) a directory under the per-user annotation cache"""
+    base = os.environ.get('ANNOTATION_CACHE_DIR') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+        'annotation_web',
+    )
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _scan_directory(directory, root):
+    """Return ([(relpath, size, mtime_ns)], [subdirectory]) for one directory"""
+    files, subdirs = [], []
+    # Entries are joined onto directory, itself under root: slicing is far
+    # cheaper than os.path.relpath on a million files
+    strip = len(os.path.join(root, ''))
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif (is_image_file(entry.name) or is_video_file(entry.name)) and entry.is_file():
+                        st = entry.stat()
+                        files.append((entry.path[strip:], st.st_size, st.st_mtime_ns))
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return files, subdirs
+
+
+def scan_tree(root, workers=1):
+    """Yield (relpath, size, mtime_ns) for every image and video under root
+
+    With workers > 1 directories are listed concurrently; scandir and stat
+    release the GIL, which matters for ImageFolder trees of many class
+    directories. Order is not defined either way.
+    """
+    if workers <= 1:
+        stack = [root]
+        while stack:
+            files, subdirs = _scan_directory(stack.pop(), root)
+            stack.extend(subdirs)
+            yield from files
+        return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scan') as pool:
+        pending = {pool.submit(_scan_directory, root, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                pending.update(pool.submit(_scan_directory, d, root) for d in subdirs)
+                yield from files
+
+
+def _jpeg_size(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            h, w = struct.unpack('>xHH', f.read(5))
+            return w, h
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_image_size(path):
+    """Return (width, height) by reading only the file header
+
+    PNG, GIF, BMP, WebP and JPEG are parsed directly; other formats fall back
+    to Pillow when it is installed. (None, None) means unknown.
+    """
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(32)
+            if head.startswith(b'\x89PNG\r\n\x1a\n'):
+                return struct.unpack('>II', head[16:24])
+            if head[:6] in (b'GIF87a', b'GIF89a'):
+                return struct.unpack('<HH', head[6:10])
+            if head.startswith(b'BM'):
+                w, h = struct.unpack('<ii', head[18:26])
+                return w, abs(h)
+            if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+                chunk = head[12:16]
+                if chunk == b'VP8 ':
+                    w, h = struct.unpack('<HH', head[26:30])
+                    return w & 0x3FFF, h & 0x3FFF
+                if chunk == b'VP8L':
+                    bits = struct.unpack('<I', head[21:25])[0]
+                    return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+                if chunk == b'VP8X':
+                    return (int.from_bytes(head[24:27], 'little') + 1,
+                            int.from_bytes(head[27:30], 'little') + 1)
+            if head[:2] == b'\xff\xd8':
+                size = _jpeg_size(f)
+                if size:
+                    return size
+    except (OSError, struct.error):
+        return None, None
+
+    try:
+        from PIL import Image
+    except ImportError:
+        return None, None
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except Exception:
+        return None, None
+
+
+class DatasetIndex:
+    """SQLite-backed manifest of the images under root"""
+
+    def __init__(self, root, manifest_path=None):
+        self.root = os.path.realpath(root)
+        if manifest_path is None:
+            digest = hashlib.sha1(self.root.encode('utf-8')).hexdigest()[:16]
+            manifest_path = os.path.join(default_cache_dir('indexes'), digest + '.sqlite')
+        self.manifest_path = manifest_path
+        self._lock = threading.RLock()
+        # Per-filter row counts, and {(pattern, offset): path before it} for
+        # keyset paging; both are dropped whenever rows are added or removed
+        self._counts = {}
+        self._cursors = {}
+        self._conn = sqlite3.connect(manifest_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        existing = {row[1] for row in self._conn.execute('PRAGMA table_info(images)')}
+        for name, kind in _ADDED_COLUMNS:
+            if name not in existing:
+                self._conn.execute('ALTER TABLE images ADD COLUMN %s %s' % (name, kind))
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS images_content_id ON images (content_id)')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    def scan(self, workers=8):
+        """Bring the manifest in line with the tree and return a summary"""
+        started = time.perf_counter()
+        with self._lock:
+            known = {
+                path: (size, mtime_ns)
+                for path, size, mtime_ns in self._conn.execute(
+                    'SELECT path, size, mtime_ns FROM images')
+            }
+            known_videos = {
+                path: (size, mtime_ns, frames)
+                for path, size, mtime_ns, frames in self._conn.execute(
+                    'SELECT path, size, mtime_ns, frames FROM videos')
+            }
+        added = updated = 0
+        pending = []
+        changed_videos = []
+
+        def flush():
+            full_paths = [os.path.join(self.root, p) for p, _, _ in pending]
+            sizes = pool.map(read_image_size, full_paths)
+            rows = [(p, s, m, w, h) for (p, s, m), (w, h) in zip(pending, sizes)]
+            with self._lock, self._conn:
+                self._conn.executemany(_UPSERT, rows)
+                self._rows_changed()
+            pending.clear()
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for relpath, size, mtime_ns in scan_tree(self.root, workers):
+                if is_video_file(relpath):
+                    previous = known_videos.pop(relpath, None)
+                    if previous is not None and previous[:2] == (size, mtime_ns):
+                        for number in range(previous[2]):
+                            known.pop(frame_path(relpath, number), None)
+                    else:
+                        changed_videos.append(
+                            (relpath, size, mtime_ns, previous[2] if previous else 0))
+                    continue
+                previous = known.pop(relpath, None)
+                if previous == (size, mtime_ns):
+                    continue
+                if previous is None:
+                    added += 1
+                else:
+                    updated += 1
+                pending.append((relpath, size, mtime_ns))
+                if len(pending) >= BATCH_SIZE:
+                    flush()
+            if pending:
+                flush()
+            if changed_videos:
+                video_added, video_updated = self._add_videos(changed_videos, known, pool)
+                added += video_added
+                updated += video_updated
+
+        if known_videos:
+            with self._lock, self._conn:
+                self._conn.executemany('DELETE FROM videos WHERE path = ?',
+                                       ((p,) for p in known_videos))
+                self._rows_changed()
+        if known:
+            with self._lock, self._conn:
+                self._conn.executemany('DELETE FROM images WHERE path = ?',
+                                       ((p,) for p in known))
+                self._rows_changed()
+
+        return {
+            'root': self.root,
+            'total': len(self),
+            'added': added,
+            'updated': updated,
+            'removed': len(known),
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+
+    def _add_videos(self, videos, known, pool):
+        """Index new or changed videos and upsert a row per frame
+
+        videos are (relpath, size, mtime_ns, frames indexed before). Frames
+        listed before and still present are popped from known; without PyAV
+        a video keeps its previous frames and row until it can be decoded.
+        Returns (added, updated) frame counts.
+        """
+        def load(video):
+            try:
+                return video_index(os.path.join(self.root, video[0]))
+            except ImportError:
+                return None
+            except Exception as e:
+                # Not decodable; remembered with no frames until it changes
+                print('Skipping video %s: %s' % (video[0], e), file=sys.stderr)
+                return False
+
+        added = updated = skipped = 0
+        for (relpath, size, mtime_ns, previous), index in zip(videos, pool.map(load, videos)):
+            if index is None:
+                skipped += 1
+                for number in range(previous):
+                    known.pop(frame_path(relpath, number), None)
+                continue
+            frames = len(index) if index else 0
+            rows = []
+            for number in range(frames):
+                path = frame_path(relpath, number)
+                if known.pop(path, None) is None:
+                    added += 1
+                else:
+                    updated += 1
+                rows.append((path, size, mtime_ns, index.width, index.height))
+            with self._lock, self._conn:
+                for start in range(0, len(rows), BATCH_SIZE):
+                    self._conn.executemany(_UPSERT, rows[start:start + BATCH_SIZE])
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO videos (path, size, mtime_ns, frames) '
+                    'VALUES (?, ?, ?, ?)', (relpath, size, mtime_ns, frames))
+                self._rows_changed()
+        if skipped:
+            print('Skipping %d video(s): PyAV is not installed (pip install av)' % skipped,
+                  file=sys.stderr)
+        return added, updated
+
+    def get(self, path):
+        """Return the manifest row for path as a dict, or None"""
+        with self._lock:
+            row = self._conn.execute(_SELECT + ' WHERE path = ?', (path,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def _rows_changed(self):
+        # Called with the lock held
+        self._counts.clear()
+        self._cursors.clear()
+
+    def count(self, pattern=None):
+        """Return the number of images whose path matches pattern
+
+        A filtered count scans the table, so it is cached per pattern until
+        the next scan adds or removes rows.
+        """
+        pattern = pattern or None
+        where, params = self._filter_clause(pattern)
+        with self._lock:
+            if pattern not in self._counts:
+                self._counts[pattern] = self._conn.execute(
+                    'SELECT COUNT(*) FROM images' + where, params).fetchone()[0]
+            return self._counts[pattern]
+
+    def list_images(self, offset=0, limit=100, pattern=None):
+        """Return one page of manifest rows ordered by path
+
+        pattern is a case-insensitive substring, or a glob when it contains
+        any of *?[. The last path of every page served is remembered, so the
+        page after it is read by keyset (path > cursor) from the path index.
+        An offset no page has ended at yet falls back to OFFSET, which costs
+        a walk over the rows before it.
+        """
+        pattern = pattern or None
+        where, params = self._filter_clause(pattern)
+        with self._lock:
+            cursor = self._cursors.get((pattern, offset)) if offset else None
+            if cursor is not None:
+                rows = self._conn.execute(
+                    _SELECT + (where + ' AND' if where else ' WHERE') + ' path > ?'
+                    ' ORDER BY path LIMIT ?', params + (cursor, limit)).fetchall()
+            else:
+                rows = self._conn.execute(
+                    _SELECT + where + ' ORDER BY path LIMIT ? OFFSET ?',
+                    params + (limit, offset)).fetchall()
+            if rows:
+                if len(self._cursors) >= MAX_CURSORS:
+                    self._cursors.clear()
+                self._cursors[pattern, offset + len(rows)] = rows[-1][1]
+        return [self._row_to_dict(row) for row in rows]
+
+    def position(self, path):
+        """Return the offset of path in list_images order, or None"""
+        with self._lock:
+            if self._conn.execute('SELECT 1 FROM images WHERE path = ?', (path,)).fetchone() is None:
+                return None
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM images WHERE path < ?', (path,)).fetchone()[0]
+
+    def paths(self, pattern=None):
+        """Return every indexed path matching pattern, ordered by path"""
+        where, params = self._filter_clause(pattern)
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                'SELECT path FROM images' + where + ' ORDER BY path', params)]
+
+    def paths_under(self, folder):
+        """Return the paths inside folder (relative to root), recursively"""
+        prefix = folder.strip('/\\')
+        if not prefix:
+            return self.paths()
+        prefix += os.sep
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                'SELECT path FROM images WHERE substr(path, 1, ?) = ? ORDER BY path',
+                (len(prefix), prefix))]
+
+    def siblings(self, path):
+        """Return the rows directly beside path, its own included, ordered by path
+
+        These are the frames of the same video, or the images in the same
+        folder without descending into subfolders.
+        """
+        folder = os.path.dirname(path)
+        prefix = folder + os.sep if folder else ''
+        with self._lock:
+            rows = self._conn.execute(
+                _SELECT + ' WHERE substr(path, 1, ?) = ? AND instr(substr(path, ?), ?) = 0'
+                ' ORDER BY path', (len(prefix), prefix, len(prefix) + 1, os.sep)).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def existing_paths(self, paths):
+        """Return the subset of paths that are in the index, in input order"""
+        paths = list(paths)
+        found = set()
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                found.update(row[0] for row in self._conn.execute(
+                    'SELECT path FROM images WHERE path IN (%s)' % ','.join('?' * len(chunk)),
+                    chunk))
+        return [path for path in paths if path in found]
+
+    def iter_images(self):
+        """Yield every manifest row as a dict, ordered by path"""
+        with self._lock:
+            rows = self._conn.execute(_SELECT + ' ORDER BY path').fetchall()
+        for row in rows:
+            yield self._row_to_dict(row)
+
+    def unhashed(self, limit, after_id=0):
+        """Return up to limit rows after after_id that have no content_id yet"""
+        with self._lock:
+            rows = self._conn.execute(
+                _SELECT + ' WHERE content_id IS NULL AND id > ? ORDER BY id LIMIT ?',
+                (after_id, limit)).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def set_hashes(self, rows):
+        """Store [(id, content_id, phash)] computed by annotation_web.dedup"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'UPDATE images SET content_id = ?, phash = ? WHERE id = ?',
+                ((cid, _to_signed(phash), row_id) for row_id, cid, phash in rows))
+
+    def hashes(self):
+        """Return [(path, content_id, phash)] for every hashed image"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT path, content_id, phash FROM images '
+                'WHERE content_id IS NOT NULL ORDER BY path').fetchall()
+        return [(path, cid, _to_unsigned(phash)) for path, cid, phash in rows]
+
+    def paths_for_content(self, content_id):
+        """Return every path whose bytes hash to content_id"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                'SELECT path FROM images WHERE content_id = ? ORDER BY path', (content_id,))]
+
+    def content_ids(self):
+        """Return {content_id: first path} over the hashed images"""
+        ids = {}
+        with self._lock:
+            for path, cid in self._conn.execute(
+                    'SELECT path, content_id FROM images '
+                    'WHERE content_id IS NOT NULL ORDER BY path'):
+                ids.setdefault(cid, path)
+        return ids
+
+    @staticmethod
+    def _filter_clause(pattern):
+        if not pattern:
+            return '', ()
+        if any(c in pattern for c in '*?['):
+            return ' WHERE path GLOB ?', (pattern,)
+        return ' WHERE instr(lower(path), ?) > 0', (pattern.lower(),)
+
+    @staticmethod
+    def _row_to_dict(row):
+        row = dict(zip(_COLUMNS, row))
+        row['phash'] = _to_unsigned(row['phash'])
+        return row
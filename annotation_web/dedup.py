@@ -0,0 +1,216 @@
+"""Exact and near-duplicate detection for the images in a DatasetIndex.
+
+Every indexed file gets two hashes, stored next to its manifest row:
+
+  * content_id, a streamed BLAKE2b digest of the file bytes. Identical
+    files share it no matter where they live or what they are called, so
+    annotations keyed by it are made once and never collide between
+    same-named files in different folders.
+  * phash, a 64-bit difference hash of a 9x8 greyscale thumbnail. Re-encoded
+    or slightly edited copies of a frame land within a few bits of each other.
+
+Only rows added or changed since the last run are hashed. Near-duplicate
+lookup goes through a BK-tree over the perceptual hashes, which prunes by
+the triangle inequality instead of comparing every pair.
+"""
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from annotation_web.instrumentation import span
+from annotation_web.video import open_image, split_frame_path
+
+HASH_CHUNK_SIZE = 1024 * 1024
+HASH_BATCH_SIZE = 256
+DEFAULT_RADIUS = 6
+# Perceptual hashes are skipped for images the viewer shows through tiles
+PHASH_MAX_EDGE = 8192
+
+
+def content_id(path):
+    """Return a hex digest of the file contents, read in chunks"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def dhash(path, hash_size=8):
+    """Return the difference hash of an image as an unsigned int"""
+    from PIL import Image
+
+    with open_image(path) as img:
+        img.draft('L', (hash_size * 8, hash_size * 8))
+        small = img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+        pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hash_file(path, perceptual=True):
+    """Return (content_id, phash) for one file; phash is None if undecodable"""
+    phash = None
+    with span('hash.file'):
+        if perceptual:
+            try:
+                phash = dhash(path)
+            except Exception:
+                phash = None
+        return content_id(path), phash
+
+
+def _hash_job(job):
+    path, perceptual = job
+    try:
+        return hash_file(path, perceptual)
+    except OSError:
+        return None, None
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes under Hamming distance"""
+
+    def __init__(self, items=()):
+        # Each node is [hash, values, {distance: child}]
+        self._root = None
+        self._size = 0
+        for value, item in items:
+            self.add(value, item)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, value, item):
+        self._size += 1
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+        node = self._root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, radius):
+        """Return [(distance, item)] within radius of value, nearest first"""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                found.extend((d, item) for item in node[1])
+            for edge, child in node[2].items():
+                if d - radius <= edge <= d + radius:
+                    stack.append(child)
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+
+def hash_images(index, workers=None, processes=True):
+    """Hash every index row missing hashes and return how many were hashed
+
+    Decoding runs in a process pool by default. Inside the desktop apps pass
+    processes=False: hashlib and Pillow release the GIL, and a process pool
+    would fork the webview.
+    """
+    pool_type = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    hashed = last_id = 0
+    video_ids = {}
+    with pool_type(max_workers=workers or os.cpu_count()) as pool:
+        while True:
+            # Paged by id so unreadable files are not retried forever
+            rows = index.unhashed(HASH_BATCH_SIZE, after_id=last_id)
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            frames = [row for row in rows if split_frame_path(row['path']) is not None]
+            files = [row for row in rows if split_frame_path(row['path']) is None]
+            jobs = [(os.path.join(index.root, row['path']),
+                     not row['width'] or max(row['width'], row['height'] or 0) <= PHASH_MAX_EDGE)
+                    for row in files]
+            results = list(pool.map(_hash_job, jobs))
+            results.extend(frame_content_id(os.path.join(index.root, row['path']), video_ids)
+                           for row in frames)
+            index.set_hashes([(row['id'], cid, phash)
+                              for row, (cid, phash) in zip(files + frames, results)])
+            hashed += len(rows)
+    return hashed
+
+
+def frame_content_id(path, video_ids):
+    """Return (content_id, None) for a video frame path
+
+    The ID derives from the video's content hash, computed once per video
+    and kept in video_ids, and the frame number. Decoding every frame for a
+    perceptual hash would cost more than the rest of the import, so frames
+    have none.
+    """
+    video, number = split_frame_path(path)
+    video_id = video_ids.get(video)
+    if video_id is None:
+        try:
+            video_id = video_ids[video] = content_id(video)
+        except OSError:
+            return None, None
+    return '%s-%d' % (video_id, number), None
+
+
+def exact_duplicates(index):
+    """Return [[path, ...]] groups of byte-identical files"""
+    groups = {}
+    for path, cid, _ in index.hashes():
+        if cid is not None:
+            groups.setdefault(cid, []).append(path)
+    return [paths for paths in groups.values() if len(paths) > 1]
+
+
+def build_tree(index):
+    """Return a BKTree of (phash, path) over the indexed images"""
+    return BKTree((phash, path) for path, _, phash in index.hashes() if phash is not None)
+
+
+def near_duplicates(index, radius=DEFAULT_RADIUS, tree=None):
+    """Return [[path, ...]] clusters of images within radius bits of each other
+
+    Clusters are connected components, so a chain of small edits ends up in
+    one group even when its ends are further apart than radius.
+    """
+    items = [(path, phash) for path, _, phash in index.hashes() if phash is not None]
+    if tree is None:
+        tree = BKTree((phash, path) for path, phash in items)
+    parent = {path: path for path, _ in items}
+
+    def find(item):
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    for path, phash in items:
+        for _, other in tree.search(phash, radius):
+            if other not in parent:
+                continue
+            a, b = find(path), find(other)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+
+    clusters = {}
+    for item in parent:
+        clusters.setdefault(find(item), []).append(item)
+    return [sorted(paths) for paths in clusters.values() if len(paths) > 1]
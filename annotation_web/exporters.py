@@ -0,0 +1,432 @@
+"""Convert saved annotations to COCO JSON, YOLO txt and Pascal VOC XML.
+
+Two inputs are understood: the {image: [annotation, ...]} mapping written by
+the annotation tool, whose boxes are in canvas space (a single-image export
+of cv-annotation-tool.html is read as one; see
+annotation_web.validation.expand_document), and the flat
+[{filename, label, verified}] list written by the checker. Detection input
+is loaded into an annotation_web.model.AnnotationTable and every shape is
+mapped back to image pixels in one vectorized pass, with the same
+scale/offset math as drawCanvas. Polygons also export their outline as a
+COCO segmentation; points have no extent and are skipped.
+
+Records are consumed as a stream and written out per image. COCO goes to a
+single file with the annotations spooled to a temporary file; YOLO and VOC
+write one file per image from a process pool, a batch at a time, so memory
+stays bounded however many boxes are exported.
+
+    python -m annotation_web.exporters annotations.json out/ --format yolo --images DATASET
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from annotation_web.dataset_index import read_image_size
+from annotation_web.model import IMAGE_SPACE, KINDS, AnnotationTable
+from annotation_web.validation import expand_document
+
+# Fixed backing size of the annotation canvas in annotation_app.py
+CANVAS_WIDTH = 800
+CANVAS_HEIGHT = 600
+BATCH_SIZE = 500
+
+ExportImage = namedtuple('ExportImage', 'file_name width height objects')
+# bbox is (x, y, width, height) in image pixels, or None for a class label;
+# segmentation is a polygon's flat [x0, y0, x1, y1, ...] pixel outline
+ExportObject = namedtuple('ExportObject', 'label bbox segmentation', defaults=(None,))
+
+
+def canvas_to_pixels(ann, image_width, image_height,
+                     canvas_width=CANVAS_WIDTH, canvas_height=CANVAS_HEIGHT):
+    """Map a canvas-space box or circle to a clipped pixel-space bbox
+
+    The image is drawn fitted and centred in the canvas at the zoom active
+    when the box was drawn (recorded on the annotation, default 1).
+    Annotations drawn on tiled images are already in image space
+    ('space': 'image') and are only clipped.
+    """
+    if ann.get('space') == 'image':
+        scale, offset_x, offset_y = 1, 0, 0
+    else:
+        zoom = ann.get('zoom') or 1
+        scale = min(canvas_width / image_width, canvas_height / image_height)
+        offset_x = (canvas_width / zoom - image_width * scale) / 2
+        offset_y = (canvas_height / zoom - image_height * scale) / 2
+
+    x, y, w, h = ann['x'], ann['y'], ann['width'], ann['height']
+    if ann.get('type') == 'circle':
+        radius = max(abs(w), abs(h)) / 2
+        cx, cy = x + w / 2, y + h / 2
+        x, y, w, h = cx - radius, cy - radius, 2 * radius, 2 * radius
+
+    x0 = min(max((x - offset_x) / scale, 0), image_width)
+    y0 = min(max((y - offset_y) / scale, 0), image_height)
+    x1 = min(max((x + w - offset_x) / scale, 0), image_width)
+    y1 = min(max((y + h - offset_y) / scale, 0), image_height)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def pixels_to_canvas(bbox, image_width, image_height,
+                     canvas_width=CANVAS_WIDTH, canvas_height=CANVAS_HEIGHT):
+    """Map a pixel-space (x, y, w, h) bbox to canvas space at zoom 1"""
+    scale = min(canvas_width / image_width, canvas_height / image_height)
+    offset_x = (canvas_width - image_width * scale) / 2
+    offset_y = (canvas_height - image_height * scale) / 2
+    x, y, w, h = bbox
+    return x * scale + offset_x, y * scale + offset_y, w * scale, h * scale
+
+
+def directory_size_lookup(images_dir):
+    """Return a lookup resolving image keys to (path, width, height) on disk"""
+    by_name = {}
+
+    def lookup(key):
+        path = os.path.join(images_dir, key)
+        if not os.path.isfile(path):
+            if not by_name:
+                for root, _, files in os.walk(images_dir):
+                    for name in files:
+                        by_name.setdefault(name, os.path.join(root, name))
+            path = by_name.get(os.path.basename(key))
+            if path is None:
+                return None
+        width, height = read_image_size(path)
+        if not width:
+            return None
+        return os.path.relpath(path, images_dir), width, height
+
+    return lookup
+
+
+def index_size_lookup(index):
+    """Return a lookup resolving image keys through a DatasetIndex"""
+    rows = {}
+    for row in index.iter_images():
+        entry = (row['path'], row['width'], row['height'])
+        rows[row['path']] = entry
+        rows.setdefault(os.path.basename(row['path']), entry)
+        if row['content_id']:
+            rows.setdefault(row['content_id'], entry)
+
+    def lookup(key):
+        entry = rows.get(key)
+        if entry is None or not entry[1]:
+            return None
+        return entry
+
+    return lookup
+
+
+def detection_records(annotations, lookup):
+    """Yield ExportImage records from {image: [canvas annotation, ...]}"""
+    return annotation_records(AnnotationTable.from_document(annotations), lookup,
+                              images=list(annotations))
+
+
+def annotation_records(table, lookup, images=None):
+    """Yield ExportImage records for the images of an AnnotationTable
+
+    images defaults to every image with annotations. The pixel boxes of all
+    rows are computed at once, vectorizing canvas_to_pixels.
+    """
+    table = table.compacted()
+    rows = table.rows
+    names = table.images.names
+    # Compacted rows are grouped by image in code order
+    bounds = np.searchsorted(rows['image'], np.arange(len(names) + 1)).tolist()
+    codes = range(len(names)) if images is None else [table.images.get(i) for i in images]
+    resolved = {}
+    image_width = np.full(len(names), np.nan)
+    image_height = np.full(len(names), np.nan)
+    for code in codes:
+        if code < 0 or code in resolved or (images is None and bounds[code] == bounds[code + 1]):
+            continue
+        resolved[code] = lookup(names[code])
+        if resolved[code] is not None:
+            image_width[code], image_height[code] = resolved[code][1:]
+
+    w_img = image_width[rows['image']]
+    h_img = image_height[rows['image']]
+    image_space = (rows['flags'] & IMAGE_SPACE) != 0
+    zoom = np.where(rows['zoom'] > 0, rows['zoom'], 1.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.where(image_space, 1.0,
+                         np.minimum(CANVAS_WIDTH / w_img, CANVAS_HEIGHT / h_img))
+        offset_x = np.where(image_space, 0.0, (CANVAS_WIDTH / zoom - w_img * scale) / 2)
+        offset_y = np.where(image_space, 0.0, (CANVAS_HEIGHT / zoom - h_img * scale) / 2)
+
+        x, y, w, h = rows['x'], rows['y'], rows['width'], rows['height']
+        circle = rows['kind'] == KINDS.index('circle')
+        radius = np.maximum(np.abs(w), np.abs(h)) / 2
+        x = np.where(circle, x + w / 2 - radius, x)
+        y = np.where(circle, y + h / 2 - radius, y)
+        w = np.where(circle, 2 * radius, w)
+        h = np.where(circle, 2 * radius, h)
+        x0 = np.clip((x - offset_x) / scale, 0, w_img)
+        y0 = np.clip((y - offset_y) / scale, 0, h_img)
+        x1 = np.clip((x + w - offset_x) / scale, 0, w_img)
+        y1 = np.clip((y + h - offset_y) / scale, 0, h_img)
+        keep = (x1 - x0 > 0) & (y1 - y0 > 0) & (rows['label'] >= 0)
+
+        # Polygon vertices take the transform of the row they belong to
+        counts = rows['vertex_count'].astype(np.int64)
+        owner = np.repeat(np.arange(len(rows)), counts)
+        vertices = table.vertices
+        vx = np.clip((vertices[:, 0] - offset_x[owner]) / scale[owner], 0, w_img[owner])
+        vy = np.clip((vertices[:, 1] - offset_y[owner]) / scale[owner], 0, h_img[owner])
+    outline = np.stack([vx, vy], axis=1).ravel().tolist()
+
+    boxes = np.stack([x0, y0, x1 - x0, y1 - y0], axis=1).tolist()
+    keep = keep.tolist()
+    labels = rows['label'].tolist()
+    starts = (2 * rows['vertex_start']).tolist()
+    ends = (2 * (rows['vertex_start'] + counts)).tolist()
+    for code in codes:
+        if code not in resolved:
+            continue
+        if resolved[code] is None:
+            print('Skipping %s: image not found or size unknown' % names[code], file=sys.stderr)
+            continue
+        path, width, height = resolved[code]
+        objects = [ExportObject(table.labels.names[labels[row]], tuple(boxes[row]),
+                                outline[starts[row]:ends[row]] or None)
+                   for row in range(bounds[code], bounds[code + 1]) if keep[row]]
+        yield ExportImage(path, width, height, objects)
+
+
+def classification_records(entries, lookup):
+    """Yield ExportImage records from the checker's [{filename, label}] list"""
+    for entry in entries:
+        resolved = lookup(entry['filename'])
+        if resolved is None:
+            print('Skipping %s: image not found or size unknown' % entry['filename'],
+                  file=sys.stderr)
+            continue
+        path, width, height = resolved
+        yield ExportImage(path, width, height, [ExportObject(entry['label'], None)])
+
+
+def load_records(path, lookup):
+    """Load an exported annotation JSON file of either shape as records"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return classification_records(data, lookup)
+    data, sizes = expand_document(data)
+    if sizes:
+        find = lookup
+
+        def lookup(key):
+            # The export records its image size; the dataset folder still
+            # wins so output paths match the files on disk
+            found = find(key)
+            if found is None and key in sizes:
+                found = (key,) + tuple(sizes[key])
+            return found
+    return detection_records(data, lookup)
+
+
+def _polygon_area(flat):
+    """Shoelace area of a flat [x0, y0, x1, y1, ...] outline"""
+    xs, ys = flat[0::2], flat[1::2]
+    return abs(sum(xs[i - 1] * ys[i] - xs[i] * ys[i - 1] for i in range(len(xs)))) / 2
+
+
+def write_coco(records, out_path):
+    """Stream records into a single COCO JSON file"""
+    categories = {}
+    counts = {'images': 0, 'annotations': 0}
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    os.makedirs(out_dir, exist_ok=True)
+
+    with tempfile.TemporaryFile('w+', encoding='utf-8', dir=out_dir) as spool, \
+            open(out_path, 'w', encoding='utf-8') as out:
+        out.write('{"images":[')
+        for image_id, record in enumerate(records, 1):
+            if image_id > 1:
+                out.write(',')
+            json.dump({'id': image_id, 'file_name': record.file_name,
+                       'width': record.width, 'height': record.height}, out)
+            for obj in record.objects:
+                category_id = categories.setdefault(obj.label, len(categories) + 1)
+                ann = {'id': counts['annotations'] + 1, 'image_id': image_id,
+                       'category_id': category_id}
+                if obj.bbox is not None:
+                    x, y, w, h = (round(v, 2) for v in obj.bbox)
+                    ann.update(bbox=[x, y, w, h], area=round(w * h, 2), iscrowd=0)
+                if obj.segmentation:
+                    ann['segmentation'] = [[round(v, 2) for v in obj.segmentation]]
+                    ann['area'] = round(_polygon_area(obj.segmentation), 2)
+                if counts['annotations']:
+                    spool.write(',')
+                json.dump(ann, spool)
+                counts['annotations'] += 1
+            counts['images'] = image_id
+
+        out.write('],"annotations":[')
+        spool.seek(0)
+        shutil.copyfileobj(spool, out)
+        out.write('],"categories":')
+        json.dump([{'id': cid, 'name': name} for name, cid in categories.items()], out)
+        out.write('}')
+
+    counts['categories'] = len(categories)
+    return counts
+
+
+def _yolo_lines(record, class_ids):
+    lines = []
+    for obj in record.objects:
+        if obj.bbox is None:
+            continue
+        x, y, w, h = obj.bbox
+        lines.append('%d %.6f %.6f %.6f %.6f' % (
+            class_ids[obj.label],
+            (x + w / 2) / record.width, (y + h / 2) / record.height,
+            w / record.width, h / record.height))
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def _voc_document(record):
+    parts = [
+        '<annotation>',
+        '<filename>%s</filename>' % escape(os.path.basename(record.file_name)),
+        '<path>%s</path>' % escape(record.file_name),
+        '<size><width>%d</width><height>%d</height><depth>3</depth></size>' % (
+            record.width, record.height),
+    ]
+    for obj in record.objects:
+        if obj.bbox is None:
+            continue
+        x, y, w, h = obj.bbox
+        parts.append(
+            '<object><name>%s</name><difficult>0</difficult><bndbox>'
+            '<xmin>%d</xmin><ymin>%d</ymin><xmax>%d</xmax><ymax>%d</ymax>'
+            '</bndbox></object>' % (escape(obj.label), round(x), round(y),
+                                    round(x + w), round(y + h)))
+    parts.append('</annotation>\n')
+    return '\n'.join(parts)
+
+
+def _write_batch(out_dir, extension, batch, class_ids):
+    for record in batch:
+        stem = os.path.splitext(record.file_name)[0]
+        target = os.path.join(out_dir, stem + extension)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if extension == '.txt':
+            content = _yolo_lines(record, class_ids)
+        else:
+            content = _voc_document(record)
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(content)
+    return len(batch), sum(len(record.objects) for record in batch)
+
+
+def _write_per_image(records, out_dir, extension, workers):
+    os.makedirs(out_dir, exist_ok=True)
+    class_ids = {}
+    counts = {'images': 0, 'annotations': 0}
+
+    def batches():
+        batch = []
+        for record in records:
+            if any(obj.bbox is None for obj in record.objects):
+                raise ValueError('%s export only supports box annotations'
+                                 % ('YOLO' if extension == '.txt' else 'VOC'))
+            for obj in record.objects:
+                class_ids.setdefault(obj.label, len(class_ids))
+            batch.append(record)
+            if len(batch) >= BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def collect(result):
+        counts['images'] += result[0]
+        counts['annotations'] += result[1]
+
+    if workers == 1:
+        for batch in batches():
+            collect(_write_batch(out_dir, extension, batch, class_ids))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            inflight = []
+            max_inflight = 2 * (workers or os.cpu_count() or 1)
+            for batch in batches():
+                inflight.append(pool.submit(_write_batch, out_dir, extension, batch,
+                                            dict(class_ids)))
+                if len(inflight) >= max_inflight:
+                    collect(inflight.pop(0).result())
+            for future in inflight:
+                collect(future.result())
+
+    counts['categories'] = len(class_ids)
+    return counts, class_ids
+
+
+def write_yolo(records, out_dir, workers=None):
+    """Write one YOLO label file per image plus classes.txt"""
+    counts, class_ids = _write_per_image(records, out_dir, '.txt', workers)
+    with open(os.path.join(out_dir, 'classes.txt'), 'w', encoding='utf-8') as f:
+        f.writelines(name + '\n' for name in sorted(class_ids, key=class_ids.get))
+    return counts
+
+
+def write_voc(records, out_dir, workers=None):
+    """Write one Pascal VOC XML file per image"""
+    return _write_per_image(records, out_dir, '.xml', workers)[0]
+
+
+FORMATS = ('coco', 'yolo', 'voc')
+
+
+def export(records, fmt, out, workers=None):
+    """Write records in fmt to out (a file for COCO, a directory otherwise)"""
+    if fmt == 'coco':
+        return write_coco(records, out)
+    if fmt == 'yolo':
+        return write_yolo(records, out, workers)
+    if fmt == 'voc':
+        return write_voc(records, out, workers)
+    raise ValueError('Unknown export format: %s' % fmt)
+
+
+def build_parser(parser=None):
+    parser = parser or argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('annotations', help='annotation JSON exported by either tool')
+    parser.add_argument('output', help='output file (coco) or directory (yolo, voc)')
+    parser.add_argument('--format', choices=FORMATS, default='coco')
+    parser.add_argument('--images',
+                        help='dataset folder used to look up image sizes '
+                             '(optional for a cv-annotation-tool export, which records its size)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes writing per-image files (default: CPU count)')
+    return parser
+
+
+def run(args):
+    started = time.perf_counter()
+    lookup = directory_size_lookup(args.images) if args.images else lambda key: None
+    records = load_records(args.annotations, lookup)
+    counts = export(records, args.format, args.output, args.workers)
+    print('Exported %(images)d images, %(annotations)d annotations, '
+          '%(categories)d categories' % counts, 'in %.2fs' % (time.perf_counter() - started))
+    return 0
+
+
+def main(argv=None):
+    return run(build_parser().parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
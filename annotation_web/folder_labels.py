@@ -0,0 +1,89 @@
+"""Infer class labels from an ImageFolder-style layout and sidecar files.
+
+In root/<class>/image.jpg (optionally under a split such as train/ or
+val/) the label of an image is the nearest enclosing directory that is not
+a generic container name. A labels.csv or labels.json at the dataset root
+overrides that per file. CSV rows are "filename,label", with an optional
+header. JSON is either {filename: label} or the checker's exported
+[{filename, label}] list. Filenames may be relative paths or bare names.
+
+Inferred labels are a starting point: they count towards the class
+distribution but stay unverified until someone confirms them.
+"""
+import csv
+import json
+import os
+import sys
+
+from annotation_web.video import is_video_file
+
+SIDECAR_NAMES = ('labels.csv', 'labels.json')
+GENERIC_DIRS = frozenset((
+    'images', 'imgs', 'img', 'data', 'train', 'training', 'val', 'valid',
+    'validation', 'test', 'testing',
+))
+
+
+def folder_label(relpath):
+    """Return the class implied by the directories of relpath, or None"""
+    parts = relpath.replace('\\', '/').split('/')[:-1]
+    for name in reversed(parts):
+        # A video frame takes the label of the folder holding the video
+        if name.lower() not in GENERIC_DIRS and not is_video_file(name):
+            return name
+    return None
+
+
+def _read_csv(path):
+    labels = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        for i, row in enumerate(csv.reader(f)):
+            if len(row) < 2 or not row[0].strip():
+                continue
+            if i == 0 and row[1].strip().lower() in ('label', 'class', 'category'):
+                continue
+            labels[row[0].strip()] = row[1].strip()
+    return labels
+
+
+def _read_json(path):
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return {str(k): v for k, v in data.items() if isinstance(v, str) and v}
+    return {entry['filename']: entry['label'] for entry in data
+            if isinstance(entry, dict) and entry.get('filename') and entry.get('label')}
+
+
+def load_sidecars(root):
+    """Return {filename: label} from the sidecar files at root"""
+    labels = {}
+    for name in SIDECAR_NAMES:
+        path = os.path.join(root, name)
+        if not os.path.isfile(path):
+            continue
+        try:
+            labels.update(_read_csv(path) if name.endswith('.csv') else _read_json(path))
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            print('Ignoring sidecar %s: %s' % (path, e), file=sys.stderr)
+    return labels
+
+
+def infer_labels(paths, root):
+    """Return {relpath: label} for every path whose label can be inferred"""
+    sidecar = load_sidecars(root)
+    inferred = {}
+    # Every file in a directory gets the same folder label; work it out once
+    by_directory = {}
+    for path in paths:
+        directory, _, name = path.rpartition(os.sep)
+        label = None
+        if sidecar:
+            label = sidecar.get(path) or sidecar.get(name)
+        if label is None:
+            label = by_directory.get(directory)
+            if label is None:
+                label = by_directory[directory] = folder_label(path) or ''
+        if label:
+            inferred[path] = label
+    return inferred
@@ -0,0 +1,132 @@
+"""Precompile the embedded React apps into offline, static assets.
+
+The desktop apps embed their UI as a <script type="text/babel"> block and, by
+default, fetch React, Babel and the Tailwind CDN at every launch and
+transpile in the webview. This build step does that work once:
+
+  * the JSX is extracted from each app's HTML_CONTENT, transpiled and
+    minified with esbuild, and so is shared.jsx, once, for every page,
+  * Tailwind generates a CSS file containing only the classes the app uses,
+  * the React/ReactDOM (and lucide) production UMD builds are copied from
+    node_modules,
+
+and everything is written to annotation_web/frontend/dist/, which the apps
+serve locally when it exists (see annotation_web.assets).
+
+    cd annotation_web/frontend && npm install && python build.py
+"""
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(HERE))
+DIST_DIR = os.path.join(HERE, 'dist')
+SHARED_JSX = os.path.join(HERE, 'shared.jsx')
+NODE_BIN = os.path.join(HERE, 'node_modules', '.bin')
+
+# Bundle name -> module defining HTML_CONTENT
+APPS = {
+    'annotation_app': 'annotation_web.annotation_app',
+    'checker': 'test_model',
+}
+
+VENDOR_FILES = {
+    'react': 'react/umd/react.production.min.js',
+    'react-dom': 'react-dom/umd/react-dom.production.min.js',
+    'lucide': 'lucide/dist/umd/lucide.min.js',
+}
+
+PAGE_TEMPLATE = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>{title}</title>
+<link rel="stylesheet" href="{name}.css">
+{vendor_scripts}
+</head>
+<body>
+<div id="root"></div>
+<script src="shared.js"></script>
+<script src="{name}.js"></script>
+</body>
+</html>
+'''
+
+
+def _tool(name):
+    path = os.path.join(NODE_BIN, name + ('.cmd' if os.name == 'nt' else ''))
+    if not os.path.exists(path):
+        sys.exit('%s not found; run `npm install` in %s first' % (name, HERE))
+    return path
+
+
+def _load_html(module_name):
+    import importlib
+
+    sys.path.insert(0, REPO_ROOT)
+    return importlib.import_module(module_name).HTML_CONTENT
+
+
+def build_shared():
+    """Write shared.js, loaded by every page before its own script"""
+    # Without --format esbuild keeps the top-level names the apps refer to
+    subprocess.run(
+        [_tool('esbuild'), '--loader:.jsx=jsx', '--minify', '--target=es2018',
+         '--outfile=' + os.path.join(DIST_DIR, 'shared.js'), SHARED_JSX],
+        check=True)
+
+
+def build_app(name, html):
+    """Write <name>.js, <name>.css and <name>.html into DIST_DIR"""
+    jsx = re.search(r'<script type="text/babel">(.*?)</script>', html, re.S).group(1)
+    title = re.search(r'<title>(.*?)</title>', html, re.S).group(1)
+
+    subprocess.run(
+        [_tool('esbuild'), '--loader=jsx', '--minify', '--target=es2018',
+         '--outfile=' + os.path.join(DIST_DIR, name + '.js')],
+        input=jsx.encode('utf-8'), check=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        content = os.path.join(tmp, name + '.jsx')
+        with open(content, 'w', encoding='utf-8') as f:
+            f.write(jsx)
+        css_input = os.path.join(tmp, 'input.css')
+        with open(css_input, 'w', encoding='utf-8') as f:
+            f.write('@tailwind base;\n@tailwind components;\n@tailwind utilities;\n')
+        subprocess.run(
+            [_tool('tailwindcss'), '--input', css_input, '--content', content,
+             '--output', os.path.join(DIST_DIR, name + '.css'), '--minify'],
+            check=True)
+
+    vendors = ['react', 'react-dom'] + (['lucide'] if 'lucide' in html else [])
+    scripts = '\n'.join('<script src="vendor/%s.js"></script>' % v for v in vendors)
+    with open(os.path.join(DIST_DIR, name + '.html'), 'w', encoding='utf-8') as f:
+        f.write(PAGE_TEMPLATE.format(title=title, name=name, vendor_scripts=scripts))
+
+
+def copy_vendor():
+    vendor_dir = os.path.join(DIST_DIR, 'vendor')
+    os.makedirs(vendor_dir, exist_ok=True)
+    for name, relpath in VENDOR_FILES.items():
+        shutil.copyfile(os.path.join(HERE, 'node_modules', relpath),
+                        os.path.join(vendor_dir, name + '.js'))
+
+
+def main():
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    os.makedirs(DIST_DIR)
+    copy_vendor()
+    build_shared()
+    for name, module_name in APPS.items():
+        build_app(name, _load_html(module_name))
+        print('built', name)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
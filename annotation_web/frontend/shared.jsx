@@ -0,0 +1,76 @@
+// Helpers both apps share. annotation_web.assets inlines this file ahead of
+// each app's own script, and frontend/build.py compiles it once to
+// dist/shared.js for the bundled pages. Every top-level name here is global
+// to the page, so React hooks are referenced as React.* rather than
+// destructured a second time.
+
+const PAGE_SIZE = 200;
+
+// Image records are fetched from the Python index one page at a time,
+// so only the windows the UI actually shows ever reach React state.
+// Without the desktop bridge the hook wraps a local array instead.
+const useImagePages = () => {
+  const [total, setTotal] = React.useState(0);
+  const [pages, setPages] = React.useState({});
+  const localRef = React.useRef(null);
+  const requested = React.useRef(new Set());
+  const generation = React.useRef(0);
+
+  const reset = (count) => {
+    generation.current += 1;
+    requested.current = new Set();
+    localRef.current = null;
+    setPages({});
+    setTotal(count);
+  };
+
+  const appendLocal = (items) => {
+    localRef.current = [...(localRef.current || []), ...items];
+    setTotal(localRef.current.length);
+  };
+
+  const getImage = (idx) => {
+    if (localRef.current) return localRef.current[idx];
+    const page = pages[Math.floor(idx / PAGE_SIZE)];
+    return page && page[idx % PAGE_SIZE];
+  };
+
+  const ensureRange = (start, end) => {
+    if (localRef.current || !window.pywebview) return;
+    const gen = generation.current;
+    const stop = Math.min(end, total);
+    for (let p = Math.floor(Math.max(0, start) / PAGE_SIZE); p * PAGE_SIZE < stop; p++) {
+      if (requested.current.has(p)) continue;
+      requested.current.add(p);
+      window.pywebview.api.list_images(p * PAGE_SIZE, PAGE_SIZE).then(result => {
+        if (gen !== generation.current) return;
+        setPages(prev => ({ ...prev, [p]: result.images }));
+      });
+    }
+  };
+
+  // Images picked in the browser, or null when Python holds the list
+  const getLocal = () => localRef.current;
+
+  return { total, getImage, ensureRange, reset, appendLocal, getLocal };
+};
+
+// Frontend timings are batched to Python's ui.* histograms, next to the
+// js_api timings, instead of costing a bridge call each
+const pendingTimings = [];
+const recordTiming = (name, started) => {
+  if (window.pywebview) pendingTimings.push([name, performance.now() - started]);
+};
+setInterval(() => {
+  if (pendingTimings.length && window.pywebview?.api) {
+    window.pywebview.api.report_timings(pendingTimings.splice(0));
+  }
+}, 2000);
+
+// Called by each app right after its first ReactDOM.render, so the backend
+// can record time-to-interactive (see benchmarks/startup.py)
+const announceReady = () => {
+  const notify = () => window.pywebview.api.mark_ready();
+  if (window.pywebview) notify();
+  else window.addEventListener('pywebviewready', notify, { once: true });
+};
@@ -0,0 +1,146 @@
+"""Undo/redo for annotation edits as a log of invertible commands.
+
+A command is {'image', 'do': [event, ...], 'undo': [event, ...]} where the
+events are ordinary journal events. Recording an add stores the new
+annotation and a delete of its id; a delete stores the annotation it
+removed. The journal keeps annotations in columns (see
+annotation_web.model) and builds dicts on demand, so each command holds its
+own copies of the annotations it touches; history memory grows with the
+number of edits, not with the size of the project.
+
+The stacks are persisted as an append-only history.jsonl next to the
+journal ('do', 'undo' and 'redo' records) and replayed on open, so undo
+survives a restart; a record torn by a crash is cut off before new ones are
+appended. Once the undo stack holds more than max_bytes of
+commands the oldest are dropped; the log is rewritten from the live stacks
+when it grows well past that.
+"""
+import json
+import os
+import threading
+from collections import deque
+
+HISTORY_NAME = 'history.jsonl'
+# The log is compacted when it exceeds this many times max_bytes
+COMPACT_FACTOR = 4
+
+
+def _encode(record):
+    return (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class EditHistory:
+    """Bounded undo and redo stacks of annotation commands"""
+
+    def __init__(self, directory, max_bytes=16 * 1024 * 1024):
+        self.path = os.path.join(directory, HISTORY_NAME)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Entries are (command, encoded size)
+        self._undo = deque()
+        self._redo = []
+        self._bytes = 0
+        if os.path.exists(self.path):
+            # Drop a torn tail so the next record starts on a line of its own
+            os.truncate(self.path, self._replay())
+        self._file = open(self.path, 'ab')
+        self._log_bytes = self._file.tell()
+
+    def _replay(self):
+        """Apply the log to the stacks and return the length of its whole lines"""
+        valid = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line) if line.endswith(b'\n') else None
+                except ValueError:
+                    record = None
+                if record is None:
+                    # Torn write at the tail after a crash
+                    break
+                valid += len(line)
+                if record['op'] == 'do':
+                    self._push(record['command'], len(line))
+                elif record['op'] == 'undo' and self._undo:
+                    self._pop_undo()
+                elif record['op'] == 'redo' and self._redo:
+                    self._pop_redo()
+        return valid
+
+    def _push(self, command, size):
+        self._redo.clear()
+        self._undo.append((command, size))
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._undo) > 1:
+            _, dropped = self._undo.popleft()
+            self._bytes -= dropped
+
+    def _pop_undo(self):
+        entry = self._undo.pop()
+        self._bytes -= entry[1]
+        self._redo.append(entry)
+        return entry[0]
+
+    def _pop_redo(self):
+        entry = self._redo.pop()
+        self._undo.append(entry)
+        self._bytes += entry[1]
+        return entry[0]
+
+    def _write(self, record):
+        line = _encode(record)
+        self._file.write(line)
+        self._file.flush()
+        self._log_bytes += len(line)
+        if self._log_bytes > COMPACT_FACTOR * self.max_bytes:
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the log so it replays to exactly the current stacks"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for command, _ in self._undo:
+                f.write(_encode({'op': 'do', 'command': command}))
+            # The top of the redo stack was undone last, so it was done first
+            for command, _ in reversed(self._redo):
+                f.write(_encode({'op': 'do', 'command': command}))
+            for _ in self._redo:
+                f.write(_encode({'op': 'undo'}))
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'ab')
+        self._log_bytes = self._file.tell()
+
+    def record(self, image, do, undo):
+        """Push a new command; this discards anything that could be redone"""
+        command = {'image': image, 'do': do, 'undo': undo}
+        with self._lock:
+            self._push(command, len(_encode({'op': 'do', 'command': command})))
+            self._write({'op': 'do', 'command': command})
+
+    def undo(self):
+        """Pop the latest command and return it, or None when there is none"""
+        with self._lock:
+            if not self._undo:
+                return None
+            command = self._pop_undo()
+            self._write({'op': 'undo'})
+            return command
+
+    def redo(self):
+        """Re-push the latest undone command and return it, or None"""
+        with self._lock:
+            if not self._redo:
+                return None
+            command = self._pop_redo()
+            self._write({'op': 'redo'})
+            return command
+
+    def counts(self):
+        with self._lock:
+            return {'undo': len(self._undo), 'redo': len(self._redo),
+                    'bytes': self._bytes}
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,232 @@
+"""Loopback HTTP server that streams dataset images straight from disk.
+
+The webview only ever receives a URL per image. Bytes are read lazily, in
+fixed-size chunks, when an <img> element or the canvas actually asks for
+them, and single-range requests are honoured so large frames can be fetched
+piecewise. Nothing is base64 encoded and nothing is held in memory.
+"""
+import mimetypes
+import os
+import re
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from annotation_web.instrumentation import count, metrics_route, span, trace_route
+from annotation_web.video import frame_reader, split_frame_path
+
+CHUNK_SIZE = 64 * 1024
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff'}
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Live diagnostics; everything else is immutable for a given URL
+UNCACHED_ROUTES = {'metrics', 'trace'}
+
+
+def is_image_file(name):
+    """Return True if name has a known image extension"""
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def iter_image_files(root):
+    """Yield image paths under root, relative to it, without building a list"""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and is_image_file(entry.name):
+                        yield os.path.relpath(entry.path, root)
+        except OSError:
+            continue
+
+
+class _ImageRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'AnnotationImageServer/1.0'
+    protocol_version = 'HTTP/1.1'
+    _cacheable = True
+
+    def do_GET(self):
+        self._dispatch(send_body=True)
+
+    def do_HEAD(self):
+        self._dispatch(send_body=False)
+
+    def log_message(self, format, *args):
+        # Keep the console quiet; a filmstrip fires hundreds of requests
+        pass
+
+    def _dispatch(self, send_body):
+        parts = urlsplit(self.path)
+        route, _, rest = unquote(parts.path).lstrip('/').partition('/')
+        handler = self.server.routes.get(route)
+        if handler is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        self._cacheable = route not in UNCACHED_ROUTES
+        with span('serve.' + route):
+            result = handler(rest, parse_qs(parts.query))
+            if result is None:
+                self.send_error(HTTPStatus.NOT_FOUND)
+            elif isinstance(result, tuple):
+                self._send_bytes(*result, send_body=send_body)
+            else:
+                self._send_file(result, send_body=send_body)
+
+    def _send_common_headers(self, content_type, length):
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Cache-Control',
+                         'private, max-age=3600' if self._cacheable else 'no-store')
+        # No CORS header: the apps only load these URLs as <img> and page
+        # sources, and other sites must not read a local dataset through them
+
+    def _send_bytes(self, data, content_type, send_body=True):
+        self.send_response(HTTPStatus.OK)
+        self._send_common_headers(content_type, len(data))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+            count('serve.bytes', len(data))
+
+    def _send_file(self, path, send_body=True):
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            start, end = 0, size - 1
+            status = HTTPStatus.OK
+
+            match = _RANGE_RE.match(self.headers.get('Range', ''))
+            if match and (match.group(1) or match.group(2)):
+                if match.group(1):
+                    start = int(match.group(1))
+                    if match.group(2):
+                        end = min(int(match.group(2)), size - 1)
+                else:
+                    start = max(0, size - int(match.group(2)))
+                if start > end:
+                    self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                    self.send_header('Content-Range', 'bytes */%d' % size)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                status = HTTPStatus.PARTIAL_CONTENT
+
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            self.send_response(status)
+            self._send_common_headers(content_type, end - start + 1)
+            self.send_header('Accept-Ranges', 'bytes')
+            if status == HTTPStatus.PARTIAL_CONTENT:
+                self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, size))
+            self.end_headers()
+            if not send_body:
+                return
+
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+            count('serve.bytes', end - start + 1 - remaining)
+
+
+class ImageServer:
+    """Serve files from a dataset root over a loopback-only HTTP server
+
+    /metrics/ and /trace/ expose annotation_web.instrumentation for scraping.
+    Extra endpoints can be mounted with add_route(); a route handler receives
+    the path after its prefix and the parsed query string and returns either
+    a filesystem path to stream, a (bytes, content_type) tuple, or None.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self._root = None
+        self._httpd = ThreadingHTTPServer((host, port), _ImageRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.routes = {'images': self._serve_image,
+                              'metrics': metrics_route, 'trace': trace_route}
+        self._thread = None
+        # When set, URLs handed to the frontend start with this instead of
+        # base_url ('' makes them relative, for annotation_web.collab_server)
+        self.public_base = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    @property
+    def routes(self):
+        """Mounted route handlers by prefix"""
+        return self._httpd.routes
+
+    @property
+    def root(self):
+        return self._root
+
+    def start(self):
+        """Start serving in a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server and release the socket"""
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread = None
+        self._httpd.server_close()
+
+    def set_root(self, root):
+        """Point the /images/ endpoint at a dataset directory"""
+        self._root = os.path.realpath(root)
+
+    def add_route(self, prefix, handler):
+        """Mount handler under /<prefix>/"""
+        self._httpd.routes[prefix] = handler
+
+    def resolve(self, relpath):
+        """Map a URL-relative path to a file inside the root, or None
+
+        A video frame (see annotation_web.video) resolves to its virtual
+        path under the root when the video itself exists.
+        """
+        if self._root is None:
+            return None
+        full = os.path.realpath(os.path.join(self._root, relpath))
+        if os.path.commonpath([full, self._root]) != self._root:
+            return None
+        if os.path.isfile(full):
+            return full
+        frame = split_frame_path(full)
+        if frame is not None and os.path.isfile(frame[0]):
+            return full
+        return None
+
+    def url_for(self, relpath, route='images'):
+        """Return the URL the frontend should load relpath from"""
+        base = self.base_url if self.public_base is None else self.public_base
+        return '%s/%s/%s' % (base, route, quote(relpath.replace(os.sep, '/')))
+
+    def _serve_image(self, relpath, query):
+        path = self.resolve(relpath)
+        if path is not None and split_frame_path(path) is not None:
+            try:
+                return frame_reader().jpeg(path), 'image/jpeg'
+            except (ImportError, OSError):
+                return None
+        return path
@@ -0,0 +1,313 @@
+"""Low-overhead timing of js_api calls and pipeline stages.
+
+Every js_api method of DatasetAPI and stages such as file serving,
+decoding, hashing and journal fsyncs are timed with perf_counter_ns into a
+per-name histogram with fixed log-spaced buckets. Recording a sample is a
+bucket search, two additions and an append to a bounded ring buffer of
+recent spans. Nothing is written anywhere until asked for:
+
+  * prometheus_text() renders histograms and counters in the Prometheus
+    text format, also served at /metrics/ by the image server;
+  * chrome_trace() turns the ring buffer into Chrome trace JSON, also at
+    /trace/, which chrome://tracing and Perfetto load directly;
+  * SamplingProfiler, toggled from the UI, snapshots every thread's stack
+    at a fixed interval and reports collapsed stacks for flame graphs.
+
+Set ANNOTATION_INSTRUMENTATION=0 to turn recording off.
+"""
+import bisect
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+# Upper bounds in seconds, from 50us to 10s
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TRACE_CAPACITY = 65536
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_DEPTH = 64
+
+
+class Histogram:
+    """Bucketed latency distribution with count, sum and max"""
+
+    __slots__ = ('counts', 'total', 'count', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Estimate the q quantile by interpolating inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                low = BUCKETS[i - 1] if i else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(low + (high - low) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+
+class Recorder:
+    """Histograms, counters and a ring buffer of recent spans"""
+
+    def __init__(self, trace_capacity=TRACE_CAPACITY, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = Counter()
+        # (name, category, start_ns, duration_ns, thread id)
+        self._trace = deque(maxlen=trace_capacity)
+        self._origin_ns = time.perf_counter_ns()
+
+    def observe(self, name, start_ns, duration_ns, category='stage'):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(duration_ns / 1e9)
+            self._trace.append((name, category, start_ns, duration_ns, threading.get_ident()))
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self._counters[name] += n
+
+    def span(self, name, category='stage'):
+        """Return a context manager timing its body under name"""
+        return _Span(self, name, category)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._trace.clear()
+
+    def summary(self):
+        """Return {name: {count, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}} and counters"""
+        with self._lock:
+            stages = {}
+            for name, h in sorted(self._histograms.items()):
+                stages[name] = {
+                    'count': h.count,
+                    'mean_ms': round(1000 * h.total / h.count, 3) if h.count else 0.0,
+                    'p50_ms': round(1000 * h.quantile(0.5), 3),
+                    'p95_ms': round(1000 * h.quantile(0.95), 3),
+                    'p99_ms': round(1000 * h.quantile(0.99), 3),
+                    'max_ms': round(1000 * h.max, 3),
+                }
+            return {'stages': stages, 'counters': dict(self._counters)}
+
+    def prometheus_text(self, prefix='annotation'):
+        """Render every histogram and counter in the Prometheus text format"""
+        lines = ['# HELP %s_latency_seconds Time spent per js_api method and stage.' % prefix,
+                 '# TYPE %s_latency_seconds histogram' % prefix]
+        with self._lock:
+            for name, h in sorted(self._histograms.items()):
+                label = 'stage="%s"' % _escape_label(name)
+                cumulative = 0
+                for bound, n in zip(BUCKETS, h.counts):
+                    cumulative += n
+                    lines.append('%s_latency_seconds_bucket{%s,le="%g"} %d' % (
+                        prefix, label, bound, cumulative))
+                lines.append('%s_latency_seconds_bucket{%s,le="+Inf"} %d' % (
+                    prefix, label, h.count))
+                lines.append('%s_latency_seconds_sum{%s} %.9f' % (prefix, label, h.total))
+                lines.append('%s_latency_seconds_count{%s} %d' % (prefix, label, h.count))
+            lines.append('# HELP %s_events_total Counted events such as bytes served.' % prefix)
+            lines.append('# TYPE %s_events_total counter' % prefix)
+            for name, n in sorted(self._counters.items()):
+                lines.append('%s_events_total{name="%s"} %d' % (prefix, _escape_label(name), n))
+        return '\n'.join(lines) + '\n'
+
+    def chrome_trace(self):
+        """Return the recent spans as a Chrome trace event document"""
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self._trace)
+        return {
+            'displayTimeUnit': 'ms',
+            'traceEvents': [{
+                'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': tid,
+                'ts': (start_ns - self._origin_ns) / 1000, 'dur': duration_ns / 1000,
+            } for name, category, start_ns, duration_ns, tid in spans],
+        }
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Span:
+    __slots__ = ('_recorder', '_name', '_category', '_start')
+
+    def __init__(self, recorder, name, category):
+        self._recorder = recorder
+        self._name = name
+        self._category = category
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self._recorder.observe(self._name, self._start, end - self._start, self._category)
+        return False
+
+
+# Printed once the frontend's first render has committed
+READY_MARKER = 'annotation-ui-ready'
+PROCESS_START_NS = time.perf_counter_ns()
+
+RECORDER = Recorder(enabled=os.environ.get('ANNOTATION_INSTRUMENTATION', '1') != '0')
+
+
+def span(name, category='stage'):
+    """Time a block of code under name in the process-wide recorder"""
+    return RECORDER.span(name, category)
+
+
+def count(name, n=1):
+    RECORDER.count(name, n)
+
+
+def record_ready(announce=False):
+    """Record time-to-interactive, from this module's import, as ui.ready
+
+    With announce, READY_MARKER is also printed for benchmarks/startup.py.
+    """
+    now = time.perf_counter_ns()
+    RECORDER.observe('ui.ready', PROCESS_START_NS, now - PROCESS_START_NS, 'ui')
+    if announce:
+        print(READY_MARKER, flush=True)
+
+
+def instrument_methods(cls, prefix='api.'):
+    """Wrap the public methods defined on cls so each call is timed
+
+    The wrappers keep the original signature, which pywebview reads to
+    build the JavaScript side of js_api.
+    """
+    for name, fn in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.isfunction(fn) or getattr(fn, '_instrumented', False):
+            continue
+        setattr(cls, name, _timed(fn, prefix + name))
+    return cls
+
+
+def _timed(fn, name):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            RECORDER.observe(name, start, time.perf_counter_ns() - start, 'api')
+
+    wrapper.__signature__ = inspect.signature(fn)
+    wrapper._instrumented = True
+    return wrapper
+
+
+class SamplingProfiler:
+    """Statistical profiler sampling every thread's stack on a timer thread
+
+    Overhead is one sys._current_frames() walk per interval, so it can be
+    left running on a slow session for a while; nothing is traced per call.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self._stacks = Counter()
+        self._samples = 0
+        self._started = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stacks.clear()
+        self._samples = 0
+        self._stop.clear()
+        self._started = time.time()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and return the report"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.report()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                                                 code.co_firstlineno))
+                    frame = frame.f_back
+                # Idle pool workers and servers waiting on sockets dominate
+                # otherwise; keep only stacks doing something
+                if stack and stack[0].split(' ', 1)[0] in ('wait', 'select', 'poll', '_worker',
+                                                           'accept', 'readinto', '_wait_for_tstate_lock'):
+                    continue
+                self._stacks[';'.join(reversed(stack))] += 1
+            self._samples += 1
+
+    def report(self, top=30):
+        """Return sample counts, the hottest functions and collapsed stacks"""
+        functions = Counter()
+        for stack, n in self._stacks.items():
+            functions[stack.rsplit(';', 1)[-1]] += n
+        return {
+            'running': self.running,
+            'samples': self._samples,
+            'interval_ms': self.interval * 1000,
+            'seconds': round(time.time() - self._started, 2) if self._started else 0,
+            'top': [{'function': name, 'samples': n} for name, n in functions.most_common(top)],
+            # One "frame;frame;frame count" line per stack, for flamegraph.pl or speedscope
+            'collapsed': '\n'.join('%s %d' % item for item in self._stacks.most_common()),
+        }
+
+
+def metrics_route(relpath, query):
+    """ImageServer route serving the Prometheus text dump"""
+    return RECORDER.prometheus_text().encode('utf-8'), 'text/plain; version=0.0.4'
+
+
+def trace_route(relpath, query):
+    """ImageServer route serving the Chrome trace JSON"""
+    return json.dumps(RECORDER.chrome_trace()).encode('utf-8'), 'application/json'
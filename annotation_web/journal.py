@@ -0,0 +1,275 @@
+"""Append-only persistence for annotation edits.
+
+Every add/update/delete/label event from the UI is appended as one JSON
+line to the current journal segment, so a save costs O(change) no matter
+how large the project is. A background thread fsyncs the segment every
+flush_interval seconds (or sooner once batch_size events are pending), which
+bounds what a crash can lose to the last unsynced batch.
+
+When the segments grow past compact_bytes the same thread writes a snapshot
+of the materialized state and deletes the segments it covers. On open the
+snapshot is loaded and the newer segments are replayed on top of it; a torn
+last line from a crash is ignored.
+
+A batch label operation is a single 'labels' event naming every image, so
+it lands in one line and is replayed entirely or not at all.
+
+Label events written by annotation_web.prelabel also carry the model's
+confidence and version and are saved unverified.
+
+The materialized state is an annotation_web.model.AnnotationTable, so a
+large project costs a fixed-width row per annotation rather than a dict,
+and readers get dicts built on demand.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+
+from annotation_web.dataset_index import default_cache_dir
+from annotation_web.instrumentation import span
+from annotation_web.model import AnnotationTable
+
+SNAPSHOT_NAME = 'snapshot.json'
+SEGMENT_PATTERN = re.compile(r'^journal-(\d+)\.jsonl$')
+EVENT_OPS = ('add', 'update', 'delete', 'label', 'labels')
+
+
+def _fsync_directory(directory):
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def project_dir(root):
+    """Return where the annotation journal for a dataset root is kept
+
+    Annotations live next to the data in <root>/.annotations so they travel
+    with it; read-only datasets fall back to the user cache directory.
+    """
+    path = os.path.join(root, '.annotations')
+    try:
+        os.makedirs(path, exist_ok=True)
+        return path
+    except OSError:
+        digest = hashlib.sha1(root.encode('utf-8')).hexdigest()[:16]
+        return default_cache_dir('projects', digest)
+
+
+class AnnotationJournal:
+    """Materialized annotation state backed by a segmented JSONL journal"""
+
+    def __init__(self, directory, flush_interval=0.25, batch_size=256,
+                 compact_bytes=8 * 1024 * 1024):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.compact_bytes = compact_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self._table = AnnotationTable()
+        self._lock = threading.Lock()
+        # Serializes fsync and segment rotation so neither sees a closed file
+        self._io_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = 0
+        self._dirty = False
+        self._closed = False
+
+        last_segment = self._load()
+        self._segment = last_segment + 1
+        self._file = open(self._segment_path(self._segment), 'ab')
+        self._bytes = self._journal_bytes()
+
+        self._thread = threading.Thread(target=self._run, name='journal-flush', daemon=True)
+        self._thread.start()
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, 'journal-%06d.jsonl' % number)
+
+    def _segments(self):
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def _journal_bytes(self):
+        return sum(os.path.getsize(self._segment_path(n)) for n in self._segments())
+
+    def _load(self):
+        first_segment = 0
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_NAME)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            first_segment = snapshot['next_segment']
+            for image, annotations in snapshot['annotations'].items():
+                for ann in annotations:
+                    self._table.add(image, ann)
+            for image, entry in snapshot['labels'].items():
+                self._table.set_label(image, entry)
+
+        last_segment = first_segment
+        for number in self._segments():
+            last_segment = max(last_segment, number)
+            if number < first_segment:
+                continue
+            with open(self._segment_path(number), 'rb') as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        # Torn write at the tail of a segment after a crash
+                        break
+        return last_segment
+
+    def _apply(self, event):
+        op = event['op']
+        image = event.get('image')
+        if op == 'add':
+            self._table.add(image, event['annotation'])
+        elif op == 'update':
+            self._table.update(image, event['id'], event['changes'])
+        elif op == 'delete':
+            self._table.delete(image, event['id'])
+        elif op == 'label':
+            entry = {'label': event['label'], 'verified': event.get('verified', True)}
+            # Labels written by a model keep its confidence and version
+            for key in ('confidence', 'model'):
+                if key in event:
+                    entry[key] = event[key]
+            self._table.set_label(image, entry)
+        elif op == 'labels':
+            entry = {'label': event['label'], 'verified': event.get('verified', True)}
+            self._table.set_labels(event['images'], entry)
+
+    def append(self, event):
+        """Apply event to the in-memory state and queue it for the journal"""
+        target = 'images' if event.get('op') == 'labels' else 'image'
+        if event.get('op') not in EVENT_OPS or target not in event:
+            raise ValueError('Invalid journal event: %r' % (event,))
+        line = (json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8')
+        with self._lock:
+            if self._closed:
+                raise ValueError('Journal is closed')
+            self._apply(event)
+            self._file.write(line)
+            self._bytes += len(line)
+            self._pending += 1
+            self._dirty = True
+            if self._pending >= self.batch_size:
+                self._wakeup.notify()
+
+    def annotations(self, image):
+        """Return the annotations of one image in insertion order"""
+        with self._lock:
+            return self._table.annotations(image)
+
+    def annotation(self, image, annotation_id):
+        """Return one annotation, or None"""
+        with self._lock:
+            return self._table.get(image, annotation_id)
+
+    def all_annotations(self):
+        """Return {image: [annotation, ...]} for every annotated image"""
+        with self._lock:
+            return self._table.to_dict()
+
+    def find(self, **criteria):
+        """Return [(image, annotation)] matching AnnotationTable.select criteria"""
+        with self._lock:
+            return self._table.records(self._table.select(**criteria))
+
+    def table(self):
+        """Return a compacted copy of the annotation table for bulk readers"""
+        with self._lock:
+            return self._table.compacted()
+
+    def labels(self):
+        """Return {image: {'label', 'verified'}} for every labeled image"""
+        with self._lock:
+            return self._table.labels_dict()
+
+    def label(self, image):
+        """Return {'label', 'verified'} for one image, or None"""
+        with self._lock:
+            return self._table.label(image)
+
+    def flush(self):
+        """Write and fsync everything appended so far"""
+        with self._io_lock:
+            with self._lock:
+                self._file.flush()
+                fd = self._file.fileno()
+                self._pending = 0
+                self._dirty = False
+            with span('journal.fsync'):
+                os.fsync(fd)
+
+    def compact(self):
+        """Snapshot the current state and drop the segments it covers"""
+        with self._io_lock:
+            self._compact()
+
+    def _compact(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._segment += 1
+            self._file = open(self._segment_path(self._segment), 'ab')
+            self._bytes = 0
+            self._pending = 0
+            self._dirty = False
+            next_segment = self._segment
+            table = self._table.compacted()
+        # Dicts are built from the copy without holding up writers
+        snapshot = {
+            'next_segment': next_segment,
+            'annotations': table.to_dict(),
+            'labels': table.labels_dict(),
+        }
+
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_NAME)
+        tmp_path = snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, snapshot_path)
+        _fsync_directory(self.directory)
+
+        for number in self._segments():
+            if number < snapshot['next_segment']:
+                os.remove(self._segment_path(number))
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._closed and self._pending < self.batch_size:
+                    self._wakeup.wait(self.flush_interval)
+                if self._closed:
+                    return
+                dirty = self._dirty
+                needs_compaction = self._bytes > self.compact_bytes
+            if needs_compaction:
+                self.compact()
+            elif dirty:
+                self.flush()
@@ -0,0 +1,169 @@
+"""Incrementally maintained dataset statistics backed by NumPy arrays.
+
+Image labels are kept as a categorical column: an int32 code per image plus
+a small list of category names. Per-class image counts, box counts, box-size
+histograms and images-per-class are counters updated by the delta of each
+edit, so labeling or drawing a box costs O(1) and a summary costs O(classes)
+instead of a pass over every image.
+"""
+import math
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+# Box sizes are binned by log2 of sqrt(width * height): 1, 2, 4 ... 8192+
+SIZE_BINS = 14
+SIZE_BIN_EDGES = [2 ** i for i in range(SIZE_BINS)]
+
+
+def size_bin(ann):
+    """Return the histogram bin of a box or circle annotation"""
+    side = math.sqrt(abs(ann['width'] * ann['height']))
+    return min(int(math.log2(max(side, 1))), SIZE_BINS - 1)
+
+
+class LabelStats:
+    """Class distribution, verification and box statistics for one dataset"""
+
+    def __init__(self, images, default_label='Unknown'):
+        self.default_label = default_label
+        self._lock = threading.Lock()
+        self._rows = {key: i for i, key in enumerate(images)}
+        self._categories = [default_label]
+        self._codes = {default_label: 0}
+
+        n = len(self._rows)
+        self._labels = np.zeros(n, dtype=np.int32)
+        self._verified = np.zeros(n, dtype=bool)
+        self._verified_count = 0
+
+        capacity = 16
+        self._image_counts = np.zeros(capacity, dtype=np.int64)
+        self._image_counts[0] = n
+        self._box_counts = np.zeros(capacity, dtype=np.int64)
+        self._images_per_class = np.zeros(capacity, dtype=np.int64)
+        self._box_hist = np.zeros((capacity, SIZE_BINS), dtype=np.int64)
+        self._boxes_in_image = defaultdict(int)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _code(self, label):
+        code = self._codes.get(label)
+        if code is not None:
+            return code
+        code = len(self._categories)
+        self._categories.append(label)
+        self._codes[label] = code
+        if code >= len(self._image_counts):
+            grow = len(self._image_counts)
+            self._image_counts = np.concatenate([self._image_counts, np.zeros(grow, np.int64)])
+            self._box_counts = np.concatenate([self._box_counts, np.zeros(grow, np.int64)])
+            self._images_per_class = np.concatenate(
+                [self._images_per_class, np.zeros(grow, np.int64)])
+            self._box_hist = np.concatenate(
+                [self._box_hist, np.zeros((grow, SIZE_BINS), np.int64)])
+        return code
+
+    def load_labels(self, labels):
+        """Bulk-apply {image: {'label', 'verified'}} and recount once"""
+        with self._lock:
+            rows, codes, verified = [], [], []
+            for key, entry in labels.items():
+                row = self._rows.get(key)
+                if row is None:
+                    continue
+                rows.append(row)
+                codes.append(self._code(entry['label']))
+                verified.append(bool(entry.get('verified', True)))
+            if rows:
+                self._labels[rows] = codes
+                self._verified[rows] = verified
+            self._image_counts[:] = 0
+            counts = np.bincount(self._labels, minlength=len(self._categories))
+            self._image_counts[:len(counts)] = counts
+            self._verified_count = int(np.count_nonzero(self._verified))
+
+    def set_label(self, key, label, verified=True):
+        """Move one image to label; unknown keys are ignored"""
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                return
+            new = self._code(label)
+            old = self._labels[row]
+            self._image_counts[old] -= 1
+            self._image_counts[new] += 1
+            self._labels[row] = new
+            self._verified_count += int(verified) - int(self._verified[row])
+            self._verified[row] = verified
+
+    def set_labels(self, keys, label, verified=True):
+        """Move many images to label at once and return the change in counts
+
+        The result is {'distribution': {label: change}, 'verified': change}.
+        """
+        with self._lock:
+            rows = np.unique(np.fromiter(
+                (row for row in map(self._rows.get, keys) if row is not None), dtype=np.int64))
+            if not len(rows):
+                return {'distribution': {}, 'verified': 0}
+            new = self._code(label)
+            old_counts = np.bincount(self._labels[rows], minlength=len(self._categories))
+            self._image_counts[:len(old_counts)] -= old_counts
+            self._image_counts[new] += len(rows)
+            self._labels[rows] = new
+            verified_change = int(verified) * len(rows) - int(np.count_nonzero(self._verified[rows]))
+            self._verified_count += verified_change
+            self._verified[rows] = verified
+
+            change = {self._categories[code]: -int(n) for code, n in enumerate(old_counts) if n}
+            change[label] = change.get(label, 0) + len(rows)
+            return {
+                'distribution': {name: n for name, n in change.items() if n},
+                'verified': verified_change,
+            }
+
+    def add_box(self, image, ann):
+        with self._lock:
+            code = self._code(ann['label'])
+            self._box_counts[code] += 1
+            self._box_hist[code, size_bin(ann)] += 1
+            self._boxes_in_image[image, code] += 1
+            if self._boxes_in_image[image, code] == 1:
+                self._images_per_class[code] += 1
+
+    def remove_box(self, image, ann):
+        with self._lock:
+            code = self._codes.get(ann['label'])
+            if code is None or not self._boxes_in_image.get((image, code)):
+                return
+            self._box_counts[code] -= 1
+            self._box_hist[code, size_bin(ann)] -= 1
+            self._boxes_in_image[image, code] -= 1
+            if self._boxes_in_image[image, code] == 0:
+                del self._boxes_in_image[image, code]
+                self._images_per_class[code] -= 1
+
+    def summary(self):
+        """Return the statistics the UIs display, in O(number of classes)"""
+        with self._lock:
+            n = len(self._categories)
+            image_counts = self._image_counts[:n].tolist()
+            box_counts = self._box_counts[:n].tolist()
+            per_class = self._images_per_class[:n].tolist()
+            hist = self._box_hist[:n].tolist()
+            distribution = {name: c for name, c in zip(self._categories, image_counts) if c}
+            return {
+                'total': len(self._rows),
+                'labels': len(distribution),
+                'verified': self._verified_count,
+                'distribution': distribution,
+                'boxes': {name: c for name, c in zip(self._categories, box_counts) if c},
+                'images_per_class': {name: c for name, c in zip(self._categories, per_class)
+                                     if c},
+                'box_size_histogram': {name: h for name, h, c in
+                                       zip(self._categories, hist, box_counts) if c},
+                'box_size_bin_edges': SIZE_BIN_EDGES,
+            }
@@ -0,0 +1,492 @@
+"""The annotation model every app reads and writes, stored in columns.
+
+An annotation is a box, circle, polygon or point on an image, shaped like
+the dicts the frontends exchange over js_api: {id, type, label, x, y,
+width, height} plus optional zoom, space, verified, confidence, track,
+source and model, and 'points' for polygons. Image-level class labels
+({label, verified, confidence, model}) are the classification side of the
+same model.
+
+AnnotationTable keeps them in NumPy structured arrays rather than one dict
+per annotation: a fixed-width row per shape, strings (labels, track IDs,
+sources, model versions) interned into dictionaries and stored as int32
+codes, and polygon vertices in one shared (n, 2) array addressed by
+per-row offset and count. Any key that does not fit a column is kept in a
+small per-row side dict, so nothing a frontend sends is lost. Counting,
+filtering and exporting work on whole columns at once (see select(),
+counts() and annotation_web.exporters.annotation_records).
+
+The table is not thread-safe; AnnotationJournal guards it with its lock.
+"""
+import math
+import numbers
+
+import numpy as np
+
+from annotation_web.validation import ANNOTATION_TYPES
+
+KINDS = ANNOTATION_TYPES
+KIND_NONE = 255
+
+VERIFIED_SET = 1
+VERIFIED = 2
+IMAGE_SPACE = 4
+
+ANNOTATION_DTYPE = np.dtype([
+    # Code of the image in AnnotationTable.images; -1 marks a deleted row
+    ('image', np.int32),
+    ('label', np.int32),
+    ('kind', np.uint8),
+    ('flags', np.uint8),
+    ('x', np.float64),
+    ('y', np.float64),
+    ('width', np.float64),
+    ('height', np.float64),
+    # NaN when absent
+    ('zoom', np.float64),
+    ('confidence', np.float64),
+    # -1 when absent
+    ('track', np.int32),
+    ('source', np.int32),
+    ('model', np.int32),
+    ('vertex_start', np.int64),
+    ('vertex_count', np.int32),
+])
+
+IMAGE_LABEL_DTYPE = np.dtype([
+    # -1 for an image without a class label
+    ('label', np.int32),
+    ('flags', np.uint8),
+    ('confidence', np.float64),
+    ('model', np.int32),
+])
+
+_COORDS = ('x', 'y', 'width', 'height')
+_EMPTY = (-1, -1, KIND_NONE, 0, math.nan, math.nan, math.nan, math.nan, math.nan, math.nan,
+          -1, -1, -1, 0, 0)
+
+
+def _finite(value):
+    return (isinstance(value, numbers.Real) and not isinstance(value, bool)
+            and math.isfinite(value))
+
+
+def _vertices(points):
+    """Return points as an (n, 2) float array, or None if they are not [x, y] pairs"""
+    if not isinstance(points, list) or not points:
+        return None
+    if not all(isinstance(p, (list, tuple)) and len(p) == 2 and _finite(p[0]) and _finite(p[1])
+               for p in points):
+        return None
+    return np.array(points, dtype=np.float64)
+
+
+def normalize_annotation(ann):
+    """Return ann in the shared shape
+
+    Polygon points given as {x, y} objects become [x, y] pairs and x, y,
+    width and height are set to their bounding box; a point gets an empty
+    box. Anything malformed is returned as is for validation to report.
+    """
+    kind = ann.get('type')
+    if kind == 'polygon' and isinstance(ann.get('points'), list):
+        try:
+            points = [[p['x'], p['y']] if isinstance(p, dict) else list(p) for p in ann['points']]
+            xs = [float(p[0]) for p in points]
+            ys = [float(p[1]) for p in points]
+        except (KeyError, TypeError, ValueError, IndexError):
+            return ann
+        if not points:
+            return ann
+        return dict(ann, points=points, x=min(xs), y=min(ys),
+                    width=max(xs) - min(xs), height=max(ys) - min(ys))
+    if kind == 'point':
+        return dict(ann, width=0, height=0)
+    return ann
+
+
+class Vocabulary:
+    """Interned strings with dense int32 codes in first-seen order"""
+
+    def __init__(self, names=()):
+        self.names = []
+        self._codes = {}
+        for name in names:
+            self.code(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._codes
+
+    def code(self, name):
+        """Return the code of name, adding it if new"""
+        code = self._codes.get(name)
+        if code is None:
+            code = self._codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def get(self, name):
+        """Return the code of name, or -1"""
+        return self._codes.get(name, -1)
+
+    def copy(self):
+        return Vocabulary(self.names)
+
+
+class AnnotationTable:
+    """Columnar store of the annotations and class labels of a project"""
+
+    def __init__(self, capacity=1024):
+        self.images = Vocabulary()
+        self.labels = Vocabulary()
+        self.tracks = Vocabulary()
+        # Sources and model versions
+        self.strings = Vocabulary()
+        self._rows = np.zeros(max(int(capacity), 16), dtype=ANNOTATION_DTYPE)
+        self._size = 0
+        self._live = 0
+        self._vertices = np.zeros((1024, 2), dtype=np.float64)
+        self._vertex_size = 0
+        self._dead_vertices = 0
+        # Per image code, {annotation id: row} in drawing order
+        self._ids = []
+        self._row_ids = []
+        self._extras = {}
+        self._image_labels = np.zeros(16, dtype=IMAGE_LABEL_DTYPE)
+        self._image_labels['label'] = -1
+        self._label_extras = {}
+
+    def __len__(self):
+        return self._live
+
+    @property
+    def nbytes(self):
+        """Bytes held by the column arrays"""
+        return self._rows.nbytes + self._vertices.nbytes + self._image_labels.nbytes
+
+    @property
+    def rows(self):
+        """The structured row array, deleted rows included (image -1)"""
+        return self._rows[:self._size]
+
+    @property
+    def vertices(self):
+        return self._vertices[:self._vertex_size]
+
+    def _image_code(self, image):
+        code = self.images.code(image)
+        while len(self._ids) <= code:
+            self._ids.append({})
+        if code >= len(self._image_labels):
+            grown = np.zeros(2 * len(self._image_labels), dtype=IMAGE_LABEL_DTYPE)
+            grown['label'] = -1
+            grown[:len(self._image_labels)] = self._image_labels
+            self._image_labels = grown
+        return code
+
+    def _push_vertices(self, points):
+        end = self._vertex_size + len(points)
+        if end > len(self._vertices):
+            grown = np.zeros((max(end, 2 * len(self._vertices)), 2), dtype=np.float64)
+            grown[:self._vertex_size] = self._vertices[:self._vertex_size]
+            self._vertices = grown
+        self._vertices[self._vertex_size:end] = points
+        start = self._vertex_size
+        self._vertex_size = end
+        return start
+
+    def _encode(self, image_code, ann):
+        """Return (row tuple, extras) for one annotation dict"""
+        values = list(_EMPTY)
+        values[0] = image_code
+        extras = {}
+        for key, value in ann.items():
+            if key == 'id':
+                continue
+            if key == 'type' and value in KINDS:
+                values[2] = KINDS.index(value)
+            elif key == 'label' and isinstance(value, str):
+                values[1] = self.labels.code(value)
+            elif key in _COORDS and _finite(value):
+                values[4 + _COORDS.index(key)] = value
+            elif key == 'zoom' and _finite(value):
+                values[8] = value
+            elif key == 'confidence' and _finite(value):
+                values[9] = value
+            elif key == 'verified' and isinstance(value, bool):
+                values[3] |= VERIFIED_SET | (VERIFIED if value else 0)
+            elif key == 'space' and value == 'image':
+                values[3] |= IMAGE_SPACE
+            elif key == 'track' and isinstance(value, str):
+                values[10] = self.tracks.code(value)
+            elif key == 'source' and isinstance(value, str):
+                values[11] = self.strings.code(value)
+            elif key == 'model' and isinstance(value, str):
+                values[12] = self.strings.code(value)
+            elif key == 'points' and _vertices(value) is not None:
+                points = _vertices(value)
+                values[13] = self._push_vertices(points)
+                values[14] = len(points)
+            else:
+                extras[key] = value
+        return tuple(values), extras
+
+    def _decode(self, ann_id, row, values=None):
+        (_, label, kind, flags, x, y, width, height, zoom, confidence, track, source, model,
+         start, count) = values if values is not None else self._rows[row].item()
+        ann = {'id': ann_id}
+        if kind != KIND_NONE:
+            ann['type'] = KINDS[kind]
+        if label >= 0:
+            ann['label'] = self.labels.names[label]
+        for key, value in zip(_COORDS, (x, y, width, height)):
+            if not math.isnan(value):
+                ann[key] = value
+        if count:
+            ann['points'] = self._vertices[start:start + count].tolist()
+        if not math.isnan(zoom):
+            ann['zoom'] = zoom
+        if flags & IMAGE_SPACE:
+            ann['space'] = 'image'
+        if flags & VERIFIED_SET:
+            ann['verified'] = bool(flags & VERIFIED)
+        if not math.isnan(confidence):
+            ann['confidence'] = confidence
+        if track >= 0:
+            ann['track'] = self.tracks.names[track]
+        if source >= 0:
+            ann['source'] = self.strings.names[source]
+        if model >= 0:
+            ann['model'] = self.strings.names[model]
+        extras = self._extras.get(row)
+        if extras:
+            ann.update(extras)
+        return ann
+
+    def _store(self, row, values, extras):
+        old_count = int(self._rows['vertex_count'][row]) if row < self._size else 0
+        self._dead_vertices += old_count
+        self._rows[row] = values
+        if extras:
+            self._extras[row] = extras
+        else:
+            self._extras.pop(row, None)
+
+    def add(self, image, ann, key=None):
+        """Store ann on image, replacing (in place) any annotation with its id"""
+        code = self._image_code(image)
+        ann_id = ann.get('id') if key is None else key
+        values, extras = self._encode(code, ann)
+        ids = self._ids[code]
+        row = ids.get(ann_id)
+        if row is None:
+            if self._size == len(self._rows):
+                grown = np.zeros(2 * len(self._rows), dtype=ANNOTATION_DTYPE)
+                grown[:self._size] = self._rows[:self._size]
+                self._rows = grown
+            row = self._size
+            self._size += 1
+            self._live += 1
+            ids[ann_id] = row
+            self._row_ids.append(ann_id)
+        self._store(row, values, extras)
+        self._maybe_compact()
+
+    def update(self, image, ann_id, changes):
+        """Merge changes into one annotation; unknown IDs are ignored"""
+        code = self.images.get(image)
+        row = self._ids[code].get(ann_id) if code >= 0 else None
+        if row is None:
+            return
+        ann = dict(self._decode(ann_id, row), **changes)
+        values, extras = self._encode(code, ann)
+        self._store(row, values, extras)
+        self._maybe_compact()
+
+    def delete(self, image, ann_id):
+        code = self.images.get(image)
+        row = self._ids[code].pop(ann_id, None) if code >= 0 else None
+        if row is None:
+            return
+        self._dead_vertices += int(self._rows['vertex_count'][row])
+        self._rows[row] = _EMPTY
+        self._extras.pop(row, None)
+        self._live -= 1
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        """Drop deleted rows and orphaned vertices once they outweigh live data"""
+        dead = self._size - self._live
+        live_vertices = self._vertex_size - self._dead_vertices
+        if (dead > 1024 and dead > self._live) or (
+                self._dead_vertices > 4096 and self._dead_vertices > live_vertices):
+            self.__dict__.update(self.compacted().__dict__)
+
+    def get(self, image, ann_id):
+        """Return one annotation as a dict, or None"""
+        code = self.images.get(image)
+        row = self._ids[code].get(ann_id) if code >= 0 else None
+        return None if row is None else self._decode(ann_id, row)
+
+    def annotations(self, image):
+        """Return the annotations of image as dicts, in drawing order"""
+        code = self.images.get(image)
+        if code < 0:
+            return []
+        return [self._decode(ann_id, row) for ann_id, row in self._ids[code].items()]
+
+    def to_dict(self):
+        """Return {image: [annotation, ...]} for every image with annotations"""
+        values = self._rows[:self._size].tolist()
+        return {self.images.names[code]: [self._decode(ann_id, row, values[row])
+                                          for ann_id, row in ids.items()]
+                for code, ids in enumerate(self._ids) if ids}
+
+    def select(self, images=None, label=None, kind=None, track=None, source=None,
+               verified=None):
+        """Return the row numbers of live annotations matching every criterion"""
+        rows = self._rows[:self._size]
+        mask = rows['image'] >= 0
+        if images is not None:
+            codes = [self.images.get(image) for image in images]
+            mask &= np.isin(rows['image'], [code for code in codes if code >= 0])
+        for column, vocabulary, value in (('label', self.labels, label),
+                                          ('track', self.tracks, track),
+                                          ('source', self.strings, source)):
+            if value is not None:
+                mask &= rows[column] == vocabulary.get(value) if value in vocabulary else False
+        if kind is not None:
+            mask &= rows['kind'] == (KINDS.index(kind) if kind in KINDS else -1)
+        if verified is not None:
+            flags = rows['flags']
+            mask &= (flags & VERIFIED_SET) != 0
+            mask &= ((flags & VERIFIED) != 0) == bool(verified)
+        return np.flatnonzero(mask)
+
+    def records(self, rows):
+        """Return [(image, annotation)] for row numbers from select()"""
+        return [(self.images.names[int(self._rows['image'][row])],
+                 self._decode(self._row_ids[row], int(row))) for row in rows]
+
+    def counts(self, column):
+        """Return {name: live annotations} for the 'label' or 'kind' column"""
+        rows = self._rows[:self._size]
+        live = rows[rows['image'] >= 0]
+        if column == 'kind':
+            # Annotations saved without a type are boxes
+            names = KINDS
+            codes = np.where(live['kind'] == KIND_NONE, KINDS.index('box'), live['kind'])
+        else:
+            names = self.labels.names
+            codes = live['label'][live['label'] >= 0]
+        counts = np.bincount(codes.astype(np.int64), minlength=len(names)).tolist()
+        return {name: n for name, n in zip(names, counts) if n}
+
+    def annotated_images(self):
+        """Return how many images have at least one annotation"""
+        return sum(1 for ids in self._ids if ids)
+
+    def set_label(self, image, entry):
+        """Store the class label entry {label, verified, ...} of image"""
+        code = self._image_code(image)
+        label, flags, confidence, model = -1, 0, math.nan, -1
+        extras = {}
+        for key, value in entry.items():
+            if key == 'label' and isinstance(value, str):
+                label = self.labels.code(value)
+            elif key == 'verified' and isinstance(value, bool):
+                flags |= VERIFIED_SET | (VERIFIED if value else 0)
+            elif key == 'confidence' and _finite(value):
+                confidence = value
+            elif key == 'model' and isinstance(value, str):
+                model = self.strings.code(value)
+            else:
+                extras[key] = value
+        self._image_labels[code] = (label, flags, confidence, model)
+        if extras:
+            self._label_extras[code] = extras
+        else:
+            self._label_extras.pop(code, None)
+
+    def set_labels(self, images, entry):
+        """Give many images the same class label entry"""
+        for image in images:
+            self.set_label(image, entry)
+
+    def _label_entry(self, code):
+        label, flags, confidence, model = self._image_labels[code].item()
+        entry = {}
+        if label >= 0:
+            entry['label'] = self.labels.names[label]
+        if flags & VERIFIED_SET:
+            entry['verified'] = bool(flags & VERIFIED)
+        if not math.isnan(confidence):
+            entry['confidence'] = confidence
+        if model >= 0:
+            entry['model'] = self.strings.names[model]
+        entry.update(self._label_extras.get(code, ()))
+        return entry
+
+    def label(self, image):
+        """Return the class label entry of image, or None"""
+        code = self.images.get(image)
+        if code < 0 or (self._image_labels['label'][code] < 0 and code not in self._label_extras):
+            return None
+        return self._label_entry(code)
+
+    def labels_dict(self):
+        """Return {image: label entry} for every labelled image"""
+        codes = set(np.flatnonzero(self._image_labels['label'][:len(self.images)] >= 0).tolist())
+        codes.update(self._label_extras)
+        return {self.images.names[code]: self._label_entry(code) for code in sorted(codes)}
+
+    def compacted(self):
+        """Return a copy holding only live rows, grouped by image in drawing order"""
+        order = np.fromiter((row for ids in self._ids for row in ids.values()),
+                            dtype=np.int64, count=self._live)
+        table = AnnotationTable(capacity=len(order))
+        table.images = self.images.copy()
+        table.labels = self.labels.copy()
+        table.tracks = self.tracks.copy()
+        table.strings = self.strings.copy()
+        rows = self._rows[order]
+
+        # Pack the vertices of the surviving polygons contiguously
+        counts = rows['vertex_count'].astype(np.int64)
+        total = int(counts.sum())
+        starts = np.zeros(len(rows), dtype=np.int64)
+        np.cumsum(counts[:-1], out=starts[1:])
+        if total:
+            gather = np.repeat(rows['vertex_start'] - starts, counts) + np.arange(total)
+            table._vertices = np.zeros((max(total, 1024), 2), dtype=np.float64)
+            table._vertices[:total] = self._vertices[gather]
+        rows['vertex_start'] = starts
+        table._vertex_size = total
+        table._rows[:len(rows)] = rows
+        table._size = table._live = len(rows)
+
+        new_row = iter(range(len(order)))
+        table._ids = [{ann_id: next(new_row) for ann_id in ids} for ids in self._ids]
+        table._row_ids = [self._row_ids[row] for row in order.tolist()]
+        position = {old: new for new, old in enumerate(order.tolist())}
+        table._extras = {position[row]: dict(extras) for row, extras in self._extras.items()}
+        table._image_labels = self._image_labels.copy()
+        table._label_extras = {code: dict(extras) for code, extras in self._label_extras.items()}
+        return table
+
+    @classmethod
+    def from_document(cls, data):
+        """Build a table from a detection {image: [annotation, ...]} document
+
+        Annotations are keyed by position, so missing or repeated IDs in a
+        hand-edited file do not collapse rows.
+        """
+        table = cls(capacity=sum(len(anns) for anns in data.values()))
+        for image, anns in data.items():
+            table._image_code(image)
+            for i, ann in enumerate(anns):
+                table.add(image, normalize_annotation(ann), key=i)
+        return table
@@ -0,0 +1,150 @@
+"""Decode-ahead cache for next/previous navigation.
+
+Large TIFF/PNG frames take longer to decode than a reviewer takes to press
+"next". Given the current position, the prefetcher decodes and downsizes the
+K following and K preceding images on a background pool into a byte-bounded
+cache of display-ready JPEGs, which the /display/ route then serves without
+touching the original file. Misses are decoded on the request thread.
+
+Hit rate, server-side serve latency and the time-to-display reported by the
+frontend are kept for metrics().
+"""
+import io
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from annotation_web.instrumentation import span
+from annotation_web.thumbnails import LRUCache
+from annotation_web.video import open_image, source_file
+
+DISPLAY_EDGE = 2048
+SAMPLE_WINDOW = 512
+
+
+def decode_for_display(path, max_edge=DISPLAY_EDGE):
+    """Return JPEG bytes of path downsized to fit max_edge"""
+    from PIL import Image
+
+    with open_image(path) as img:
+        img.draft('RGB', (max_edge, max_edge))
+        img = img.convert('RGB')
+        img.thumbnail((max_edge, max_edge), Image.BILINEAR)
+        buf = io.BytesIO()
+        img.save(buf, 'JPEG', quality=90)
+        return buf.getvalue()
+
+
+def _percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+
+class Prefetcher:
+    """Keep the neighbours of the current image decoded and ready to serve"""
+
+    def __init__(self, image_server, radius=3, max_bytes=256 * 1024 * 1024,
+                 max_edge=DISPLAY_EDGE, workers=2):
+        self._server = image_server
+        self.radius = radius
+        self.max_edge = max_edge
+        self._cache = LRUCache(max_bytes)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self._serve_ms = deque(maxlen=SAMPLE_WINDOW)
+        self._display_ms = deque(maxlen=SAMPLE_WINDOW)
+        self.hits = 0
+        self.misses = 0
+        image_server.add_route('display', self._serve)
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _key(path):
+        st = os.stat(source_file(path))
+        return path, st.st_size, st.st_mtime_ns
+
+    def schedule(self, relpaths):
+        """Decode relpaths in the background, dropping stale requests"""
+        wanted = set()
+        for relpath in relpaths:
+            path = self._server.resolve(relpath)
+            if path is None:
+                continue
+            key = self._key(path)
+            wanted.add(key)
+            if self._cache.get(key) is not None:
+                continue
+            with self._lock:
+                if key not in self._inflight:
+                    self._inflight[key] = self._pool.submit(self._load, key)
+        with self._lock:
+            for key, future in list(self._inflight.items()):
+                if key not in wanted and future.cancel():
+                    del self._inflight[key]
+
+    def _load(self, key):
+        try:
+            with span('prefetch.decode'):
+                data = decode_for_display(key[0], self.max_edge)
+            self._cache.put(key, data)
+            return data
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def get(self, path):
+        """Return display bytes for path, decoding now on a cache miss"""
+        key = self._key(path)
+        data = self._cache.get(key)
+        if data is not None:
+            self.hits += 1
+            return data
+        self.misses += 1
+        with self._lock:
+            future = self._inflight.get(key)
+        if future is not None:
+            try:
+                return future.result()
+            except CancelledError:
+                pass
+        data = decode_for_display(path, self.max_edge)
+        self._cache.put(key, data)
+        return data
+
+    def record_display(self, milliseconds):
+        """Record a frontend-measured navigation-to-onload time"""
+        self._display_ms.append(float(milliseconds))
+
+    def metrics(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'cached_bytes': self._cache.current_bytes,
+            'serve_ms_p50': _percentile(self._serve_ms, 0.5),
+            'serve_ms_p95': _percentile(self._serve_ms, 0.95),
+            'display_ms_p50': _percentile(self._display_ms, 0.5),
+            'display_ms_p95': _percentile(self._display_ms, 0.95),
+        }
+
+    def _serve(self, relpath, query):
+        path = self._server.resolve(relpath)
+        if path is None:
+            return None
+        started = time.perf_counter()
+        try:
+            data = self.get(path)
+        except ImportError:
+            return path
+        except OSError:
+            return None
+        self._serve_ms.append((time.perf_counter() - started) * 1000)
+        return data, 'image/jpeg'
@@ -0,0 +1,393 @@
+"""Model-assisted pre-labeling of a dataset in micro-batches.
+
+A model is anything with a version string, an input_size and a predict()
+taking a list of RGB uint8 arrays of that size. OnnxModel wraps an ONNX
+Runtime CPU session around an image classifier; CallableModel wraps a plain
+Python function, which is also how detectors are plugged in. predict()
+returns one prediction per image:
+
+    {'label': str or None, 'confidence': float,
+     'boxes': [{'x', 'y', 'width', 'height', 'label', 'confidence'}, ...]}
+
+with boxes in input_size pixels; they are scaled back to the source image.
+
+Images are decoded and run a batch at a time on a thread pool (Pillow and
+ONNX Runtime both release the GIL) with a bounded number of batches in
+flight, and results stream back in order as each batch finishes. Results are
+cached by content hash plus model version, so files already scored by the
+same model, including byte-identical copies, never reach the model again.
+"""
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from annotation_web.dataset_index import default_cache_dir
+from annotation_web.dedup import content_id
+from annotation_web.instrumentation import span
+from annotation_web.model import normalize_annotation
+from annotation_web.validation import validate_annotation
+from annotation_web.video import open_image
+
+BATCH_SIZE = 32
+DEFAULT_INPUT_SIZE = 224
+# ImageNet statistics, which most exported classifiers expect
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+def load_image(path, size):
+    """Decode path as an RGB uint8 array resized to size = (width, height)"""
+    from PIL import Image
+
+    with open_image(path) as img:
+        img.draft('RGB', size)
+        return np.asarray(img.convert('RGB').resize(size, Image.BILINEAR))
+
+
+def _softmax(logits):
+    shifted = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return shifted / shifted.sum(axis=1, keepdims=True)
+
+
+class OnnxModel:
+    """Image classifier run by ONNX Runtime on the CPU
+
+    Class names are read from labels_path, one per line (default: a
+    labels.txt next to the model); without one, class indexes are used.
+    """
+
+    def __init__(self, model_path, labels_path=None, threads=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self._session = onnxruntime.InferenceSession(
+            model_path, options, providers=['CPUExecutionProvider'])
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        shape = model_input.shape
+        # NCHW; dynamic dimensions come back as names or None
+        height = shape[2] if len(shape) == 4 and isinstance(shape[2], int) else DEFAULT_INPUT_SIZE
+        width = shape[3] if len(shape) == 4 and isinstance(shape[3], int) else DEFAULT_INPUT_SIZE
+        self.input_size = (width, height)
+
+        if labels_path is None:
+            candidate = os.path.join(os.path.dirname(model_path), 'labels.txt')
+            labels_path = candidate if os.path.isfile(candidate) else None
+        self.labels = None
+        if labels_path:
+            with open(labels_path, encoding='utf-8') as f:
+                self.labels = [line.strip() for line in f if line.strip()]
+        # The weights decide the predictions, so they decide the version
+        self.version = 'onnx:' + content_id(model_path)
+
+    def predict(self, images):
+        batch = np.stack(images).astype(np.float32) / 255.0
+        batch = ((batch - MEAN) / STD).astype(np.float32).transpose(0, 3, 1, 2)
+        scores = self._session.run(None, {self._input_name: batch})[0]
+        scores = scores.reshape(len(images), -1)
+        if scores.min() < 0 or not np.allclose(scores.sum(axis=1), 1, atol=1e-3):
+            scores = _softmax(scores)
+        best = scores.argmax(axis=1)
+        predictions = []
+        for row, code in enumerate(best):
+            label = self.labels[code] if self.labels and code < len(self.labels) else str(code)
+            predictions.append({'label': label, 'confidence': float(scores[row, code]),
+                                'boxes': []})
+        return predictions
+
+
+class CallableModel:
+    """Any function mapping a list of RGB arrays to a list of predictions
+
+    A prediction may be a full dict, a (label, confidence) pair, or a list
+    of box dicts for a detector.
+    """
+
+    def __init__(self, fn, version=None, input_size=None):
+        self._fn = fn
+        self.version = version or getattr(fn, 'version', None) or 'callable:%s.%s' % (
+            getattr(fn, '__module__', '?'), getattr(fn, '__qualname__', repr(fn)))
+        size = input_size or getattr(fn, 'input_size', None) or DEFAULT_INPUT_SIZE
+        self.input_size = (size, size) if isinstance(size, int) else tuple(size)
+
+    def predict(self, images):
+        return [_normalize(result) for result in self._fn(images)]
+
+
+def _box(box):
+    """Return a predicted box with plain float fields, NaN where one is unusable
+
+    Detectors tend to return NumPy scalars, which neither the prediction
+    cache nor the journal can serialize.
+    """
+    box = dict(box)
+    for key in ('x', 'y', 'width', 'height', 'confidence'):
+        if key == 'confidence' and key not in box:
+            continue
+        try:
+            box[key] = float(box.get(key))
+        except (TypeError, ValueError):
+            box[key] = float('nan')
+    return box
+
+
+def _normalize(result):
+    if isinstance(result, dict):
+        return {'label': result.get('label'),
+                'confidence': float(result.get('confidence', 1.0)),
+                'boxes': [_box(box) for box in result.get('boxes', ())]}
+    if isinstance(result, tuple):
+        label, confidence = result
+        return {'label': label, 'confidence': float(confidence), 'boxes': []}
+    boxes = [_box(box) for box in result or ()]
+    confidence = min((box.get('confidence', 1.0) for box in boxes), default=1.0)
+    return {'label': None, 'confidence': float(confidence), 'boxes': boxes}
+
+
+def load_model(spec, labels_path=None, threads=None):
+    """Return a model for spec: an .onnx file or 'package.module:function'"""
+    if spec.endswith('.onnx'):
+        return OnnxModel(spec, labels_path, threads)
+    module_name, sep, attr = spec.partition(':')
+    if not sep:
+        raise ValueError('Model must be an .onnx file or module:function, got %r' % spec)
+    import importlib
+
+    fn = getattr(importlib.import_module(module_name), attr)
+    return CallableModel(fn, version=getattr(fn, 'version', spec))
+
+
+class PredictionCache:
+    """Predictions in SQLite keyed by (content_id, model version)
+
+    Kept in the per-user cache rather than the project, since a file's
+    content ID identifies it in every dataset it appears in.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(default_cache_dir('predictions'), 'predictions.sqlite')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS predictions ('
+            'content_id TEXT NOT NULL, model TEXT NOT NULL, prediction TEXT NOT NULL, '
+            'PRIMARY KEY (content_id, model))')
+
+    def get_many(self, content_ids, model):
+        """Return {content_id: prediction} for the cached subset"""
+        found = {}
+        content_ids = list(content_ids)
+        with self._lock:
+            for start in range(0, len(content_ids), 500):
+                chunk = content_ids[start:start + 500]
+                for cid, prediction in self._conn.execute(
+                        'SELECT content_id, prediction FROM predictions '
+                        'WHERE model = ? AND content_id IN (%s)' % ','.join('?' * len(chunk)),
+                        [model] + chunk):
+                    found[cid] = json.loads(prediction)
+        return found
+
+    def put_many(self, model, items):
+        """Store [(content_id, prediction)] for model"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)',
+                ((cid, model, json.dumps(prediction, separators=(',', ':')))
+                 for cid, prediction in items))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _box_id_prefix(model_version):
+    # Stable per model, so a rerun adds boxes under the same ids
+    return 'model-' + hashlib.blake2b(model_version.encode('utf-8'), digest_size=4).hexdigest()
+
+
+def _scale_boxes(prediction, input_size, width, height):
+    sx, sy = width / input_size[0], height / input_size[1]
+    boxes = []
+    for box in map(_box, prediction['boxes']):
+        boxes.append(dict(box, x=box['x'] * sx, y=box['y'] * sy,
+                          width=box['width'] * sx, height=box['height'] * sy))
+    return dict(prediction, boxes=boxes)
+
+
+def _run_batch(model, root, rows, decode_pool):
+    """Decode and predict one micro-batch; returns (results, failed rows)"""
+    def decode(row):
+        try:
+            return load_image(os.path.join(root, row['path']), model.input_size)
+        except Exception:
+            return None
+
+    with span('prelabel.decode'):
+        images = list(decode_pool.map(decode, rows))
+    kept = [(row, image) for row, image in zip(rows, images) if image is not None]
+    failed = [row for row, image in zip(rows, images) if image is None]
+    if not kept:
+        return [], failed
+    with span('prelabel.predict'):
+        predictions = model.predict([image for _, image in kept])
+    results = []
+    for (row, _), prediction in zip(kept, predictions):
+        if row['width'] and row['height'] and prediction['boxes']:
+            prediction = _scale_boxes(prediction, model.input_size, row['width'], row['height'])
+        results.append((row, prediction))
+    return results, failed
+
+
+class Prelabeler:
+    """Run a model over index rows, skipping what the cache already holds
+
+    run() yields (row, prediction, cached) as results become available;
+    progress() may be called from any thread while it runs.
+    """
+
+    def __init__(self, model, cache, batch_size=BATCH_SIZE, workers=None):
+        self.model = model
+        self.cache = cache
+        self.batch_size = batch_size
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._progress = {'model': model.version, 'total': 0, 'done': 0, 'predicted': 0,
+                          'cached': 0, 'failed': 0, 'seconds': 0.0,
+                          'images_per_second': 0.0, 'running': False}
+
+    def cancel(self):
+        self._cancelled = True
+
+    def progress(self):
+        with self._lock:
+            return dict(self._progress)
+
+    def reject(self, n):
+        """Count n predicted boxes or labels that failed validation under failed
+
+        Unlike unreadable images they do not add to done, which counts images.
+        """
+        with self._lock:
+            self._progress['failed'] += n
+
+    def _count(self, started, **changes):
+        with self._lock:
+            for key, n in changes.items():
+                self._progress[key] += n
+                if key != 'total':
+                    self._progress['done'] += n
+            self._progress['seconds'] = time.perf_counter() - started
+            # Throughput of the model path only; cache hits cost nothing
+            if self._progress['seconds'] > 0:
+                self._progress['images_per_second'] = (
+                    self._progress['predicted'] / self._progress['seconds'])
+
+    def run(self, root, rows):
+        """Yield (row, prediction, cached) for rows that have a content_id"""
+        started = time.perf_counter()
+        rows = [row for row in rows if row['content_id']]
+        with self._lock:
+            self._progress['running'] = True
+        self._count(started, total=len(rows))
+        try:
+            # Byte-identical copies share a content ID and go to the model once
+            copies = {}
+            for row in rows:
+                copies.setdefault(row['content_id'], []).append(row)
+            cached = self.cache.get_many(copies, self.model.version)
+            pending = []
+            for cid, group in copies.items():
+                prediction = cached.get(cid)
+                if prediction is None:
+                    pending.append(group[0])
+                    continue
+                for row in group:
+                    self._count(started, cached=1)
+                    yield row, prediction, True
+            yield from self._predict(root, pending, copies, started)
+        finally:
+            with self._lock:
+                self._progress['running'] = False
+
+    def _predict(self, root, rows, copies, started):
+        # One pool decodes inside each batch, the other runs whole batches so
+        # the next one is decoded while the model is busy with this one
+        max_inflight = self.workers + 1
+        with ThreadPoolExecutor(max_workers=self.workers) as batch_pool, \
+                ThreadPoolExecutor(max_workers=self.workers) as decode_pool:
+            inflight = []
+
+            def collect(future):
+                results, failed = future.result()
+                self.cache.put_many(self.model.version, [
+                    (row['content_id'], prediction) for row, prediction in results])
+                self._count(started, predicted=len(results), failed=sum(
+                    len(copies[row['content_id']]) for row in failed))
+                for row, prediction in results:
+                    for copy in copies[row['content_id']]:
+                        if copy is not row:
+                            self._count(started, cached=1)
+                        yield copy, prediction, copy is not row
+
+            for start in range(0, len(rows), self.batch_size):
+                if self._cancelled:
+                    break
+                inflight.append(batch_pool.submit(
+                    _run_batch, self.model, root, rows[start:start + self.batch_size],
+                    decode_pool))
+                if len(inflight) >= max_inflight:
+                    yield from collect(inflight.pop(0))
+            for future in inflight:
+                yield from collect(future)
+
+
+def prediction_events(row, prediction, model_version, journal):
+    """Return (journal events that store one prediction, parts rejected)
+
+    A class label is written unverified, and never over a label someone
+    verified or one this model already wrote. Boxes are added once per model
+    in image space and keyed by content ID, like boxes drawn by hand, and go
+    through the same checks; boxes that fail them, and labels without a
+    finite confidence, are left out and counted.
+    """
+    events = []
+    rejected = 0
+    path = row['path']
+    if prediction.get('label') is not None and not math.isfinite(prediction['confidence']):
+        rejected += 1
+    elif prediction.get('label') is not None:
+        saved = journal.label(path)
+        if not (saved and (saved['verified'] or saved.get('model') == model_version)):
+            events.append({'op': 'label', 'image': path, 'label': str(prediction['label']),
+                           'verified': False,
+                           'confidence': round(prediction['confidence'], 4),
+                           'model': model_version})
+    if prediction.get('boxes'):
+        image = row['content_id']
+        if not any(ann.get('model') == model_version for ann in journal.annotations(image)):
+            prefix = _box_id_prefix(model_version)
+            for i, box in enumerate(map(_box, prediction['boxes'])):
+                annotation = normalize_annotation({
+                    'id': '%s-%d' % (prefix, i), 'type': 'box', 'space': 'image',
+                    'x': box['x'], 'y': box['y'], 'width': box['width'],
+                    'height': box['height'],
+                    'label': str(box.get('label') or prediction.get('label') or 'object'),
+                    'confidence': round(box.get('confidence', 1.0), 4),
+                    'model': model_version, 'verified': False,
+                })
+                if validate_annotation(annotation):
+                    rejected += 1
+                    continue
+                events.append({'op': 'add', 'image': image, 'annotation': annotation})
+    return events, rejected
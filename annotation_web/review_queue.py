@@ -0,0 +1,132 @@
+"""Priority order for reviewing unverified labels.
+
+Each unverified image is scored from three signals:
+
+  * uncertainty, 1 - the confidence of the model that labeled it (0.5 when
+    no model has scored it);
+  * disagreement, whether the label proposed by the folder layout or a
+    sidecar file differs from the one saved in the journal;
+  * anomaly, how far the image's box count lies from the dataset mean, as a
+    z-score scaled so three standard deviations count fully.
+
+A review mode weighs the signals, and ReviewQueue hands out images highest
+score first. It is a binary heap with lazy invalidation: rescoring an image
+pushes a new entry and marks the old one stale, so every update and every
+pop is O(log N) and the heap is only rebuilt when stale entries pile up.
+Images whose boxes did not change keep the anomaly score they were queued
+with when the mean moves; changing mode rebuilds the queue from scratch.
+"""
+import heapq
+import itertools
+import math
+import threading
+
+# (uncertainty, disagreement, anomaly) weights per review mode
+MODES = {
+    'uncertainty': (1.0, 0.0, 0.0),
+    'disagreement': (0.0, 1.0, 0.0),
+    'anomaly': (0.0, 0.0, 1.0),
+    'combined': (0.5, 0.3, 0.2),
+}
+# A z-score of this many standard deviations gives the full anomaly score
+ANOMALY_SCALE = 3.0
+# Within a single-signal mode, ties are broken by the combined score
+TIE_BREAK = 1e-3
+
+
+class BoxCountStats:
+    """Running mean and deviation of the number of boxes per image"""
+
+    def __init__(self, counts, total):
+        self.total = max(total, 1)
+        self._lock = threading.Lock()
+        self._sum = sum(counts)
+        self._sum_sq = sum(n * n for n in counts)
+
+    def change(self, old, new):
+        with self._lock:
+            self._sum += new - old
+            self._sum_sq += new * new - old * old
+
+    def z_score(self, n):
+        mean = self._sum / self.total
+        variance = max(self._sum_sq / self.total - mean * mean, 0.0)
+        if variance == 0:
+            return 0.0
+        return abs(n - mean) / math.sqrt(variance)
+
+
+def review_signals(entry, inferred, boxes, box_stats):
+    """Return {'uncertainty', 'disagreement', 'anomaly'} for one image
+
+    entry is the image's saved {'label', 'verified', 'confidence'} or None,
+    inferred its folder or sidecar label or None, boxes its box count.
+    """
+    confidence = entry.get('confidence') if entry else None
+    label = entry['label'] if entry else None
+    return {
+        'uncertainty': 0.5 if confidence is None else 1.0 - confidence,
+        'disagreement': 1.0 if label and inferred and label != inferred else 0.0,
+        'anomaly': min(box_stats.z_score(boxes) / ANOMALY_SCALE, 1.0),
+    }
+
+
+def review_priority(signals, mode='combined'):
+    """Combine review signals into one score; higher is reviewed first"""
+    if mode not in MODES:
+        raise ValueError('Unknown review mode: %s' % mode)
+    values = (signals['uncertainty'], signals['disagreement'], signals['anomaly'])
+    combined = sum(w * v for w, v in zip(MODES['combined'], values))
+    if mode == 'combined':
+        return combined
+    return sum(w * v for w, v in zip(MODES[mode], values)) + TIE_BREAK * combined
+
+
+class ReviewQueue:
+    """Max-priority queue of image keys with O(log N) update and pop"""
+
+    def __init__(self, items=()):
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        # key -> sequence number of its live heap entry
+        self._live = {}
+        self._heap = []
+        for key, priority in items:
+            seq = next(self._counter)
+            self._live[key] = seq
+            self._heap.append((-priority, seq, key))
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self._live)
+
+    def __contains__(self, key):
+        return key in self._live
+
+    def push(self, key, priority):
+        """Insert key, or move it to a new priority"""
+        with self._lock:
+            seq = next(self._counter)
+            self._live[key] = seq
+            heapq.heappush(self._heap, (-priority, seq, key))
+            if len(self._heap) > 2 * len(self._live) + 1024:
+                self._rebuild()
+
+    def discard(self, key):
+        """Remove key if queued; its heap entry is dropped when reached"""
+        with self._lock:
+            self._live.pop(key, None)
+
+    def pop(self):
+        """Remove and return (key, priority) of the top entry, or None"""
+        with self._lock:
+            while self._heap:
+                priority, seq, key = heapq.heappop(self._heap)
+                if self._live.get(key) == seq:
+                    del self._live[key]
+                    return key, -priority
+            return None
+
+    def _rebuild(self):
+        self._heap = [entry for entry in self._heap if self._live.get(entry[2]) == entry[1]]
+        heapq.heapify(self._heap)
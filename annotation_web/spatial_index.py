@@ -0,0 +1,159 @@
+"""Uniform-grid spatial index over the annotations of one image.
+
+Each box is registered in every grid cell its bounding rectangle touches, so
+point picking and viewport queries only look at the annotations in the
+cells they cover instead of every annotation on the image. Boxes spanning
+more than MAX_CELLS cells are kept in a short "oversized" list that every
+query also checks, which keeps insertion cheap for full-frame boxes.
+
+Circles are indexed by their bounding square (matching drawCanvas: radius
+max(|w|, |h|) / 2 around the box centre) and point picks test the circle;
+polygons are indexed by their bounding box and picks test the outline.
+"""
+import math
+from collections import defaultdict
+
+CELL_SIZE = 64.0
+MAX_CELLS = 256
+
+
+def annotation_bounds(ann):
+    """Return (x0, y0, x1, y1) covering the drawn shape of an annotation"""
+    x, y, w, h = ann['x'], ann['y'], ann['width'], ann['height']
+    if ann.get('type') == 'circle':
+        r = max(abs(w), abs(h)) / 2
+        cx, cy = x + w / 2, y + h / 2
+        return cx - r, cy - r, cx + r, cy + r
+    return min(x, x + w), min(y, y + h), max(x, x + w), max(y, y + h)
+
+
+def _contains(ann, bounds, px, py):
+    x0, y0, x1, y1 = bounds
+    if not (x0 <= px <= x1 and y0 <= py <= y1):
+        return False
+    if ann.get('type') == 'circle':
+        r = (x1 - x0) / 2
+        return (px - (x0 + r)) ** 2 + (py - (y0 + r)) ** 2 <= r * r
+    if ann.get('type') == 'polygon' and ann.get('points'):
+        # Even-odd rule: count the edges a ray to the right crosses
+        inside = False
+        points = ann['points']
+        for (ax, ay), (bx, by) in zip(points, points[1:] + points[:1]):
+            if (ay > py) != (by > py) and px < ax + (py - ay) * (bx - ax) / (by - ay):
+                inside = not inside
+        return inside
+    return True
+
+
+def iou(a, b):
+    """Intersection over union of two (x0, y0, x1, y1) rectangles"""
+    ix = min(a[2], b[2]) - max(a[0], b[0])
+    iy = min(a[3], b[3]) - max(a[1], b[1])
+    if ix <= 0 or iy <= 0:
+        return 0.0
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class GridIndex:
+    """Annotations of one image bucketed into a uniform grid"""
+
+    def __init__(self, annotations=(), cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self._cells = defaultdict(set)
+        self._oversized = set()
+        self._items = {}
+        # Insertion order decides which of several overlapping boxes is on top
+        self._order = {}
+        self._counter = 0
+        for ann in annotations:
+            self.insert(ann)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _cell_range(self, bounds):
+        c = self.cell_size
+        return (math.floor(bounds[0] / c), math.floor(bounds[1] / c),
+                math.floor(bounds[2] / c), math.floor(bounds[3] / c))
+
+    def insert(self, ann):
+        ann_id = ann['id']
+        if ann_id in self._items:
+            self.remove(ann_id)
+        bounds = annotation_bounds(ann)
+        self._items[ann_id] = (ann, bounds)
+        self._counter += 1
+        self._order[ann_id] = self._counter
+        cx0, cy0, cx1, cy1 = self._cell_range(bounds)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > MAX_CELLS:
+            self._oversized.add(ann_id)
+            return
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                self._cells[cx, cy].add(ann_id)
+
+    def remove(self, ann_id):
+        entry = self._items.pop(ann_id, None)
+        if entry is None:
+            return
+        del self._order[ann_id]
+        if ann_id in self._oversized:
+            self._oversized.discard(ann_id)
+            return
+        cx0, cy0, cx1, cy1 = self._cell_range(entry[1])
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = self._cells.get((cx, cy))
+                if cell is not None:
+                    cell.discard(ann_id)
+                    if not cell:
+                        del self._cells[cx, cy]
+
+    def _candidates(self, bounds):
+        cx0, cy0, cx1, cy1 = self._cell_range(bounds)
+        found = set(self._oversized)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+            # The query covers more cells than are occupied: walk those instead
+            for (cx, cy), ids in self._cells.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    found.update(ids)
+            return found
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                ids = self._cells.get((cx, cy))
+                if ids:
+                    found.update(ids)
+        return found
+
+    def pick(self, x, y):
+        """Return the topmost annotation containing (x, y), or None"""
+        hits = [ann_id for ann_id in self._candidates((x, y, x, y))
+                if _contains(*self._items[ann_id], x, y)]
+        if not hits:
+            return None
+        return self._items[max(hits, key=self._order.get)][0]
+
+    def query(self, x0, y0, x1, y1):
+        """Return annotations intersecting the rectangle, in drawing order"""
+        rect = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        hits = []
+        for ann_id in self._candidates(rect):
+            b = self._items[ann_id][1]
+            if b[0] <= rect[2] and b[2] >= rect[0] and b[1] <= rect[3] and b[3] >= rect[1]:
+                hits.append(ann_id)
+        hits.sort(key=self._order.get)
+        return [self._items[ann_id][0] for ann_id in hits]
+
+    def overlaps(self, min_iou=0.0):
+        """Return [(id_a, id_b, iou)] for every pair of overlapping annotations"""
+        pairs = []
+        for ann_id, (_, bounds) in self._items.items():
+            for other in self._candidates(bounds):
+                if self._order[other] <= self._order[ann_id]:
+                    continue
+                score = iou(bounds, self._items[other][1])
+                if score > min_iou:
+                    pairs.append((ann_id, other, round(score, 4)))
+        return pairs
@@ -0,0 +1,33 @@
+"""Dataset statistics shared by the command line and the desktop apps."""
+from collections import Counter
+
+from annotation_web.validation import document_kind, expand_document
+
+
+def summarize(data):
+    """Return counts and label distribution for a loaded annotation document"""
+    data, _ = expand_document(data)
+    kind = document_kind(data)
+    if kind == 'classification':
+        labels = Counter(entry['label'] for entry in data)
+        return {
+            'kind': kind,
+            'images': len(data),
+            'classes': len(labels),
+            'verified': sum(1 for entry in data if entry.get('verified')),
+            'distribution': dict(labels.most_common()),
+        }
+
+    from annotation_web.model import AnnotationTable
+
+    table = AnnotationTable.from_document(data)
+    labels = Counter(table.counts('label'))
+    return {
+        'kind': kind,
+        'images': len(data),
+        'annotated_images': table.annotated_images(),
+        'annotations': sum(labels.values()),
+        'classes': len(labels),
+        'types': table.counts('kind'),
+        'distribution': dict(labels.most_common()),
+    }
@@ -0,0 +1,175 @@
+"""Thumbnail pyramid with an on-disk cache and an in-memory LRU.
+
+Each source image is decoded once and reduced to every level of THUMB_SIZES
+in a single pass. Levels are stored on disk keyed by the image's content ID
+when the caller can supply one (annotation_web.dedup hashes the dataset
+index), so renamed or copied files reuse the same thumbnails, and otherwise
+by path, size and mtime; the file is never read just to name its
+thumbnails. The most recently served levels are kept in a byte-bounded LRU
+in front of the disk.
+Decoding runs in a small thread pool; Pillow releases the GIL while it
+decodes and resamples, so the HTTP threads are never the bottleneck.
+"""
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from annotation_web.dataset_index import default_cache_dir
+from annotation_web.instrumentation import span
+from annotation_web.video import open_image, source_file
+
+THUMB_SIZES = (64, 128, 256)
+
+
+def pyramid_level(size):
+    """Round a requested edge length up to the nearest pyramid level"""
+    for level in THUMB_SIZES:
+        if size <= level:
+            return level
+    return THUMB_SIZES[-1]
+
+
+class LRUCache:
+    """Thread-safe LRU mapping bounded by the total length of its values"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old)
+            self._items[key] = value
+            self.current_bytes += len(value)
+            while self.current_bytes > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ThumbnailService:
+    """Generate, cache and serve downscaled thumbnails for the filmstrip
+
+    content_key(path, stat) may return a content ID for the file at path
+    whose os.stat() is stat, or None to fall back to the stat key.
+    """
+
+    def __init__(self, image_server, cache_dir=None, memory_bytes=64 * 1024 * 1024,
+                 workers=4, content_key=None):
+        self._server = image_server
+        self.cache_dir = cache_dir or default_cache_dir('thumbnails')
+        self._memory = LRUCache(memory_bytes)
+        self._content_key = content_key
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumb')
+        image_server.add_route('thumbs', self._serve)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            'memory_items': len(self._memory),
+            'memory_bytes': self._memory.current_bytes,
+            'hits': self._memory.hits,
+            'misses': self._memory.misses,
+        }
+
+    def get(self, path, size=128):
+        """Return JPEG bytes for the pyramid level covering size"""
+        level = pyramid_level(size)
+        digest = self._digest(path)
+        data = self._memory.get((digest, level))
+        if data is not None:
+            return data
+
+        with self._lock:
+            future = self._inflight.get((digest, level))
+            if future is None:
+                future = self._pool.submit(self._load, path, digest, level)
+                self._inflight[(digest, level)] = future
+        try:
+            return future.result()
+        finally:
+            with self._lock:
+                self._inflight.pop((digest, level), None)
+
+    def _digest(self, path):
+        # A frame stats as its video, so it is keyed by the video's size and
+        # mtime plus its own virtual path
+        st = os.stat(source_file(path))
+        digest = self._content_key(path, st) if self._content_key else None
+        if digest is None:
+            stat_key = (path, st.st_size, st.st_mtime_ns)
+            digest = hashlib.sha1(repr(stat_key).encode('utf-8')).hexdigest()
+        return digest
+
+    def _disk_path(self, digest, level):
+        return os.path.join(self.cache_dir, digest[:2], '%s_%d.jpg' % (digest, level))
+
+    def _load(self, path, digest, level):
+        disk_path = self._disk_path(digest, level)
+        try:
+            with open(disk_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = self._build_pyramid(path, digest)[level]
+        self._memory.put((digest, level), data)
+        return data
+
+    def _build_pyramid(self, path, digest):
+        from PIL import Image
+
+        levels = {}
+        with span('thumbnail.decode'), open_image(path) as img:
+            # Let JPEG decode at reduced scale instead of full resolution
+            img.draft('RGB', (THUMB_SIZES[-1], THUMB_SIZES[-1]))
+            img = img.convert('RGB')
+            for level in sorted(THUMB_SIZES, reverse=True):
+                img.thumbnail((level, level), Image.BILINEAR)
+                buf = io.BytesIO()
+                img.save(buf, 'JPEG', quality=80)
+                levels[level] = buf.getvalue()
+
+        os.makedirs(os.path.dirname(self._disk_path(digest, 0)), exist_ok=True)
+        for level, data in levels.items():
+            tmp_path = self._disk_path(digest, level) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._disk_path(digest, level))
+        return levels
+
+    def _serve(self, relpath, query):
+        path = self._server.resolve(relpath)
+        if path is None:
+            return None
+        try:
+            size = int(query.get('size', ['128'])[0])
+            return self.get(path, size), 'image/jpeg'
+        except ImportError:
+            # Without Pillow the filmstrip falls back to the original file
+            return path
+        except (OSError, ValueError):
+            return None
@@ -0,0 +1,394 @@
+"""Multi-resolution tile pyramid for images too large to decode in the webview.
+
+Survey mosaics run to tens of thousands of pixels a side, far past what a
+webview <img> can decode. The first time such an image is opened it is
+converted into a pyramid of raw RGB levels, each half the size of the one
+below, stored as .npy files in the cache and memory-mapped from then on. The
+/tiles/ route cuts TILE_SIZE x TILE_SIZE tiles out of the level that matches
+the viewer's zoom and encodes them as JPEG, so only the tiles intersecting
+the viewport ever leave Python.
+
+Level 0 is written a band of rows at a time. Uncompressed sources (raw
+TIFF, PPM) are read straight from the file; 8-bit TIFFs stored in strips or
+tiles compressed with deflate, PackBits or JPEG are decoded one row of
+blocks at a time. Anything else (PNG, JPEG, LZW TIFF) can only be decoded
+whole, so it is refused above MAX_DECODE_PIXELS rather than exhausting
+memory. Pyramids are keyed by path, size and modification time rather than
+a content hash, since hashing a multi-gigabyte mosaic would cost more than
+the reads it saves.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from annotation_web.dataset_index import default_cache_dir
+from annotation_web.instrumentation import span
+from annotation_web.thumbnails import LRUCache
+
+TILE_SIZE = 256
+# Images whose longer edge exceeds this are shown through the pyramid
+TILED_MIN_EDGE = 8192
+BAND_ROWS = 1024
+# Largest image accepted at all, and largest one decoded whole in memory
+MAX_PYRAMID_PIXELS = 2 ** 32
+MAX_DECODE_PIXELS = 2 ** 28
+# TIFF compression tag values decoded block by block
+TIFF_CODECS = {1: 'raw', 7: 'jpeg', 8: 'deflate', 32946: 'deflate', 32773: 'packbits'}
+
+_pixels_lock = threading.Lock()
+
+
+def needs_tiling(width, height):
+    """Return True when an image should be viewed through tiles"""
+    return bool(width and height) and max(width, height) > TILED_MIN_EDGE
+
+
+def level_count(width, height, tile_size=TILE_SIZE):
+    """Return how many levels it takes for the image to fit one tile"""
+    levels = 1
+    while max(width, height) > tile_size:
+        width, height = (width + 1) // 2, (height + 1) // 2
+        levels += 1
+    return levels
+
+
+def _raw_bands(img, band_rows):
+    """Yield (top, RGB band) for an uncompressed image without a full decode"""
+    from PIL import Image
+
+    (codec, extents, offset, args), = img.tile
+    rawmode, stride, orientation = args
+    width, height = img.size
+    bands = Image.getmodebands(img.mode)
+    if stride == 0:
+        stride = width * bands
+    with open(img.filename, 'rb') as f:
+        for top in range(0, height, band_rows):
+            rows = min(band_rows, height - top)
+            f.seek(offset + top * stride)
+            data = f.read(rows * stride)
+            band = Image.frombuffer(img.mode, (width, rows), data, 'raw', rawmode, stride, 1)
+            yield top, band.convert('RGB')
+
+
+def _supports_raw_bands(img):
+    if len(img.tile) != 1:
+        return False
+    codec, extents, offset, args = img.tile[0]
+    return (codec == 'raw' and tuple(extents) == (0, 0) + img.size
+            and isinstance(args, tuple) and len(args) == 3 and args[2] == 1
+            and args[0] == img.mode and img.mode in ('L', 'RGB', 'RGBA', 'RGBX'))
+
+
+def _tiff_layout(img):
+    """Return how to decode a TIFF a block at a time, or None if it cannot be
+
+    Covers 8-bit greyscale, RGB and RGBA stored contiguously in strips or
+    tiles, raw or compressed with one of TIFF_CODECS.
+    """
+    if img.format != 'TIFF':
+        return None
+    tags = img.tag_v2
+    codec = TIFF_CODECS.get(tags.get(259, 1))
+    bits = tags.get(258, 8)
+    bits = set(bits) if isinstance(bits, tuple) else {bits}
+    samples = tags.get(277, 1)
+    photometric = tags.get(262)
+    if (codec is None or bits != {8} or tags.get(284, 1) != 1 or tags.get(266, 1) != 1
+            or tags.get(317, 1) not in (1, 2)):
+        return None
+    colours = (2, 6) if codec == 'jpeg' else (2,)
+    if not ((samples == 1 and photometric == 1) or (samples in (3, 4) and photometric in colours)):
+        return None
+
+    width, height = img.size
+    if 322 in tags:
+        block_width, block_height = tags.get(322), tags.get(323)
+        offsets, counts = tags.get(324), tags.get(325)
+    else:
+        block_width, block_height = width, min(tags.get(278, height), height)
+        offsets, counts = tags.get(273), tags.get(279)
+    offsets = offsets if isinstance(offsets, tuple) else (offsets,)
+    counts = counts if isinstance(counts, tuple) else (counts,)
+    if not (isinstance(block_width, int) and isinstance(block_height, int)
+            and block_width > 0 and block_height > 0):
+        return None
+    blocks = -(-width // block_width) * -(-height // block_height)
+    if len(offsets) != blocks or len(counts) != blocks:
+        return None
+    return {'codec': codec, 'samples': samples, 'predictor': tags.get(317, 1),
+            'tables': tags.get(347), 'block': (block_width, block_height),
+            'offsets': offsets, 'counts': counts, 'tiled': 322 in tags}
+
+
+def _decode_block(data, layout, width, height):
+    """Decode one strip or tile into a (height, width, 3) uint8 array"""
+    import numpy as np
+    from PIL import Image
+
+    codec, samples = layout['codec'], layout['samples']
+    if codec == 'jpeg':
+        # Each block is an abbreviated JPEG stream sharing the JPEGTables tag
+        tables = layout['tables']
+        if tables:
+            data = tables[:-2] + data[2:]
+        with Image.open(io.BytesIO(data)) as block:
+            return np.asarray(block.convert('RGB'))[:height, :width]
+    if codec == 'deflate':
+        data = zlib.decompress(data)
+    elif codec == 'packbits':
+        data = Image.frombytes('L', (width * samples, height), data, 'packbits', 'L').tobytes()
+    block = np.frombuffer(data, dtype=np.uint8, count=width * height * samples)
+    block = block.reshape(height, width, samples)
+    if layout['predictor'] == 2:
+        # Horizontal differencing: each sample is stored relative to the one on its left
+        block = np.cumsum(block, axis=1, dtype=np.uint8)
+    if samples == 1:
+        return np.repeat(block, 3, axis=2)
+    return block[:, :, :3]
+
+
+def _tiff_bands(img, layout):
+    """Yield (top, RGB array) for each row of blocks of a TIFF"""
+    import numpy as np
+
+    width, height = img.size
+    block_width, block_height = layout['block']
+    across = -(-width // block_width)
+    with open(img.filename, 'rb') as f:
+        for row, top in enumerate(range(0, height, block_height)):
+            rows = min(block_height, height - top)
+            band = np.empty((rows, width, 3), dtype=np.uint8)
+            for col in range(across):
+                i = row * across + col
+                f.seek(layout['offsets'][i])
+                data = f.read(layout['counts'][i])
+                # Edge tiles are padded to the full tile size; the last strip is not
+                block = _decode_block(data, layout, block_width,
+                                      block_height if layout['tiled'] else rows)
+                left = col * block_width
+                cols = min(block_width, width - left)
+                band[:, left:left + cols] = block[:rows, :cols]
+            yield top, band
+
+
+def _decoded_bands(img, band_rows):
+    """Yield (top, RGB array) bands of an image decoded once in full"""
+    import numpy as np
+
+    img.load()
+    width, height = img.size
+    # Keep each crop under Pillow's decompression bomb warning
+    band_rows = max(1, min(band_rows, 2 ** 24 // width))
+    for top in range(0, height, band_rows):
+        band = img.crop((0, top, width, min(top + band_rows, height)))
+        yield top, np.asarray(band.convert('RGB'))
+
+
+def _bands(img, band_rows, max_decode_pixels):
+    """Return an iterator of (top, RGB array) bands covering img
+
+    Raises ValueError if img can only be decoded whole and is larger than
+    max_decode_pixels.
+    """
+    import numpy as np
+
+    width, height = img.size
+    if _supports_raw_bands(img):
+        return ((top, np.asarray(band)) for top, band in _raw_bands(img, band_rows))
+    layout = _tiff_layout(img)
+    if layout is not None and layout['block'][1] * width <= max_decode_pixels:
+        return _tiff_bands(img, layout)
+    if width * height > max_decode_pixels:
+        raise ValueError(
+            '%s is %dx%d, too large to decode in one piece; save it as an uncompressed '
+            'TIFF, or a deflate, PackBits or JPEG compressed TIFF in strips or tiles'
+            % (os.path.basename(img.filename), width, height))
+    return _decoded_bands(img, band_rows)
+
+
+def _open_large(path):
+    """Image.open path with the decompression bomb limit raised to MAX_PYRAMID_PIXELS
+
+    The limit is process-wide, so it is raised only while the header is
+    parsed and restored straight after.
+    """
+    from PIL import Image
+
+    with _pixels_lock:
+        saved = Image.MAX_IMAGE_PIXELS
+        if saved is not None:
+            Image.MAX_IMAGE_PIXELS = max(saved, MAX_PYRAMID_PIXELS)
+        try:
+            img = Image.open(path)
+        except Image.DecompressionBombError as e:
+            raise ValueError(str(e)) from e
+        finally:
+            Image.MAX_IMAGE_PIXELS = saved
+    width, height = img.size
+    if width * height > MAX_PYRAMID_PIXELS:
+        img.close()
+        raise ValueError('%s is %dx%d, more than the %d pixels a pyramid is built for'
+                         % (os.path.basename(path), width, height, MAX_PYRAMID_PIXELS))
+    return img
+
+
+def _downsample(src, dst, band_rows=BAND_ROWS):
+    """Fill dst with the 2x2 box-filtered src, band by band"""
+    import numpy as np
+
+    height, width = src.shape[:2]
+    band_rows -= band_rows % 2
+    for top in range(0, height, band_rows):
+        block = np.asarray(src[top:top + band_rows], dtype=np.uint16)
+        if block.shape[0] % 2:
+            block = np.concatenate([block, block[-1:]])
+        if width % 2:
+            block = np.concatenate([block, block[:, -1:]], axis=1)
+        h, w = block.shape[0] // 2, block.shape[1] // 2
+        summed = block.reshape(h, 2, w, 2, 3).sum(axis=(1, 3))
+        dst[top // 2:top // 2 + h] = ((summed + 2) // 4).astype(np.uint8)
+
+
+def build_pyramid(path, directory, tile_size=TILE_SIZE, band_rows=BAND_ROWS,
+                  max_decode_pixels=MAX_DECODE_PIXELS):
+    """Write every pyramid level of path into directory and return its meta"""
+    import numpy as np
+    from numpy.lib.format import open_memmap
+
+    with _open_large(path) as img:
+        width, height = img.size
+        bands = _bands(img, band_rows, max_decode_pixels)
+        os.makedirs(directory, exist_ok=True)
+        base = open_memmap(os.path.join(directory, 'level-0.npy'), mode='w+',
+                           dtype=np.uint8, shape=(height, width, 3))
+        for top, band in bands:
+            base[top:top + band.shape[0]] = band
+    base.flush()
+
+    levels = level_count(width, height, tile_size)
+    src = base
+    for level in range(1, levels):
+        h, w = (src.shape[0] + 1) // 2, (src.shape[1] + 1) // 2
+        dst = open_memmap(os.path.join(directory, 'level-%d.npy' % level), mode='w+',
+                          dtype=np.uint8, shape=(h, w, 3))
+        _downsample(src, dst, band_rows)
+        dst.flush()
+        src = dst
+    del base, src
+
+    meta = {'width': width, 'height': height, 'tile_size': tile_size, 'levels': levels}
+    # meta.json is written last: its presence marks a complete pyramid
+    tmp_path = os.path.join(directory, 'meta.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(directory, 'meta.json'))
+    return meta
+
+
+class TilePyramid:
+    """Read-only, memory-mapped view of a built pyramid"""
+
+    def __init__(self, directory):
+        import numpy as np
+
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.tile_size = self.meta['tile_size']
+        self._levels = [np.load(os.path.join(directory, 'level-%d.npy' % level), mmap_mode='r')
+                        for level in range(self.meta['levels'])]
+
+    def tile(self, level, x, y, quality=85):
+        """Return JPEG bytes of one tile, or None when it lies outside the level"""
+        from PIL import Image
+
+        if not 0 <= level < len(self._levels) or x < 0 or y < 0:
+            return None
+        arr = self._levels[level]
+        ts = self.tile_size
+        region = arr[y * ts:(y + 1) * ts, x * ts:(x + 1) * ts]
+        if region.size == 0:
+            return None
+        buf = io.BytesIO()
+        Image.fromarray(region).save(buf, 'JPEG', quality=quality)
+        return buf.getvalue()
+
+
+class TileService:
+    """Build pyramids on demand and serve their tiles over the image server"""
+
+    def __init__(self, image_server, cache_dir=None, tile_size=TILE_SIZE,
+                 memory_bytes=128 * 1024 * 1024, workers=2):
+        self._server = image_server
+        self.cache_dir = cache_dir or default_cache_dir('tiles')
+        self.tile_size = tile_size
+        self._memory = LRUCache(memory_bytes)
+        self._pyramids = {}
+        self._building = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tiles')
+        image_server.add_route('tiles', self._serve)
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _key(self, path):
+        st = os.stat(path)
+        raw = '%s\0%d\0%d\0%d' % (os.path.realpath(path), st.st_size, st.st_mtime_ns,
+                                  self.tile_size)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def pyramid(self, path):
+        """Return the TilePyramid of path, building it on first use"""
+        key = self._key(path)
+        pyramid = self._pyramids.get(key)
+        if pyramid is not None:
+            return pyramid
+        with self._lock:
+            future = self._building.get(key)
+            if future is None:
+                future = self._pool.submit(self._open, path, key)
+                self._building[key] = future
+        try:
+            return future.result()
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+
+    def _open(self, path, key):
+        directory = os.path.join(self.cache_dir, key[:2], key)
+        if not os.path.exists(os.path.join(directory, 'meta.json')):
+            with span('tiles.build'):
+                build_pyramid(path, directory, self.tile_size)
+        pyramid = self._pyramids[key] = TilePyramid(directory)
+        return pyramid
+
+    def info(self, path):
+        """Return {'width', 'height', 'tile_size', 'levels'} for path"""
+        return dict(self.pyramid(path).meta)
+
+    def tile(self, path, level, x, y):
+        key = (self._key(path), level, x, y)
+        data = self._memory.get(key)
+        if data is None:
+            data = self.pyramid(path).tile(level, x, y)
+            if data is not None:
+                self._memory.put(key, data)
+        return data
+
+    def _serve(self, relpath, query):
+        path = self._server.resolve(relpath)
+        if path is None:
+            return None
+        try:
+            level, x, y = (int(query.get(name, ['0'])[0]) for name in ('level', 'x', 'y'))
+            data = self.tile(path, level, x, y)
+        except (ImportError, OSError, ValueError):
+            return None
+        if data is None:
+            return None
+        return data, 'image/jpeg'
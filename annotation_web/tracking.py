@@ -0,0 +1,206 @@
+"""Fill in boxes across sequential frames by interpolation and tracking.
+
+A sequence is the frames of one video (see annotation_web.video), or the
+images directly inside one folder, in path order. Boxes that follow one
+object share a 'track' ID. Hand-drawn boxes on a track are its keyframes;
+the boxes generated between them carry 'source' ('interpolated' or
+'tracked') and 'verified': False, and are replaced whenever the track is
+regenerated.
+
+interpolate() fills the frames between keyframes from the keyframe edges,
+linearly or along a cubic Hermite spline with Catmull-Rom tangents, in one
+vectorized pass. CorrelationTracker follows boxes from a frame onward with
+MOSSE correlation filters: every box is sampled with one gather and
+correlated with one batched FFT per frame, so frame decoding, read ahead on
+a separate thread, is what bounds throughput. Filters only estimate
+translation; a box keeps its size until the next keyframe.
+"""
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from annotation_web.video import open_image
+
+METHODS = ('linear', 'spline')
+SOURCES = ('interpolated', 'tracked')
+TRACK_FRAMES = 100
+WINDOW = 64
+# Search region around a box, as a multiple of its size
+PADDING = 2.0
+LEARNING_RATE = 0.125
+SIGMA = 2.0
+# Peak-to-sidelobe ratio below which a box counts as lost
+MIN_PSR = 7.0
+READ_AHEAD = 4
+_EPS = 1e-5
+
+
+def interpolate(keyframes, frames, method='linear'):
+    """Return an (n, 4) array of boxes for frames between keyframes
+
+    keyframes maps frame number to an (x0, y0, x1, y1) box and needs at
+    least two entries; frames outside their range are clamped to the
+    first or last keyframe.
+    """
+    if method not in METHODS:
+        raise ValueError('unknown interpolation method: %s' % method)
+    keys = np.array(sorted(keyframes), dtype=np.float64)
+    values = np.array([keyframes[k] for k in sorted(keyframes)], dtype=np.float64)
+    frames = np.clip(np.asarray(frames, dtype=np.float64), keys[0], keys[-1])
+    segment = np.clip(np.searchsorted(keys, frames, side='right') - 1, 0, len(keys) - 2)
+    t0, t1 = keys[segment], keys[segment + 1]
+    span = (t1 - t0)[:, None]
+    u = ((frames - t0) / (t1 - t0))[:, None]
+    p0, p1 = values[segment], values[segment + 1]
+    if method == 'linear' or len(keys) == 2:
+        boxes = p0 + u * (p1 - p0)
+    else:
+        # Catmull-Rom tangents for uneven keyframe spacing; one-sided at the ends
+        tangents = np.empty_like(values)
+        tangents[1:-1] = (values[2:] - values[:-2]) / (keys[2:] - keys[:-2])[:, None]
+        tangents[0] = (values[1] - values[0]) / (keys[1] - keys[0])
+        tangents[-1] = (values[-1] - values[-2]) / (keys[-1] - keys[-2])
+        u2, u3 = u * u, u * u * u
+        boxes = ((2 * u3 - 3 * u2 + 1) * p0 + (u3 - 2 * u2 + u) * span * tangents[segment]
+                 + (-2 * u3 + 3 * u2) * p1 + (u3 - u2) * span * tangents[segment + 1])
+    # A spline can overshoot into an inverted box between close keyframes
+    boxes[:, 2] = np.maximum(boxes[:, 2], boxes[:, 0] + 1)
+    boxes[:, 3] = np.maximum(boxes[:, 3], boxes[:, 1] + 1)
+    return boxes
+
+
+def load_gray(path):
+    """Decode path, or a video frame path, as a uint8 grayscale array"""
+    with open_image(path) as img:
+        return np.asarray(img.convert('L'))
+
+
+def read_ahead(paths, depth=READ_AHEAD):
+    """Yield load_gray(path) for paths in order, decoding up to depth ahead"""
+    paths = iter(paths)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='track-decode') as pool:
+        pending = deque(pool.submit(load_gray, path) for path in itertools.islice(paths, depth))
+        while pending:
+            gray = pending.popleft().result()
+            for path in itertools.islice(paths, 1):
+                pending.append(pool.submit(load_gray, path))
+            yield gray
+
+
+class CorrelationTracker:
+    """MOSSE correlation filters following several boxes at once"""
+
+    def __init__(self, gray, boxes, window=WINDOW, learning_rate=LEARNING_RATE,
+                 min_psr=MIN_PSR):
+        self.window = window
+        self.learning_rate = learning_rate
+        self.min_psr = min_psr
+        self.boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+        self.alive = np.ones(len(self.boxes), dtype=bool)
+        self._grid = np.arange(window) - window / 2 + 0.5
+        self._cosine = np.outer(np.hanning(window), np.hanning(window)).astype(np.float32)
+        yy, xx = np.mgrid[:window, :window] - window // 2
+        target = np.exp(-(xx ** 2 + yy ** 2) / (2 * SIGMA ** 2))
+        self._target = np.fft.fft2(target)
+        # Sidelobe excludes an 11x11 square around the peak
+        self._rows = np.arange(window)[None, :, None]
+        self._cols = np.arange(window)[None, None, :]
+
+        # Train on the box at a few scales so small zooms do not lose it
+        self._a = np.zeros((len(self.boxes), window, window), dtype=np.complex128)
+        self._b = np.zeros_like(self._a)
+        for scale in (1.0, 0.9, 1.1):
+            f = np.fft.fft2(self._patches(gray, self.boxes, scale))
+            self._a += self._target * np.conj(f)
+            self._b += f * np.conj(f)
+        self._b += _EPS
+
+    def _patches(self, gray, boxes, scale=1.0):
+        """Sample an (n, window, window) normalized patch around each box"""
+        height, width = gray.shape
+        cx = (boxes[:, 0] + boxes[:, 2]) / 2
+        cy = (boxes[:, 1] + boxes[:, 3]) / 2
+        step_x = PADDING * scale * np.maximum(boxes[:, 2] - boxes[:, 0], 1) / self.window
+        step_y = PADDING * scale * np.maximum(boxes[:, 3] - boxes[:, 1], 1) / self.window
+        xs = np.clip(np.rint(cx[:, None] + self._grid * step_x[:, None]), 0, width - 1).astype(np.intp)
+        ys = np.clip(np.rint(cy[:, None] + self._grid * step_y[:, None]), 0, height - 1).astype(np.intp)
+        patches = np.log1p(gray[ys[:, :, None], xs[:, None, :]].astype(np.float32))
+        patches -= patches.mean(axis=(1, 2), keepdims=True)
+        patches /= patches.std(axis=(1, 2), keepdims=True) + _EPS
+        return patches * self._cosine
+
+    def _subpixel(self, response, peak_y, peak_x):
+        """Refine integer peaks with a parabola through each peak's neighbours"""
+        n = np.arange(len(response))
+        w = self.window
+
+        def vertex(before, at, after):
+            curvature = before - 2 * at + after
+            return np.where(np.abs(curvature) > _EPS, 0.5 * (before - after) / curvature, 0.0)
+
+        # The response is circular, so neighbours wrap around the window
+        at = response[n, peak_y, peak_x]
+        offset_x = vertex(response[n, peak_y, (peak_x - 1) % w], at,
+                          response[n, peak_y, (peak_x + 1) % w])
+        offset_y = vertex(response[n, (peak_y - 1) % w, peak_x], at,
+                          response[n, (peak_y + 1) % w, peak_x])
+        return np.clip(offset_x, -0.5, 0.5), np.clip(offset_y, -0.5, 0.5)
+
+    def update(self, gray):
+        """Move the live boxes to gray; returns (boxes, psr, alive)"""
+        live = np.flatnonzero(self.alive)
+        psr = np.zeros(len(self.boxes))
+        if not len(live):
+            return self.boxes.copy(), psr, self.alive.copy()
+        boxes = self.boxes[live]
+        f = np.fft.fft2(self._patches(gray, boxes))
+        response = np.real(np.fft.ifft2(self._a[live] / self._b[live] * f))
+
+        flat = response.reshape(len(live), -1)
+        peak = flat.argmax(axis=1)
+        peak_y, peak_x = np.divmod(peak, self.window)
+        near = ((np.abs(self._rows - peak_y[:, None, None]) <= 5)
+                & (np.abs(self._cols - peak_x[:, None, None]) <= 5)).reshape(len(live), -1)
+        sidelobe = np.where(near, np.nan, flat)
+        peak_value = flat[np.arange(len(live)), peak]
+        psr[live] = ((peak_value - np.nanmean(sidelobe, axis=1))
+                     / (np.nanstd(sidelobe, axis=1) + _EPS))
+
+        found = psr[live] >= self.min_psr
+        self.alive[live[~found]] = False
+        if found.any():
+            moved = live[found]
+            step_x = PADDING * np.maximum(boxes[found, 2] - boxes[found, 0], 1) / self.window
+            step_y = PADDING * np.maximum(boxes[found, 3] - boxes[found, 1], 1) / self.window
+            offset_x, offset_y = self._subpixel(response[found], peak_y[found], peak_x[found])
+            dx = (peak_x[found] + offset_x - self.window // 2) * step_x
+            dy = (peak_y[found] + offset_y - self.window // 2) * step_y
+            self.boxes[moved] += np.stack([dx, dy, dx, dy], axis=1)
+
+            f = np.fft.fft2(self._patches(gray, self.boxes[moved]))
+            rate = self.learning_rate
+            self._a[moved] = rate * self._target * np.conj(f) + (1 - rate) * self._a[moved]
+            self._b[moved] = rate * (f * np.conj(f) + _EPS) + (1 - rate) * self._b[moved]
+        return self.boxes.copy(), psr, self.alive.copy()
+
+
+def track(paths, boxes, min_psr=MIN_PSR):
+    """Follow (x0, y0, x1, y1) boxes on paths[0] through the later paths
+
+    Yields (step, boxes, alive) for paths[1:], stopping early once every box
+    is lost or a frame cannot be decoded.
+    """
+    frames = read_ahead(paths)
+    try:
+        tracker = CorrelationTracker(next(frames), boxes, min_psr=min_psr)
+        for step, gray in enumerate(frames, 1):
+            boxes, _, alive = tracker.update(gray)
+            yield step, boxes, alive
+            if not alive.any():
+                break
+    except OSError:
+        return
+    finally:
+        frames.close()
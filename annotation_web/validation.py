@@ -0,0 +1,125 @@
+"""Schema checks for the annotation documents both tools read and write.
+
+Detection documents map an image name to a list of canvas-space boxes,
+circles, polygons and points ({x, y, width, height, type, label}, polygons
+adding [x, y] 'points' inside that bounding box); classification documents
+are the checker's flat [{filename, label, verified}] list. A single-image
+export of cv-annotation-tool.html, {imageName, imageWidth, imageHeight,
+annotations}, is read as the detection document {imageName: annotations}
+that also records the image size. The same checks guard
+edits coming in over js_api and files fed to the command line.
+"""
+import math
+import numbers
+
+ANNOTATION_TYPES = ('box', 'circle', 'polygon', 'point')
+# Boxes on tiled images are stored in full-resolution pixels
+COORDINATE_SPACES = ('canvas', 'image')
+
+
+def _is_number(value):
+    return (isinstance(value, numbers.Real) and not isinstance(value, bool)
+            and math.isfinite(value))
+
+
+def validate_annotation(ann):
+    """Return a list of problems with one detection annotation"""
+    if not isinstance(ann, dict):
+        return ['annotation is not an object']
+    errors = []
+    for key in ('x', 'y', 'width', 'height'):
+        if not _is_number(ann.get(key)):
+            errors.append('%s must be a finite number' % key)
+    # A point's bounding box is empty
+    if ann.get('type') != 'point':
+        for key in ('width', 'height'):
+            if _is_number(ann.get(key)) and ann[key] <= 0:
+                errors.append('%s must be positive' % key)
+    if ann.get('type') not in ANNOTATION_TYPES:
+        errors.append('type must be one of %s' % ', '.join(ANNOTATION_TYPES))
+    if ann.get('type') == 'polygon':
+        points = ann.get('points')
+        if not (isinstance(points, list) and len(points) >= 3 and all(
+                isinstance(p, (list, tuple)) and len(p) == 2 and all(map(_is_number, p))
+                for p in points)):
+            errors.append('points must list at least three [x, y] pairs')
+    if not isinstance(ann.get('label'), str) or not ann['label']:
+        errors.append('label must be a non-empty string')
+    if 'confidence' in ann and not _is_number(ann['confidence']):
+        errors.append('confidence must be a finite number')
+    if 'zoom' in ann and not (_is_number(ann['zoom']) and ann['zoom'] > 0):
+        errors.append('zoom must be a positive number')
+    if ann.get('space', 'canvas') not in COORDINATE_SPACES:
+        errors.append('space must be one of %s' % ', '.join(COORDINATE_SPACES))
+    return errors
+
+
+def validate_label_entry(entry):
+    """Return a list of problems with one classification entry"""
+    if not isinstance(entry, dict):
+        return ['entry is not an object']
+    errors = []
+    if not isinstance(entry.get('filename'), str) or not entry['filename']:
+        errors.append('filename must be a non-empty string')
+    if not isinstance(entry.get('label'), str) or not entry['label']:
+        errors.append('label must be a non-empty string')
+    if 'verified' in entry and not isinstance(entry['verified'], bool):
+        errors.append('verified must be a boolean')
+    return errors
+
+
+def document_kind(data):
+    """Return 'detection' or 'classification' for a loaded document"""
+    if isinstance(data, list):
+        return 'classification'
+    if isinstance(data, dict):
+        return 'detection'
+    raise ValueError('Annotation document must be a JSON object or list')
+
+
+def expand_document(data):
+    """Return (document, sizes) for a loaded document
+
+    A single-image export becomes {imageName: annotations} with sizes
+    {imageName: (imageWidth, imageHeight)}; anything else is returned as is
+    with no sizes.
+    """
+    if (isinstance(data, dict) and isinstance(data.get('annotations'), list)
+            and 'imageWidth' in data and 'imageHeight' in data):
+        # Exports from before the name was recorded
+        name = data.get('imageName') or 'image'
+        return {name: data['annotations']}, {name: (data['imageWidth'], data['imageHeight'])}
+    return data, {}
+
+
+def validate_document(data):
+    """Yield (location, message) for every problem in a loaded document"""
+    data, sizes = expand_document(data)
+    for image, size in sizes.items():
+        if not all(_is_number(v) and v > 0 for v in size):
+            yield image, 'imageWidth and imageHeight must be positive numbers'
+    if document_kind(data) == 'classification':
+        seen = set()
+        for i, entry in enumerate(data):
+            for error in validate_label_entry(entry):
+                yield '[%d]' % i, error
+            filename = entry.get('filename') if isinstance(entry, dict) else None
+            if filename in seen:
+                yield '[%d]' % i, 'duplicate filename %r' % filename
+            seen.add(filename)
+        return
+
+    for image, anns in data.items():
+        if not isinstance(anns, list):
+            yield image, 'annotations must be a list'
+            continue
+        ids = set()
+        for i, ann in enumerate(anns):
+            location = '%s[%d]' % (image, i)
+            for error in validate_annotation(ann):
+                yield location, error
+            ann_id = ann.get('id') if isinstance(ann, dict) else None
+            if ann_id is not None:
+                if ann_id in ids:
+                    yield location, 'duplicate id %r' % ann_id
+                ids.add(ann_id)
@@ -0,0 +1,288 @@
+"""Videos under a dataset root, presented as virtual image sequences.
+
+A video is indexed as one row per frame, named like a file in a directory
+called after the video (survey/dive3.mp4/0000123.jpg), so browsing,
+labelling, boxes and every exporter work on frames without the video being
+exploded into JPEGs first; an export even lines up with ffmpeg's
+"dive3.mp4/%07d.jpg" output should the frames be extracted later.
+
+The first time a video is seen its packets are demuxed, not decoded, to
+record each frame's presentation timestamp and which frames are keyframes.
+That index is cached on disk keyed by the file's path, size and mtime.
+
+Frames are decoded on demand. A request seeks to the last keyframe at or
+before the frame and decodes forward to it, unless the decoder already sits
+between that keyframe and the frame, as it does when stepping through a
+clip, in which case decoding just continues. Decoded frames are kept in a
+byte-bounded LRU and a few containers stay open between requests.
+
+Decoding uses PyAV (pip install av), imported on first use.
+"""
+import hashlib
+import json
+import os
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+VIDEO_EXTENSIONS = {'.mp4', '.m4v', '.mov', '.mkv', '.avi', '.webm', '.mpg', '.mpeg'}
+FRAME_NAME = '%07d.jpg'
+MAX_OPEN_VIDEOS = 8
+FRAME_CACHE_BYTES = 512 * 1024 * 1024
+JPEG_QUALITY = 90
+
+
+def is_video_file(name):
+    return os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS
+
+
+def frame_path(video, number):
+    """Return the virtual path of frame number of video"""
+    return os.path.join(video, FRAME_NAME % number)
+
+
+def split_frame_path(path):
+    """Return (video path, frame number) if path names a frame, else None"""
+    video, name = os.path.split(path)
+    stem, ext = os.path.splitext(name)
+    if ext == '.jpg' and stem.isdigit() and is_video_file(video):
+        return video, int(stem)
+    return None
+
+
+def source_file(path):
+    """Return the file holding path's pixels: its video for a frame"""
+    parts = split_frame_path(path)
+    return parts[0] if parts else path
+
+
+class VideoIndex:
+    """Presentation timestamps of every frame and which ones are keyframes"""
+
+    def __init__(self, width, height, time_base, pts, keyframes):
+        self.width = width
+        self.height = height
+        self.time_base = tuple(time_base)
+        # Both sorted: pts in presentation order, keyframes as frame numbers
+        self.pts = array('q', pts)
+        self.keyframes = array('q', keyframes or [0])
+
+    def __len__(self):
+        return len(self.pts)
+
+    @property
+    def fps(self):
+        if len(self.pts) < 2:
+            return 0.0
+        seconds = (self.pts[-1] - self.pts[0]) * self.time_base[0] / self.time_base[1]
+        return (len(self.pts) - 1) / seconds if seconds > 0 else 0.0
+
+    def frame_at(self, pts):
+        """Return the number of the frame presented at pts, or None"""
+        i = bisect_left(self.pts, pts)
+        return i if i < len(self.pts) and self.pts[i] == pts else None
+
+    def keyframe_for(self, number):
+        """Return the last keyframe at or before frame number"""
+        return self.keyframes[max(bisect_right(self.keyframes, number) - 1, 0)]
+
+    @classmethod
+    def build(cls, path):
+        """Demux path once, without decoding, and index its first video stream"""
+        import av
+
+        pts, keyframe_pts = [], []
+        with av.open(path) as container:
+            stream = container.streams.video[0]
+            for packet in container.demux(stream):
+                # The demuxer ends with an empty flush packet
+                if packet.pts is None:
+                    continue
+                pts.append(packet.pts)
+                if packet.is_keyframe:
+                    keyframe_pts.append(packet.pts)
+            width, height = stream.codec_context.width, stream.codec_context.height
+            time_base = stream.time_base
+        # Packets arrive in decode order; B-frames make that differ from display order
+        pts.sort()
+        keyframes = sorted({bisect_left(pts, p) for p in keyframe_pts})
+        return cls(width, height, (time_base.numerator, time_base.denominator), pts, keyframes)
+
+    def to_dict(self):
+        return {'width': self.width, 'height': self.height, 'time_base': list(self.time_base),
+                'pts': self.pts.tolist(), 'keyframes': self.keyframes.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['width'], data['height'], data['time_base'], data['pts'], data['keyframes'])
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def video_index(path):
+    """Return the VideoIndex of path, demuxing the file only on a cache miss"""
+    from annotation_web.dataset_index import default_cache_dir
+
+    st = os.stat(path)
+    raw = '%s\0%d\0%d' % (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+    key = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    with _indexes_lock:
+        index = _indexes.get(key)
+    if index is not None:
+        return index
+
+    cache_path = os.path.join(default_cache_dir('videos'), key + '.json')
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            index = VideoIndex.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError):
+        index = VideoIndex.build(path)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index.to_dict(), f, separators=(',', ':'))
+        os.replace(tmp_path, cache_path)
+    with _indexes_lock:
+        _indexes[key] = index
+    return index
+
+
+class _Decoder:
+    """One open container and where its decoder has got to"""
+
+    def __init__(self, path, index):
+        import av
+
+        self.index = index
+        self.lock = threading.Lock()
+        self._container = av.open(path)
+        self._stream = self._container.streams.video[0]
+        self._stream.thread_type = 'AUTO'
+        self._frames = None
+        # Number of the frame self._frames yields next, when known
+        self._next = None
+
+    def close(self):
+        with self.lock:
+            self._container.close()
+
+    def decode(self, number):
+        """Return frame number as an RGB Pillow image; call with lock held"""
+        keyframe = self.index.keyframe_for(number)
+        if self._next is None or not keyframe <= self._next <= number:
+            self._container.seek(self.index.pts[keyframe], stream=self._stream,
+                                 backward=True, any_frame=False)
+            self._frames = self._container.decode(self._stream)
+            self._next = None
+        for frame in self._frames:
+            current = self.index.frame_at(frame.pts) if frame.pts is not None else None
+            if current is None:
+                continue
+            self._next = current + 1
+            if current == number:
+                return frame.to_image()
+            if current > number:
+                break
+        self._next = None
+        raise OSError('frame %d could not be decoded' % number)
+
+
+class FrameReader:
+    """Decode frames by path, sharing open containers and recent frames"""
+
+    def __init__(self, max_open=MAX_OPEN_VIDEOS, cache_bytes=FRAME_CACHE_BYTES):
+        from annotation_web.thumbnails import LRUCache
+
+        self.max_open = max_open
+        # Raw RGB bytes; frames are re-encoded for whoever asks
+        self._cache = LRUCache(cache_bytes)
+        self._decoders = OrderedDict()
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            decoders = list(self._decoders.values())
+            self._decoders.clear()
+        for decoder in decoders:
+            decoder.close()
+
+    def _decoder(self, key, index):
+        with self._lock:
+            decoder = self._decoders.get(key)
+            if decoder is not None:
+                self._decoders.move_to_end(key)
+                return decoder
+        decoder = _Decoder(key[0], index)
+        evicted = []
+        with self._lock:
+            existing = self._decoders.get(key)
+            if existing is not None:
+                evicted.append(decoder)
+                decoder = existing
+            else:
+                self._decoders[key] = decoder
+                while len(self._decoders) > self.max_open:
+                    evicted.append(self._decoders.popitem(last=False)[1])
+        # Closing waits for a decode in progress, so do it outside the lock
+        for old in evicted:
+            old.close()
+        return decoder
+
+    def image(self, path):
+        """Return the frame named by path as an RGB Pillow image"""
+        from PIL import Image
+
+        video, number = split_frame_path(path)
+        st = os.stat(video)
+        key = (video, st.st_size, st.st_mtime_ns)
+        index = video_index(video)
+        if not 0 <= number < len(index):
+            raise OSError('%s has no frame %d' % (video, number))
+        data = self._cache.get(key + (number,))
+        if data is None:
+            decoder = self._decoder(key, index)
+            with decoder.lock:
+                try:
+                    image = decoder.decode(number)
+                except OSError:
+                    raise
+                except Exception as e:
+                    # PyAV's errors do not all derive from OSError
+                    raise OSError('%s: %s' % (path, e)) from e
+            if image.size != (index.width, index.height):
+                image = image.resize((index.width, index.height))
+            data = image.tobytes()
+            self._cache.put(key + (number,), data)
+        return Image.frombytes('RGB', (index.width, index.height), data)
+
+    def jpeg(self, path, quality=JPEG_QUALITY):
+        """Return the frame named by path encoded as JPEG bytes"""
+        import io
+
+        buf = io.BytesIO()
+        self.image(path).save(buf, 'JPEG', quality=quality)
+        return buf.getvalue()
+
+
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def frame_reader():
+    """Return the process-wide FrameReader"""
+    global _reader
+    with _reader_lock:
+        if _reader is None:
+            _reader = FrameReader()
+        return _reader
+
+
+def open_image(path):
+    """Open path with Pillow, decoding it from its video if it names a frame"""
+    if split_frame_path(path) is not None:
+        return frame_reader().image(path)
+    from PIL import Image
+
+    return Image.open(path)
@@ -0,0 +1,187 @@
+"""Drive a shared annotation server with many concurrent writers.
+
+Each simulated annotator keeps one HTTP connection open and, as fast as
+the server answers, adds a box or sets a label on a random image through
+the same /api/<method> calls the browser shim makes. Throughput, latency
+percentiles, refused (409) writes, and the push events seen by one extra
+listening client are reported.
+
+    python benchmarks/load_test.py --clients 15 --duration 10
+    python benchmarks/load_test.py --url http://127.0.0.1:8765
+
+Without --url a synthetic dataset is written to a temporary directory and
+served by annotation_app.py --serve in a child process.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import synthetic
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(REPO_ROOT, 'annotation_web', 'annotation_app.py')
+READY_PREFIX = 'Serving '
+TIMEOUT = 60
+
+
+def start_server(dataset, cache_dir):
+    """Serve dataset from a child process and return (process, base URL)"""
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, ANNOTATION_CACHE_DIR=cache_dir)
+    proc = subprocess.Popen([sys.executable, APP, '--serve', dataset, '--port', '0'],
+                            env=env, stdout=subprocess.PIPE, text=True)
+    started = time.perf_counter()
+    for line in proc.stdout:
+        if line.startswith(READY_PREFIX):
+            return proc, line.rsplit(' ', 1)[1].strip()
+        if time.perf_counter() - started > TIMEOUT:
+            break
+    proc.kill()
+    raise RuntimeError('server did not start')
+
+
+class Client:
+    """One annotator's keep-alive connection"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=TIMEOUT)
+        self.client_id = uuid.uuid4().hex
+
+    def call(self, method, *args):
+        body = json.dumps(args)
+        self.conn.request('POST', '/api/' + method, body, {
+            'Content-Type': 'application/json', 'X-Client-Id': self.client_id})
+        response = self.conn.getresponse()
+        payload = json.loads(response.read())
+        return response.status, payload.get('result')
+
+
+def listen(url, counts, stop):
+    """Count push events on /events until stop is set"""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=TIMEOUT)
+    conn.request('GET', '/events?client=listener')
+    response = conn.getresponse()
+    while not stop.is_set():
+        line = response.fp.readline()
+        if not line:
+            break
+        if line.startswith(b'data:'):
+            counts['events'] += 1
+
+
+def annotate(url, images, duration, label_ratio, results):
+    client = Client(url)
+    latencies, statuses = [], {}
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        image = random.choice(images)
+        started = time.perf_counter()
+        if random.random() < label_ratio:
+            status, _ = client.call('set_label', image['path'],
+                                    'class_%d' % random.randrange(5), False)
+        else:
+            x, y = random.uniform(0, 700), random.uniform(0, 500)
+            status, _ = client.call('add_annotation', image['key'], {
+                'id': uuid.uuid4().hex, 'type': 'box', 'label': 'object',
+                'x': x, 'y': y, 'width': random.uniform(5, 100),
+                'height': random.uniform(5, 100)})
+        latencies.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+    results.append((latencies, statuses))
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', help='server to test (default: start one)')
+    parser.add_argument('--images', type=int, default=2000,
+                        help='size of the synthetic dataset')
+    parser.add_argument('--clients', type=int, default=15)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds')
+    parser.add_argument('--label-ratio', type=float, default=0.2,
+                        help='fraction of writes that set labels instead of adding boxes')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args(argv)
+
+    workdir = proc = None
+    url = args.url
+    try:
+        if url is None:
+            workdir = tempfile.mkdtemp(prefix='annotation-load-')
+            dataset = os.path.join(workdir, 'data')
+            synthetic.make_image_folder(dataset, args.images)
+            proc, url = start_server(dataset, os.path.join(workdir, 'cache'))
+
+        setup = Client(url)
+        _, page = setup.call('list_images', 0, 1000)
+        images = page['images']
+        if not images:
+            parser.error('the server has no images')
+
+        counts, stop = {'events': 0}, threading.Event()
+        threading.Thread(target=listen, args=(url, counts, stop), daemon=True).start()
+        time.sleep(0.2)
+
+        results = []
+        threads = [threading.Thread(target=annotate,
+                                    args=(url, images, args.duration, args.label_ratio,
+                                          results))
+                   for _ in range(args.clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        time.sleep(0.5)
+        stop.set()
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=TIMEOUT)
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = [value for values, _ in results for value in values]
+    statuses = {}
+    for _, counts_by_status in results:
+        for status, n in counts_by_status.items():
+            statuses[status] = statuses.get(status, 0) + n
+    report = {
+        'clients': args.clients,
+        'writes': len(latencies),
+        'writes_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(1000 * statistics.median(latencies), 2),
+        'p95_ms': round(1000 * percentile(latencies, 0.95), 2),
+        'p99_ms': round(1000 * percentile(latencies, 0.99), 2),
+        'ok': statuses.get(200, 0),
+        'conflicts': statuses.get(409, 0),
+        'errors': sum(n for status, n in statuses.items() if status not in (200, 409)),
+        'events_received': counts['events'],
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print('%-16s %s' % (key, value))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
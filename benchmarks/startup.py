@@ -0,0 +1,89 @@
+"""Measure time-to-interactive of the desktop apps, CDN vs bundled frontend.
+
+Each run launches an app in a fresh process with ANNOTATION_EXIT_WHEN_READY
+set; the frontend reports its first committed render through js_api, the
+backend prints a marker and closes the window. The time from spawning the
+process to that marker is recorded.
+
+    python benchmarks/startup.py --runs 5
+
+The bundled mode requires `python annotation_web/frontend/build.py` first.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READY_MARKER = 'annotation-ui-ready'
+TIMEOUT = 60
+
+APPS = {
+    'annotation_app': os.path.join(REPO_ROOT, 'annotation_web', 'annotation_app.py'),
+    'checker': os.path.join(REPO_ROOT, 'test_model.py'),
+}
+
+
+def time_startup(script, mode):
+    """Return seconds until the app reports ready, or None on timeout"""
+    env = dict(os.environ, ANNOTATION_EXIT_WHEN_READY='1', ANNOTATION_FRONTEND=mode,
+               PYTHONPATH=REPO_ROOT)
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, script], env=env, stdout=subprocess.PIPE,
+                            text=True)
+    try:
+        for line in proc.stdout:
+            if line.strip() == READY_MARKER:
+                elapsed = time.perf_counter() - started
+                proc.wait(timeout=TIMEOUT)
+                return elapsed
+            if time.perf_counter() - started > TIMEOUT:
+                break
+        return None
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--apps', nargs='+', choices=sorted(APPS), default=sorted(APPS))
+    parser.add_argument('--modes', nargs='+', choices=('cdn', 'bundle'),
+                        default=['cdn', 'bundle'])
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args(argv)
+
+    bundled = os.path.join(REPO_ROOT, 'annotation_web', 'frontend', 'dist')
+    if 'bundle' in args.modes and not os.path.isdir(bundled):
+        parser.error('no bundle in %s; run annotation_web/frontend/build.py first' % bundled)
+
+    results = []
+    for app in args.apps:
+        for mode in args.modes:
+            samples = [time_startup(APPS[app], mode) for _ in range(args.runs)]
+            ok = [s for s in samples if s is not None]
+            results.append({
+                'app': app,
+                'mode': mode,
+                'runs': len(samples),
+                'failures': len(samples) - len(ok),
+                'median_s': round(statistics.median(ok), 3) if ok else None,
+                'min_s': round(min(ok), 3) if ok else None,
+            })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print('%-16s %-8s %10s %10s %9s' % ('app', 'mode', 'median_s', 'min_s', 'failures'))
+        for r in results:
+            print('%-16s %-8s %10s %10s %9d' % (r['app'], r['mode'], r['median_s'],
+                                                r['min_s'], r['failures']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
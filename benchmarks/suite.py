@@ -0,0 +1,444 @@
+"""Time the Python-side paths of both apps on synthetic datasets.
+
+Every benchmark runs in a fresh child process with its own annotation
+cache, so timings start cold and the peak RSS reported is that of the
+benchmark alone. Untimed setup (indexing before a re-scan, writing a
+journal before replaying it) happens in the same child before the clock
+starts. Each run appends one entry to a JSON-lines history file and is
+compared with the previous entry for the same benchmark and size; a drop
+in throughput or a rise in peak RSS beyond the tolerances is a regression.
+
+    python benchmarks/suite.py --sizes 1000 100000
+    python benchmarks/suite.py --only 'export.*' --repeat 5 --fail-on-regression
+
+Datasets are generated once per size and reused from --data-dir. The
+ui.startup.* benchmarks drive the desktop windows through
+benchmarks/startup.py and are skipped when pywebview is not installed.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+DEFAULT_HISTORY = os.path.join(HERE, 'history.jsonl')
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), 'annotation-bench')
+THROUGHPUT_TOLERANCE = 0.10
+RSS_TOLERANCE = 0.20
+THUMBNAIL_LIMIT = 2000
+LABEL_EDITS = 10000
+SERVER_SECONDS = 3
+SERVER_CLIENTS = 8
+
+# name -> (setup, run); both take a Context, run returns items processed
+BENCHMARKS = {}
+
+
+def benchmark(name, setup=None):
+    def register(fn):
+        BENCHMARKS[name] = (setup, fn)
+        return fn
+    return register
+
+
+class Context:
+    """What a benchmark gets: the dataset, its paths and a scratch directory"""
+
+    def __init__(self, root, size, scratch):
+        self.root = root
+        self.size = size
+        self.scratch = scratch
+        self.state = {}
+        self._paths = None
+
+    @property
+    def paths(self):
+        if self._paths is None:
+            from annotation_web.dataset_index import scan_tree
+
+            self._paths = sorted(path for path, _, _ in scan_tree(self.root))
+        return self._paths
+
+    def index(self, name='manifest'):
+        from annotation_web.dataset_index import DatasetIndex
+
+        return DatasetIndex(self.root, os.path.join(self.scratch, name + '.sqlite'))
+
+
+def _scanned(ctx):
+    index = ctx.index()
+    index.scan()
+    ctx.state['index'] = index
+
+
+def _hashed(ctx):
+    from annotation_web.dedup import hash_images
+
+    _scanned(ctx)
+    hash_images(ctx.state['index'])
+
+
+@benchmark('index.scan')
+def bench_index_scan(ctx):
+    index = ctx.index()
+    return index.scan()['total']
+
+
+@benchmark('index.rescan', setup=_scanned)
+def bench_index_rescan(ctx):
+    ctx.state['index'].close()
+    return ctx.index().scan()['total']
+
+
+@benchmark('index.page', setup=_scanned)
+def bench_index_page(ctx):
+    # Paging through the whole dataset the way the virtualized lists do
+    index, seen = ctx.state['index'], 0
+    for offset in range(0, len(index), 200):
+        seen += len(index.list_images(offset, 200))
+    return seen
+
+
+@benchmark('thumbnails.cold')
+def bench_thumbnails(ctx):
+    from annotation_web.image_server import ImageServer
+    from annotation_web.thumbnails import ThumbnailService
+
+    service = ThumbnailService(ImageServer(), cache_dir=os.path.join(ctx.scratch, 'thumbs'))
+    paths = ctx.paths[:THUMBNAIL_LIMIT]
+    for path in paths:
+        service.get(os.path.join(ctx.root, path), 128)
+    service.close()
+    return len(paths)
+
+
+@benchmark('dedup.hash', setup=_scanned)
+def bench_hash(ctx):
+    from annotation_web.dedup import hash_images
+
+    return hash_images(ctx.state['index'])
+
+
+@benchmark('stats.labels')
+def bench_label_stats(ctx):
+    from annotation_web.label_stats import LabelStats
+
+    paths = ctx.paths
+    stats = LabelStats(paths)
+    stats.load_labels({path: {'label': path.split(os.sep)[0], 'verified': False}
+                       for path in paths})
+    rng = random.Random(0)
+    for _ in range(LABEL_EDITS):
+        stats.set_label(rng.choice(paths), 'relabeled')
+        stats.summary()
+    return len(paths) + LABEL_EDITS
+
+
+def _detection(ctx):
+    import synthetic
+
+    return synthetic.detection_document(ctx.paths)
+
+
+@benchmark('journal.append')
+def bench_journal_append(ctx):
+    from annotation_web.journal import AnnotationJournal
+
+    journal = AnnotationJournal(os.path.join(ctx.scratch, 'journal'))
+    count = 0
+    for image, anns in _detection(ctx).items():
+        for ann in anns:
+            journal.append({'op': 'add', 'image': image, 'annotation': ann})
+            count += 1
+    journal.close()
+    return count
+
+
+def _journal_written(ctx):
+    bench_journal_append(ctx)
+
+
+@benchmark('journal.replay', setup=_journal_written)
+def bench_journal_replay(ctx):
+    from annotation_web.journal import AnnotationJournal
+
+    journal = AnnotationJournal(os.path.join(ctx.scratch, 'journal'))
+    count = sum(len(anns) for anns in journal.all_annotations().values())
+    journal.close()
+    return count
+
+
+@benchmark('model.query')
+def bench_model_query(ctx):
+    from annotation_web.model import AnnotationTable
+
+    table = AnnotationTable.from_document(_detection(ctx))
+    table.counts('label')
+    table.counts('kind')
+    for label in table.labels.names:
+        table.select(label=label)
+    return len(table.rows)
+
+
+def _export(ctx, fmt):
+    from annotation_web.exporters import detection_records, export, index_size_lookup
+
+    records = detection_records(_detection(ctx), index_size_lookup(ctx.state['index']))
+    suffix = '.json' if fmt == 'coco' else ''
+    return export(records, fmt, os.path.join(ctx.scratch, 'export' + suffix), workers=1)['images']
+
+
+@benchmark('export.coco', setup=_scanned)
+def bench_export_coco(ctx):
+    return _export(ctx, 'coco')
+
+
+@benchmark('export.yolo', setup=_scanned)
+def bench_export_yolo(ctx):
+    return _export(ctx, 'yolo')
+
+
+def _mean_colour(images):
+    return [('bright' if image.mean() > 127 else 'dark', 0.5) for image in images]
+
+
+@benchmark('prelabel.callable', setup=_hashed)
+def bench_prelabel(ctx):
+    from annotation_web.prelabel import CallableModel, PredictionCache, Prelabeler
+
+    index = ctx.state['index']
+    cache = PredictionCache(os.path.join(ctx.scratch, 'predictions.sqlite'))
+    runner = Prelabeler(CallableModel(_mean_colour, version='bench'), cache)
+    count = sum(1 for _ in runner.run(index.root, index.iter_images()))
+    cache.close()
+    return count
+
+
+@benchmark('server.writes')
+def bench_server_writes(ctx):
+    import asyncio
+
+    import load_test
+    from annotation_web.backend import DatasetAPI
+    from annotation_web.collab_server import CollabServer
+    from annotation_web.image_server import ImageServer
+
+    image_server = ImageServer()
+    image_server.public_base = ''
+    api = DatasetAPI(image_server)
+    api.open_directory(ctx.root)
+    server = CollabServer(api, '<html><head></head></html>')
+    loop = asyncio.new_event_loop()
+    host, port = loop.run_until_complete(server.start('127.0.0.1', 0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    url = 'http://%s:%d' % (host, port)
+
+    images = api.list_images(0, 1000)['images']
+    results = []
+    threads = [threading.Thread(target=load_test.annotate,
+                                args=(url, images, SERVER_SECONDS, 0.2, results))
+               for _ in range(SERVER_CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    loop.call_soon_threadsafe(loop.stop)
+    api._shutdown()
+    return sum(len(latencies) for latencies, _ in results)
+
+
+def _startup(app):
+    def run(ctx):
+        import startup
+
+        seconds = startup.time_startup(startup.APPS[app], 'cdn')
+        if seconds is None:
+            raise RuntimeError('%s did not report ready' % app)
+        return 1
+    return run
+
+
+for _app in ('annotation_app', 'checker'):
+    benchmark('ui.startup.' + _app)(_startup(_app))
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_child(name, root, size):
+    """Run one benchmark in this process and print its measurement as JSON"""
+    scratch = tempfile.mkdtemp(prefix='bench-')
+    os.environ['ANNOTATION_CACHE_DIR'] = os.path.join(scratch, 'cache')
+    sys.path[:0] = [REPO_ROOT, HERE]
+    setup, fn = BENCHMARKS[name]
+    ctx = Context(root, size, scratch)
+    try:
+        if setup is not None:
+            setup(ctx)
+        started = time.perf_counter()
+        items = fn(ctx)
+        seconds = time.perf_counter() - started
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    print(json.dumps({'seconds': seconds, 'items': items, 'peak_rss_mb': _peak_rss_mb()}))
+
+
+def measure(name, root, size, repeat):
+    """Return the median of repeat child runs of one benchmark"""
+    samples = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', name,
+             '--data-dir', root, '--sizes', str(size)],
+            capture_output=True, text=True)
+        if proc.returncode:
+            return {'benchmark': name, 'size': size,
+                    'error': (proc.stderr.strip().splitlines() or ['failed'])[-1]}
+        samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    seconds = statistics.median(s['seconds'] for s in samples)
+    items = samples[0]['items']
+    rss = [s['peak_rss_mb'] for s in samples if s['peak_rss_mb'] is not None]
+    return {
+        'benchmark': name,
+        'size': size,
+        'repeat': repeat,
+        'seconds': round(seconds, 4),
+        'items': items,
+        'items_per_s': round(items / seconds, 1) if seconds else None,
+        'peak_rss_mb': max(rss) if rss else None,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def load_history(path):
+    entries = []
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    return entries
+
+
+def previous_results(history):
+    """Return {(benchmark, size): result} from the latest entry that has each"""
+    latest = {}
+    for entry in history:
+        for result in entry['results']:
+            if 'error' not in result:
+                latest[result['benchmark'], result['size']] = result
+    return latest
+
+
+def regressions(result, previous, throughput_tolerance, rss_tolerance):
+    """Return human-readable reasons result is worse than previous"""
+    found = []
+    if previous is None or 'error' in result:
+        return found
+    if (result['items_per_s'] and previous.get('items_per_s')
+            and result['items_per_s'] < previous['items_per_s'] * (1 - throughput_tolerance)):
+        found.append('throughput %.1f -> %.1f items/s' % (
+            previous['items_per_s'], result['items_per_s']))
+    if (result['peak_rss_mb'] and previous.get('peak_rss_mb')
+            and result['peak_rss_mb'] > previous['peak_rss_mb'] * (1 + rss_tolerance)):
+        found.append('peak RSS %.1f -> %.1f MB' % (previous['peak_rss_mb'], result['peak_rss_mb']))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help='dataset sizes in images')
+    parser.add_argument('--only', nargs='+', default=['*'],
+                        help='glob patterns selecting benchmarks')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                        help='where synthetic datasets are generated and reused')
+    parser.add_argument('--history', default=DEFAULT_HISTORY)
+    parser.add_argument('--throughput-tolerance', type=float, default=THROUGHPUT_TOLERANCE)
+    parser.add_argument('--rss-tolerance', type=float, default=RSS_TOLERANCE)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--list', action='store_true', help='list benchmarks and exit')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child, args.data_dir, args.sizes[0])
+        return 0
+
+    names = [name for name in BENCHMARKS
+             if any(fnmatch.fnmatch(name, pattern) for pattern in args.only)]
+    if args.list:
+        print('\n'.join(names))
+        return 0
+
+    import importlib.util
+
+    if importlib.util.find_spec('webview') is None:
+        names = [name for name in names if not name.startswith('ui.')]
+
+    sys.path.insert(0, HERE)
+    import synthetic
+
+    previous = previous_results(load_history(args.history))
+    results, problems = [], []
+    print('%-20s %8s %10s %12s %10s' % ('benchmark', 'size', 'seconds', 'items/s', 'rss_mb'))
+    for size in args.sizes:
+        root = synthetic.ensure_image_folder(os.path.join(args.data_dir, str(size)), size)
+        for name in names:
+            result = measure(name, root, size, args.repeat)
+            results.append(result)
+            if 'error' in result:
+                print('%-20s %8d  error: %s' % (name, size, result['error']))
+                continue
+            reasons = regressions(result, previous.get((name, size)),
+                                  args.throughput_tolerance, args.rss_tolerance)
+            problems.extend('%s@%d: %s' % (name, size, reason) for reason in reasons)
+            print('%-20s %8d %10.3f %12s %10s%s' % (
+                name, size, result['seconds'], result['items_per_s'], result['peak_rss_mb'],
+                '  REGRESSION' if reasons else ''))
+
+    entry = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.history, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    for problem in problems:
+        print('regression: ' + problem)
+    return 1 if problems and args.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
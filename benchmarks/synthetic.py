@@ -0,0 +1,100 @@
+"""Generate synthetic datasets and annotation files for the benchmarks.
+
+Images are small PNGs spread over ImageFolder-style class directories, with
+a few byte-identical copies so hashing and duplicate paths see realistic
+input. Annotation documents come in both shapes the tools read: the
+annotation tool's {image: [box, ...]} mapping and the checker's
+[{filename, label, verified}] list.
+
+    python benchmarks/synthetic.py OUT --images 10000 --boxes 3
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+
+CLASSES = ('cat', 'dog', 'bird', 'fish', 'horse')
+IMAGE_SIZE = (64, 48)
+# One image in this many is a byte-identical copy of another
+DUPLICATE_EVERY = 50
+# Marks a folder as complete so interrupted generations are redone
+MARKER = '.synthetic-complete'
+
+
+def make_image_folder(root, count, size=IMAGE_SIZE, seed=0):
+    """Write count images under root/<class>/ and return their relative paths"""
+    from PIL import Image
+
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        label = CLASSES[i % len(CLASSES)]
+        relpath = os.path.join(label, '%07d.png' % i)
+        full = os.path.join(root, relpath)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        if i and i % DUPLICATE_EVERY == 0:
+            shutil.copyfile(os.path.join(root, paths[rng.randrange(i)]), full)
+        else:
+            Image.new('RGB', size, (i % 256, (i // 256) % 256, rng.randrange(256))).save(full)
+        paths.append(relpath)
+    return paths
+
+
+def ensure_image_folder(root, count):
+    """Reuse root if a complete dataset of count images is there, else build it"""
+    marker = os.path.join(root, MARKER)
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if f.read().strip() == str(count):
+                return root
+    shutil.rmtree(root, ignore_errors=True)
+    make_image_folder(root, count)
+    with open(marker, 'w') as f:
+        f.write(str(count))
+    return root
+
+
+def detection_document(paths, boxes_per_image=3, seed=0):
+    """Return {path: [canvas box, ...]} like the annotation tool exports"""
+    rng = random.Random(seed)
+    document = {}
+    for n, path in enumerate(paths):
+        boxes = []
+        for i in range(boxes_per_image):
+            boxes.append({'id': '%d-%d' % (n, i), 'type': 'box',
+                          'label': rng.choice(CLASSES),
+                          'x': rng.uniform(80, 600), 'y': rng.uniform(60, 450),
+                          'width': rng.uniform(5, 120), 'height': rng.uniform(5, 120)})
+        document[path.replace(os.sep, '/')] = boxes
+    return document
+
+
+def classification_document(paths, verified_ratio=0.5, seed=0):
+    """Return [{filename, label, verified}] like the checker exports"""
+    rng = random.Random(seed)
+    return [{'filename': path.replace(os.sep, '/'), 'label': path.split(os.sep)[0],
+             'verified': rng.random() < verified_ratio}
+            for path in paths]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('output')
+    parser.add_argument('--images', type=int, default=1000)
+    parser.add_argument('--boxes', type=int, default=3, help='boxes per image')
+    args = parser.parse_args(argv)
+
+    images = os.path.join(args.output, 'images')
+    paths = make_image_folder(images, args.images)
+    with open(os.path.join(args.output, 'detection.json'), 'w', encoding='utf-8') as f:
+        json.dump(detection_document(paths, args.boxes), f)
+    with open(os.path.join(args.output, 'classification.json'), 'w', encoding='utf-8') as f:
+        json.dump(classification_document(paths), f)
+    print('Wrote %d images and both annotation documents to %s' % (len(paths), args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
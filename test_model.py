@@ -1,8 +1,11 @@
-import webview
 import os
 import sys
 from pathlib import Path
 
+from annotation_web import collab_server
+from annotation_web.assets import window_source
+from annotation_web.backend import DatasetAPI
+
 # HTML content with the React app embedded
 HTML_CONTENT = """
 <!DOCTYPE html>
@@ -20,14 +23,162 @@ HTML_CONTENT = """
 <body>
     <div id="root"></div>
     
+    <script type="text/babel" data-shared></script>
     <script type="text/babel">
         const { Upload, AlertCircle, CheckCircle, ChevronLeft, ChevronRight } = lucide;
-        const { useState } = React;
+        const { useState, useRef, useEffect } = React;
+
+        // Mirrors annotation_web.folder_labels for datasets picked in the browser
+        const GENERIC_DIRS = new Set(['images', 'imgs', 'img', 'data', 'train', 'training', 'val', 'valid', 'validation', 'test', 'testing']);
+        const folderLabel = (pathParts) => {
+          // The first part is the folder the user picked, i.e. the dataset root
+          const dirs = pathParts.slice(1, -1);
+          for (let i = dirs.length - 1; i >= 0; i--) {
+            if (!GENERIC_DIRS.has(dirs[i].toLowerCase())) return dirs[i];
+          }
+          return 'Unknown';
+        };
+
+        // Render-to-commit time of the component calling it (see recordTiming)
+        const useRenderTiming = (name) => {
+          const started = performance.now();
+          useEffect(() => recordTiming(name, started));
+        };
+
+        const downloadUrl = (url, filename) => {
+          const link = document.createElement('a');
+          link.href = url;
+          link.download = filename;
+          link.click();
+        };
+
+        const downloadText = (text, filename, type) => {
+          downloadUrl(URL.createObjectURL(new Blob([text], { type })), filename);
+        };
+
+        // Latency percentiles per js_api method and pipeline stage, the
+        // Prometheus and Chrome trace dumps, and the sampling profiler
+        function DiagnosticsPanel() {
+          const [open, setOpen] = useState(false);
+          const [metrics, setMetrics] = useState(null);
+          const [profile, setProfile] = useState(null);
+
+          const refresh = async () => setMetrics(await window.pywebview.api.get_metrics());
+
+          useEffect(() => {
+            if (!open) return;
+            refresh();
+            const timer = setInterval(refresh, 2000);
+            return () => clearInterval(timer);
+          }, [open]);
+
+          const exportMetrics = async (fmt) => {
+            const text = await window.pywebview.api.export_metrics(fmt);
+            if (fmt === 'trace') downloadText(text, 'trace.json', 'application/json');
+            else downloadText(text, 'metrics.prom', 'text/plain');
+          };
+
+          const toggleProfiler = async () => {
+            if (metrics?.profiling) {
+              setProfile(await window.pywebview.api.stop_profiler());
+            } else {
+              setProfile(null);
+              await window.pywebview.api.start_profiler(5);
+            }
+            refresh();
+          };
+
+          // Slowest in total first: where the session's time actually went
+          const stages = Object.entries(metrics?.stages || {})
+            .sort(([, a], [, b]) => b.count * b.mean_ms - a.count * a.mean_ms)
+            .slice(0, 25);
+          const buttonClass = 'px-3 py-1 text-sm bg-white text-indigo-600 border border-indigo-600 rounded-lg hover:bg-indigo-50 transition';
+
+          return (
+            <div className="bg-white rounded-xl shadow-lg p-6">
+              <div className="flex items-center justify-between">
+                <h3 className="text-xl font-semibold">Diagnostics</h3>
+                <button onClick={() => setOpen(!open)} className={buttonClass}>
+                  {open ? 'Hide' : 'Show'}
+                </button>
+              </div>
+              {open && metrics && (
+                <div className="mt-4 space-y-4">
+                  <div className="flex gap-2">
+                    <button onClick={() => exportMetrics('prometheus')} className={buttonClass}>Download Prometheus</button>
+                    <button onClick={() => exportMetrics('trace')} className={buttonClass}>Download Chrome Trace</button>
+                    {/* Shared by every annotator when served, so read-only there */}
+                    {!window.ANNOTATION_SERVER && (
+                      <>
+                        <button onClick={async () => { await window.pywebview.api.reset_metrics(); refresh(); }} className={buttonClass}>Reset</button>
+                        <button onClick={toggleProfiler} className={buttonClass}>
+                          {metrics.profiling ? 'Stop Profiler' : 'Start Profiler'}
+                        </button>
+                      </>
+                    )}
+                  </div>
+                  <table className="w-full text-sm">
+                    <thead>
+                      <tr className="text-left text-gray-600">
+                        <th>Method / stage</th><th className="text-right">Calls</th>
+                        <th className="text-right">p50 ms</th><th className="text-right">p95 ms</th>
+                        <th className="text-right">p99 ms</th><th className="text-right">Max ms</th>
+                      </tr>
+                    </thead>
+                    <tbody>
+                      {stages.map(([name, s]) => (
+                        <tr key={name} className="border-t border-gray-100">
+                          <td className="font-mono">{name}</td><td className="text-right">{s.count}</td>
+                          <td className="text-right">{s.p50_ms.toFixed(2)}</td><td className="text-right">{s.p95_ms.toFixed(2)}</td>
+                          <td className="text-right">{s.p99_ms.toFixed(2)}</td><td className="text-right">{s.max_ms.toFixed(2)}</td>
+                        </tr>
+                      ))}
+                    </tbody>
+                  </table>
+                  {profile && (
+                    <div>
+                      <div className="flex items-center justify-between mb-2">
+                        <p className="text-sm text-gray-600">
+                          {profile.samples} samples over {profile.seconds}s, every {profile.interval_ms} ms
+                        </p>
+                        <button onClick={() => downloadText(profile.collapsed, 'profile.folded', 'text/plain')} className={buttonClass}>
+                          Download Collapsed Stacks
+                        </button>
+                      </div>
+                      <ul className="text-sm font-mono space-y-1">
+                        {profile.top.map(entry => (
+                          <li key={entry.function}>{entry.samples} {entry.function}</li>
+                        ))}
+                      </ul>
+                    </div>
+                  )}
+                </div>
+              )}
+            </div>
+          );
+        }
 
         function AnnotationChecker() {
-          const [images, setImages] = useState([]);
+          useRenderTiming('render');
+          const imageList = useImagePages();
           const [currentIndex, setCurrentIndex] = useState(0);
           const [stats, setStats] = useState(null);
+          // Only manually assigned labels are kept here, keyed by image path
+          const manualLabels = useRef(new Map());
+
+          const resetStats = (images) => {
+            manualLabels.current = new Map();
+            const distribution = {};
+            images.forEach(img => {
+              distribution[img.label] = (distribution[img.label] || 0) + 1;
+            });
+            setStats({
+              total: images.length,
+              labels: Object.keys(distribution).length,
+              verified: 0,
+              distribution
+            });
+          };
 
           const handleFileUpload = async (e) => {
             const files = Array.from(e.target.files);
@@ -38,76 +189,223 @@ HTML_CONTENT = """
               return;
             }
 
-            const loadedImages = await Promise.all(
-              imageFiles.map(async (file) => {
-                const url = URL.createObjectURL(file);
-                const pathParts = file.webkitRelativePath?.split('/') || file.name.split('/');
-                const fileName = file.name;
-                
-                return {
-                  url,
-                  name: fileName,
-                  file,
-                  label: 'Unknown'
-                };
-              })
-            );
-
-            setImages(loadedImages);
+            const loadedImages = imageFiles.map((file) => {
+              const src = URL.createObjectURL(file);
+              const pathParts = file.webkitRelativePath?.split('/') || file.name.split('/');
+              const fileName = file.name;
+              
+              return {
+                src,
+                name: fileName,
+                path: file.webkitRelativePath || fileName,
+                label: folderLabel(pathParts)
+              };
+            });
+
+            imageList.reset(0);
+            imageList.appendLocal(loadedImages);
             setCurrentIndex(0);
-            calculateStats(loadedImages);
+            resetStats(loadedImages);
           };
 
-          const calculateStats = (imgs) => {
-            const labelCounts = {};
-            imgs.forEach(img => {
-              labelCounts[img.label] = (labelCounts[img.label] || 0) + 1;
-            });
+          const handleOpenFolder = async () => {
+            const result = await window.pywebview.api.choose_directory();
+            if (!result) return;
 
-            setStats({
-              total: imgs.length,
-              labels: Object.keys(labelCounts).length,
-              distribution: labelCounts
+            imageList.reset(result.total);
+            setCurrentIndex(0);
+            manualLabels.current = new Map();
+            // Counting happens in Python; the UI only displays the result
+            setStats(await window.pywebview.api.get_stats());
+          };
+
+          const refreshTimer = useRef(null);
+
+          useEffect(() => {
+            const server = window.ANNOTATION_SERVER;
+            if (!server) return;
+            // Served to several annotators (annotation_web.collab_server): the
+            // dataset is already open, and other people's labels are picked up
+            // by refreshing at most once a second however many arrive
+            handleOpenFolder();
+            const onEvent = (e) => {
+              const event = JSON.parse(e.data);
+              if (event.type !== 'labels' || event.client === server.client || refreshTimer.current) return;
+              refreshTimer.current = setTimeout(async () => {
+                refreshTimer.current = null;
+                const [latest, page] = await Promise.all([
+                  window.pywebview.api.get_stats(),
+                  window.pywebview.api.list_images(0, 0)
+                ]);
+                setStats(latest);
+                manualLabels.current = new Map();
+                imageList.reset(page.total);
+              }, 1000);
+            };
+            server.events.addEventListener('message', onEvent);
+            return () => server.events.removeEventListener('message', onEvent);
+          }, []);
+
+          useEffect(() => {
+            imageList.ensureRange(currentIndex - 1, currentIndex + 2);
+          }, [currentIndex, imageList.total]);
+
+          const navigationStartRef = useRef(0);
+
+          useEffect(() => {
+            // Start decoding the neighbours before the user asks for them
+            navigationStartRef.current = performance.now();
+            window.pywebview?.api.prefetch(currentIndex);
+          }, [currentIndex]);
+
+          const handleImageLoad = () => {
+            window.pywebview?.api.report_display_time(performance.now() - navigationStartRef.current);
+          };
+
+          const withManualLabel = (img) => {
+            if (!img) return img;
+            const manual = manualLabels.current.get(img.path);
+            return {
+              ...img,
+              label: manual || img.label || 'Unknown',
+              confidence: manual ? null : img.confidence,
+              manuallyLabeled: Boolean(manual || img.verified)
+            };
+          };
+
+          const applyLocalLabel = (previous, wasVerified, label) => {
+            // Without the desktop bridge, update the counters by the delta of
+            // this one image instead of copying the list and recounting it.
+            setStats(prev => {
+              const distribution = { ...prev.distribution };
+              distribution[previous] -= 1;
+              if (distribution[previous] === 0) delete distribution[previous];
+              distribution[label] = (distribution[label] || 0) + 1;
+              return {
+                ...prev,
+                labels: Object.keys(distribution).length,
+                verified: prev.verified + (wasVerified ? 0 : 1),
+                distribution
+              };
             });
           };
 
           const handleManualLabel = (label) => {
-            const updated = [...images];
-            updated[currentIndex].label = label;
-            updated[currentIndex].manuallyLabeled = true;
-            setImages(updated);
-            calculateStats(updated);
+            const img = withManualLabel(imageList.getImage(currentIndex));
+            if (!img) return;
+            manualLabels.current.set(img.path, label);
+            if (window.pywebview) {
+              window.pywebview.api.set_label(img.path, label).then(setStats, (error) => {
+                // e.g. the image is leased to another annotator on a shared server
+                manualLabels.current.delete(img.path);
+                alert(error.message);
+              });
+            } else {
+              applyLocalLabel(img.label, img.manuallyLabeled, label);
+            }
+          };
+
+          const [batchScope, setBatchScope] = useState('folder');
+          const [batchPattern, setBatchPattern] = useState('');
+          const [batchLabel, setBatchLabel] = useState('');
+
+          const batchSelection = () => {
+            const img = imageList.getImage(currentIndex);
+            if (batchScope === 'glob') return { glob: batchPattern };
+            if (batchScope === 'cluster') return { cluster: img.path };
+            const slash = Math.max(img.path.lastIndexOf('/'), img.path.lastIndexOf('\\\\'));
+            return { folder: slash > 0 ? img.path.slice(0, slash) : '' };
+          };
+
+          const handleBatchLabel = async () => {
+            const label = batchLabel.trim();
+            if (!label || !imageList.getImage(currentIndex)) return;
+            if (batchScope === 'glob' && !batchPattern.trim()) return;
+            const selection = batchSelection();
+            const count = await window.pywebview.api.count_selection(selection);
+            if (count === 0 || !window.confirm(`Label ${count} image(s) as "${label}"?`)) return;
+            // One call, one journal write and one stats refresh for the batch
+            const result = await window.pywebview.api.apply_label(selection, label);
+            setStats(result.stats);
+            manualLabels.current = new Map();
+            imageList.reset(imageList.total);
           };
 
-          const nextImage = () => {
-            if (currentIndex < images.length - 1) {
+          const [prelabel, setPrelabel] = useState(null);
+
+          const handlePrelabel = async () => {
+            const model = await window.pywebview.api.choose_model();
+            if (!model) return;
+            setPrelabel(await window.pywebview.api.start_prelabel(model));
+          };
+
+          useEffect(() => {
+            if (!prelabel?.running) return;
+            // Predictions land in Python as they are made; poll for progress
+            // and refresh the labels once the run ends
+            const timer = setTimeout(async () => {
+              const status = await window.pywebview.api.get_prelabel_status();
+              setPrelabel(status);
+              if (!status.running) {
+                setStats(await window.pywebview.api.get_stats());
+                imageList.reset(imageList.total);
+              }
+            }, 500);
+            return () => clearTimeout(timer);
+          }, [prelabel]);
+
+          // 'order' walks the list; any other mode asks Python's review queue
+          // for the unverified image most worth checking next
+          const [reviewMode, setReviewMode] = useState('order');
+          const [reviewInfo, setReviewInfo] = useState(null);
+          const reviewHistory = useRef([]);
+          const reviewing = reviewMode !== 'order' && Boolean(window.pywebview);
+
+          const changeReviewMode = (mode) => {
+            setReviewMode(mode);
+            setReviewInfo(null);
+            reviewHistory.current = [];
+          };
+
+          const nextImage = async () => {
+            if (reviewing) {
+              const next = await window.pywebview.api.next_for_review(reviewMode);
+              setReviewInfo(next || { done: true });
+              if (!next) return;
+              reviewHistory.current.push(currentIndex);
+              setCurrentIndex(next.position);
+            } else if (currentIndex < imageList.total - 1) {
               setCurrentIndex(currentIndex + 1);
             }
           };
 
           const prevImage = () => {
-            if (currentIndex > 0) {
+            if (reviewing) {
+              if (reviewHistory.current.length) setCurrentIndex(reviewHistory.current.pop());
+            } else if (currentIndex > 0) {
               setCurrentIndex(currentIndex - 1);
             }
           };
 
           const exportLabels = () => {
-            const labelData = images.map(img => ({
+            const images = imageList.getLocal();
+            if (!images) {
+              // Python writes the file rather than paging the manifest in here;
+              // the shared server's labels route is same-origin with this page
+              if (window.ANNOTATION_SERVER) downloadUrl('/labels/annotations.json', 'annotations.json');
+              else window.pywebview.api.export_labels();
+              return;
+            }
+            const labelData = images.map(withManualLabel).map(img => ({
               filename: img.name,
               label: img.label,
-              verified: img.manuallyLabeled || false
+              verified: img.manuallyLabeled
             }));
             
-            const dataStr = JSON.stringify(labelData, null, 2);
-            const dataBlob = new Blob([dataStr], { type: 'application/json' });
-            const url = URL.createObjectURL(dataBlob);
-            const link = document.createElement('a');
-            link.href = url;
-            link.download = 'annotations.json';
-            link.click();
+            downloadText(JSON.stringify(labelData, null, 2), 'annotations.json', 'application/json');
           };
 
-          const currentImage = images[currentIndex];
+          const currentImage = withManualLabel(imageList.getImage(currentIndex));
 
           return (
             <div className="min-h-screen bg-gradient-to-br from-blue-50 to-indigo-100 p-8">
@@ -115,7 +413,7 @@ HTML_CONTENT = """
                 <h1 className="text-4xl font-bold text-gray-800 mb-2">Dataset Annotation Checker</h1>
                 <p className="text-gray-600 mb-8">Visualize and verify your image classification labels</p>
 
-                {images.length === 0 ? (
+                {imageList.total === 0 ? (
                   <div className="bg-white rounded-xl shadow-lg p-12">
                     <div className="text-center">
                       <Upload className="w-16 h-16 text-indigo-500 mx-auto mb-4" />
@@ -130,6 +428,14 @@ HTML_CONTENT = """
                         onChange={handleFileUpload}
                         className="block mx-auto mb-4 text-sm text-gray-500 file:mr-4 file:py-2 file:px-4 file:rounded-lg file:border-0 file:text-sm file:font-semibold file:bg-indigo-600 file:text-white hover:file:bg-indigo-700"
                       />
+                      {window.pywebview && (
+                        <button
+                          onClick={handleOpenFolder}
+                          className="px-4 py-2 bg-indigo-600 text-white rounded-lg hover:bg-indigo-700 transition"
+                        >
+                          Open Dataset Folder
+                        </button>
+                      )}
                     </div>
                   </div>
                 ) : (
@@ -138,13 +444,38 @@ HTML_CONTENT = """
                       <div className="bg-white rounded-xl shadow-lg p-6">
                         <div className="flex items-center justify-between mb-4">
                           <h3 className="text-xl font-semibold">Dataset Statistics</h3>
-                          <button
-                            onClick={exportLabels}
-                            className="px-4 py-2 bg-indigo-600 text-white rounded-lg hover:bg-indigo-700 transition"
-                          >
-                            Export Labels
-                          </button>
+                          <div className="flex gap-2">
+                            {window.pywebview && (
+                              <button
+                                onClick={prelabel?.running ? () => window.pywebview.api.cancel_prelabel() : handlePrelabel}
+                                className="px-4 py-2 bg-white text-indigo-600 border border-indigo-600 rounded-lg hover:bg-indigo-50 transition"
+                              >
+                                {prelabel?.running ? 'Stop Pre-labeling' : 'Pre-label with Model'}
+                              </button>
+                            )}
+                            {window.pywebview && (
+                              <button
+                                onClick={() => window.pywebview.api.export_dataset('coco', 'classification')}
+                                className="px-4 py-2 bg-white text-indigo-600 border border-indigo-600 rounded-lg hover:bg-indigo-50 transition"
+                              >
+                                Export COCO
+                              </button>
+                            )}
+                            <button
+                              onClick={exportLabels}
+                              className="px-4 py-2 bg-indigo-600 text-white rounded-lg hover:bg-indigo-700 transition"
+                            >
+                              Export Labels
+                            </button>
+                          </div>
                         </div>
+                        {prelabel && (
+                          <p className="text-sm text-gray-600 mb-4">
+                            {prelabel.error
+                              ? `Pre-labeling failed: ${prelabel.error}`
+                              : `Pre-labeled ${prelabel.done} of ${prelabel.total} images (${prelabel.cached} from cache, ${prelabel.failed} failed) at ${prelabel.images_per_second.toFixed(1)} img/s${prelabel.running ? '...' : ''}`}
+                          </p>
+                        )}
                         <div className="grid grid-cols-3 gap-4">
                           <div className="bg-blue-50 p-4 rounded-lg">
                             <div className="text-3xl font-bold text-blue-600">{stats.total}</div>
@@ -156,7 +487,7 @@ HTML_CONTENT = """
                           </div>
                           <div className="bg-purple-50 p-4 rounded-lg">
                             <div className="text-3xl font-bold text-purple-600">
-                              {images.filter(img => img.manuallyLabeled).length}
+                              {stats.verified}
                             </div>
                             <div className="text-sm text-gray-600">Verified</div>
                           </div>
@@ -167,19 +498,32 @@ HTML_CONTENT = """
                     <div className="bg-white rounded-xl shadow-lg p-6">
                       <div className="flex items-center justify-between mb-4">
                         <h3 className="text-xl font-semibold">
-                          Image {currentIndex + 1} of {images.length}
+                          Image {currentIndex + 1} of {imageList.total}
                         </h3>
                         <div className="flex gap-2">
+                          {window.pywebview && (
+                            <select
+                              value={reviewMode}
+                              onChange={(e) => changeReviewMode(e.target.value)}
+                              className="px-2 py-2 border border-gray-300 rounded-lg text-sm"
+                            >
+                              <option value="order">Folder order</option>
+                              <option value="combined">Review: most valuable first</option>
+                              <option value="uncertainty">Review: least confident first</option>
+                              <option value="disagreement">Review: label disagreements</option>
+                              <option value="anomaly">Review: unusual box counts</option>
+                            </select>
+                          )}
                           <button
                             onClick={prevImage}
-                            disabled={currentIndex === 0}
+                            disabled={reviewing ? reviewHistory.current.length === 0 : currentIndex === 0}
                             className="p-2 bg-gray-200 rounded-lg hover:bg-gray-300 disabled:opacity-50 disabled:cursor-not-allowed"
                           >
                             <ChevronLeft className="w-5 h-5" />
                           </button>
                           <button
                             onClick={nextImage}
-                            disabled={currentIndex === images.length - 1}
+                            disabled={reviewing ? Boolean(reviewInfo?.done) : currentIndex === imageList.total - 1}
                             className="p-2 bg-gray-200 rounded-lg hover:bg-gray-300 disabled:opacity-50 disabled:cursor-not-allowed"
                           >
                             <ChevronRight className="w-5 h-5" />
@@ -187,12 +531,21 @@ HTML_CONTENT = """
                         </div>
                       </div>
 
+                      {reviewing && reviewInfo && (
+                        <p className="text-sm text-gray-600 mb-4">
+                          {reviewInfo.done
+                            ? 'Every image in this review mode has been handed out.'
+                            : `Priority ${reviewInfo.priority.toFixed(2)} (uncertainty ${reviewInfo.signals.uncertainty.toFixed(2)}, disagreement ${reviewInfo.signals.disagreement.toFixed(0)}, box anomaly ${reviewInfo.signals.anomaly.toFixed(2)}), ${reviewInfo.remaining} left to review`}
+                        </p>
+                      )}
+
                       {currentImage && (
                         <div className="space-y-4">
                           <div className="relative bg-gray-100 rounded-lg overflow-hidden flex items-center justify-center" style={{ minHeight: '400px' }}>
                             <img
-                              src={currentImage.url}
+                              src={currentImage.display || currentImage.src}
                               alt={currentImage.name}
+                              onLoad={handleImageLoad}
                               className="max-h-[500px] max-w-full object-contain"
                             />
                           </div>
@@ -210,6 +563,11 @@ HTML_CONTENT = """
                                   : 'bg-yellow-100 text-yellow-800'
                               }`}>
                                 {currentImage.label}
+                                {!currentImage.manuallyLabeled && currentImage.confidence != null && (
+                                  <span className="ml-2 text-xs font-normal">
+                                    {(currentImage.confidence * 100).toFixed(0)}%
+                                  </span>
+                                )}
                               </span>
                               {currentImage.manuallyLabeled && (
                                 <CheckCircle className="w-5 h-5 text-green-600" />
@@ -242,6 +600,51 @@ HTML_CONTENT = """
                               />
                             </div>
                           </div>
+
+                          {window.pywebview && (
+                            <div className="bg-indigo-50 p-4 rounded-lg">
+                              <p className="text-sm font-semibold mb-2">Batch label:</p>
+                              <div className="flex gap-2 flex-wrap">
+                                <select
+                                  value={batchScope}
+                                  onChange={(e) => setBatchScope(e.target.value)}
+                                  className="px-4 py-2 border border-gray-300 rounded-lg"
+                                >
+                                  <option value="folder">This image's folder</option>
+                                  <option value="glob">Filename pattern</option>
+                                  <option value="cluster">This image and its near-duplicates</option>
+                                </select>
+                                {batchScope === 'glob' && (
+                                  <input
+                                    type="text"
+                                    placeholder="e.g. */cats/*.jpg"
+                                    value={batchPattern}
+                                    onChange={(e) => setBatchPattern(e.target.value)}
+                                    className="px-4 py-2 border border-gray-300 rounded-lg focus:outline-none focus:ring-2 focus:ring-indigo-500"
+                                  />
+                                )}
+                                <input
+                                  type="text"
+                                  placeholder="Label"
+                                  list="batch-labels"
+                                  value={batchLabel}
+                                  onChange={(e) => setBatchLabel(e.target.value)}
+                                  className="px-4 py-2 border border-gray-300 rounded-lg focus:outline-none focus:ring-2 focus:ring-indigo-500"
+                                />
+                                <datalist id="batch-labels">
+                                  {Object.keys(stats?.distribution || {}).map(label => (
+                                    <option key={label} value={label} />
+                                  ))}
+                                </datalist>
+                                <button
+                                  onClick={handleBatchLabel}
+                                  className="px-4 py-2 bg-indigo-600 text-white rounded-lg hover:bg-indigo-700 transition"
+                                >
+                                  Apply
+                                </button>
+                              </div>
+                            </div>
+                          )}
                         </div>
                       )}
                     </div>
@@ -269,6 +672,8 @@ HTML_CONTENT = """
                         </div>
                       </div>
                     )}
+
+                    {window.pywebview && <DiagnosticsPanel />}
                   </div>
                 )}
               </div>
@@ -277,14 +682,20 @@ HTML_CONTENT = """
         }
 
         ReactDOM.render(<AnnotationChecker />, document.getElementById('root'));
+
+        // Tell the backend the first render has committed (startup benchmarks)
+        announceReady();
     </script>
 </body>
 </html>
 """
 
-class API:
+class API(DatasetAPI):
     """Backend API for additional desktop features"""
-    
+
+    # Labels are keyed by path; hashes are computed when duplicates are asked for
+    hash_on_open = False
+
     def get_user_documents_path(self):
         """Get the user's documents directory"""
         if sys.platform == 'win32':
@@ -292,22 +703,31 @@ class API:
         else:
             return str(Path.home())
 
-def main():
+def main(argv=None):
+    args = collab_server.parse_args('Dataset Annotation Checker', argv)
+    if args.serve:
+        return collab_server.serve(API, HTML_CONTENT, args)
+
+    # Imported here so the backend modules stay usable without a GUI
+    import webview
+
     api = API()
     
     # Create the webview window
     window = webview.create_window(
         'Dataset Annotation Checker',
-        html=HTML_CONTENT,
         js_api=api,
+        **window_source('checker', HTML_CONTENT, api._server),
         width=1400,
         height=900,
         resizable=True,
         background_color='#EFF6FF'
     )
+    api._window = window
     
     # Start the application
     webview.start(debug=False)
+    api._shutdown()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,32 @@
+import os
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    # Manifests and thumbnails go to the test's own cache, never ~/.cache
+    path = tmp_path / 'cache'
+    monkeypatch.setenv('ANNOTATION_CACHE_DIR', str(path))
+    return path
+
+
+def write_png_header(path, width, height):
+    """Write just enough of a PNG for read_image_size to find its size"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n' + b'\x00\x00\x00\rIHDR' + struct.pack('>II', width, height))
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """An ImageFolder tree of 20 cats and 20 dogs, sized by their number"""
+    root = tmp_path / 'data'
+    for folder in ('cats', 'dogs'):
+        for n in range(1, 21):
+            write_png_header(str(root / folder / ('%02d.png' % n)), 10 + n, 20 + n)
+    return root
@@ -0,0 +1,136 @@
+import threading
+import time
+
+import pytest
+
+from annotation_web.collab_server import CollabServer, LeaseConflict, LeaseManager, RowLocks
+
+
+def test_row_locks_serialize_the_same_key():
+    locks = RowLocks()
+    entered = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def first():
+        with locks.hold(['a.png']):
+            entered.set()
+            release.wait(5)
+            order.append('first')
+
+    def second():
+        with locks.hold(['a.png', 'b.png']):
+            order.append('second')
+
+    t1 = threading.Thread(target=first)
+    t1.start()
+    entered.wait(5)
+    t2 = threading.Thread(target=second)
+    t2.start()
+    time.sleep(0.05)
+    assert order == []
+    release.set()
+    t1.join(5)
+    t2.join(5)
+    assert order == ['first', 'second']
+    assert locks._rows == {}
+
+
+def test_row_locks_leave_other_keys_free():
+    locks = RowLocks()
+    done = threading.Event()
+
+    def other():
+        with locks.hold(['b.png']):
+            done.set()
+
+    with locks.hold(['a.png']):
+        thread = threading.Thread(target=other)
+        thread.start()
+        assert done.wait(5)
+        thread.join(5)
+    assert locks._rows == {}
+
+
+def test_leases_conflict_only_across_clients():
+    leases = LeaseManager()
+    leases.grant('alice', 'a.png', ['cid-a'])
+    leases.check(['a.png', 'cid-a', 'b.png'], 'alice')
+    leases.check(['b.png'], 'bob')
+    for key in ('a.png', 'cid-a'):
+        with pytest.raises(LeaseConflict):
+            leases.check([key], 'bob')
+    assert leases.holder('cid-a') == 'alice'
+
+    assert leases.release('bob', 'a.png') == []
+    assert leases.release('alice', 'cid-a') == ['a.png']
+    leases.check(['a.png', 'cid-a'], 'bob')
+    assert len(leases) == 0
+
+
+def test_leases_expire_unless_renewed():
+    leases = LeaseManager(seconds=0)
+    leases.grant('alice', 'a.png')
+    leases.grant('bob', 'b.png')
+    assert sorted(leases.expire()) == ['a.png', 'b.png']
+    assert leases.holder('a.png') is None
+
+    leases.seconds = 60
+    leases.grant('alice', 'a.png')
+    leases.grant('alice', 'c.png')
+    leases._leases['a.png']['expires'] = leases._leases['c.png']['expires'] = 0
+    assert leases.renew('alice') == 2
+    assert leases.expire() == []
+    assert sorted(leases.release('alice')) == ['a.png', 'c.png']
+
+
+class FakeAPI:
+    _index = None
+
+    def __init__(self):
+        self.calls = []
+
+    def set_label(self, image, label, verified=True):
+        self.calls.append(('set_label', image, label, verified))
+        return {'success': True}
+
+    def get_annotations(self, image):
+        return []
+
+
+@pytest.fixture
+def server():
+    server = CollabServer(FakeAPI(), '<html><head></head><body></body></html>', workers=2)
+    yield server
+    server._executor.shutdown()
+
+
+def test_writes_respect_leases(server):
+    server.leases.grant('alice', 'a.png')
+    with pytest.raises(LeaseConflict):
+        server.call('bob', 'set_label', ['a.png', 'dog'])
+    assert server.api.calls == []
+
+    # An unverified label keeps the work item; a verified one completes it
+    server.call('alice', 'set_label', ['a.png', 'cat', False])
+    assert server.leases.holder('a.png') == 'alice'
+    server.call('alice', 'set_label', ['a.png', 'cat'])
+    assert server.leases.holder('a.png') is None
+    server.call('bob', 'set_label', ['a.png', 'dog'])
+    assert [call[2] for call in server.api.calls] == ['cat', 'cat', 'dog']
+
+
+def test_desktop_only_calls_are_refused(server):
+    with pytest.raises(PermissionError):
+        server.call('alice', 'export_labels', [])
+    with pytest.raises(TypeError):
+        server.call('alice', 'get_annotations', [])
+
+
+def test_token_from_query_or_cookie(server):
+    assert server._authorized({}, {})
+    server.token = 'secret'
+    assert not server._authorized({}, {})
+    assert not server._authorized({}, {'token': ['wrong']})
+    assert server._authorized({}, {'token': ['secret']})
+    assert server._authorized({'cookie': 'annotation_token=secret'}, {})
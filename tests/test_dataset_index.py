@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from annotation_web.dataset_index import DatasetIndex
+
+from conftest import write_png_header
+
+
+@pytest.fixture
+def index(dataset, tmp_path):
+    index = DatasetIndex(str(dataset), str(tmp_path / 'manifest.sqlite'))
+    index.scan(workers=2)
+    yield index
+    index.close()
+
+
+def page_through(index, size, pattern=None):
+    paths, offset = [], 0
+    while True:
+        page = index.list_images(offset, size, pattern)
+        if not page:
+            return paths
+        paths.extend(row['path'] for row in page)
+        offset += len(page)
+
+
+def test_scan_records_sizes(index):
+    assert len(index) == 40
+    row = index.get(os.path.join('cats', '03.png'))
+    assert (row['width'], row['height']) == (13, 23)
+
+
+@pytest.mark.parametrize('size', [1, 7, 40, 100])
+def test_paging_matches_the_full_listing(index, size):
+    everything = [row['path'] for row in index.iter_images()]
+    assert everything == sorted(everything)
+    assert page_through(index, size) == everything
+
+
+@pytest.mark.parametrize('pattern, expected', [
+    ('CATS', 20),
+    ('1', 22),
+    ('dogs/*', 20),
+    ('*/0[1-3].png', 6),
+])
+def test_filters_page_and_count(index, pattern, expected):
+    pattern = pattern.replace('/', os.sep)
+    paths = page_through(index, 3, pattern)
+    assert len(paths) == expected == index.count(pattern)
+    assert paths == sorted(paths)
+
+
+def test_jumping_to_an_offset(index):
+    everything = [row['path'] for row in index.iter_images()]
+    assert [row['path'] for row in index.list_images(25, 5)] == everything[25:30]
+    # The page after it continues from the remembered cursor
+    assert [row['path'] for row in index.list_images(30, 5)] == everything[30:35]
+    assert index.list_images(40, 5) == []
+    assert index.position(everything[33]) == 33
+
+
+def test_rescan_refreshes_pages_and_counts(index, dataset):
+    page_through(index, 7, 'cats')
+    assert index.count('cats') == 20
+    write_png_header(str(dataset / 'cats' / '00.png'), 5, 5)
+    os.remove(str(dataset / 'cats' / '20.png'))
+    write_png_header(str(dataset / 'cats' / '05.png'), 99, 98)
+    os.utime(str(dataset / 'cats' / '05.png'), ns=(1, 1))
+
+    summary = index.scan(workers=1)
+    assert (summary['added'], summary['updated'], summary['removed']) == (1, 1, 1)
+    paths = page_through(index, 7, 'cats')
+    assert paths[0] == os.path.join('cats', '00.png')
+    assert os.path.join('cats', '20.png') not in paths
+    assert len(paths) == index.count('cats') == 20
+    assert index.get(os.path.join('cats', '05.png'))['width'] == 99
+
+
+def test_unchanged_rescan_touches_nothing(index):
+    summary = index.scan()
+    assert (summary['added'], summary['updated'], summary['removed']) == (0, 0, 0)
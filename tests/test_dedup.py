@@ -0,0 +1,53 @@
+import random
+import shutil
+
+import pytest
+
+from annotation_web.dataset_index import DatasetIndex
+from annotation_web.dedup import (
+    BKTree, exact_duplicates, hamming, hash_images, near_duplicates,
+)
+
+
+def test_bk_tree_matches_a_linear_scan():
+    rng = random.Random(7)
+    values = [rng.getrandbits(16) for _ in range(300)]
+    tree = BKTree((value, i) for i, value in enumerate(values))
+    assert len(tree) == 300
+    for probe in values[:20]:
+        for radius in (0, 2, 5):
+            expected = sorted((hamming(probe, v), i) for i, v in enumerate(values)
+                              if hamming(probe, v) <= radius)
+            found = tree.search(probe, radius)
+            assert sorted(found) == expected
+            assert [d for d, _ in found] == sorted(d for d, _ in found)
+
+
+def test_exact_and_near_duplicates_are_grouped(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    root = tmp_path / 'data'
+    root.mkdir()
+    def blocks(seed):
+        # Random 16x12 blocks, scaled up so resampling keeps the pattern
+        rng = random.Random(seed)
+        img = Image.new('L', (16, 12))
+        img.putdata([rng.randrange(256) for _ in range(16 * 12)])
+        return img.resize((128, 96), Image.NEAREST)
+
+    image = blocks(1)
+    image.save(str(root / 'a.png'))
+    shutil.copy(str(root / 'a.png'), str(root / 'copy.png'))
+    edited = image.copy()
+    edited.paste(255, (0, 0, 4, 4))
+    edited.save(str(root / 'edited.png'))
+    blocks(2).save(str(root / 'other.png'))
+
+    index = DatasetIndex(str(root), str(tmp_path / 'manifest.sqlite'))
+    try:
+        index.scan(workers=1)
+        assert hash_images(index, workers=1, processes=False) == 4
+        assert hash_images(index, workers=1, processes=False) == 0
+        assert exact_duplicates(index) == [['a.png', 'copy.png']]
+        assert near_duplicates(index) == [['a.png', 'copy.png', 'edited.png']]
+    finally:
+        index.close()
@@ -0,0 +1,107 @@
+import json
+import os
+
+import pytest
+
+from annotation_web.exporters import (
+    annotation_records, canvas_to_pixels, detection_records, load_records,
+    pixels_to_canvas, write_yolo,
+)
+from annotation_web.model import AnnotationTable
+
+# A 200x300 image fits the 800x600 canvas at scale 2, centred 200px in
+BOX = {'id': 1, 'type': 'rectangle', 'label': 'cat',
+       'x': 220, 'y': 40, 'width': 60, 'height': 80}
+
+
+def sizes(**images):
+    def lookup(key):
+        size = images.get(key.replace('.', '_'))
+        return size and (key,) + size
+    return lookup
+
+
+def test_fit_and_centre_offsets():
+    assert canvas_to_pixels(BOX, 200, 300) == pytest.approx((10, 20, 30, 40))
+
+
+def test_zoom_moves_the_origin():
+    # At zoom 2 the fitted image is centred in a 400x300 canvas
+    box = dict(BOX, x=20, y=-110, zoom=2)
+    assert canvas_to_pixels(box, 200, 300) == pytest.approx((10, 20, 30, 40))
+
+
+def test_boxes_are_clipped_to_the_image():
+    box = dict(BOX, x=100, y=-50, width=700, height=100)
+    assert canvas_to_pixels(box, 200, 300) == pytest.approx((0, 0, 200, 25))
+
+
+def test_image_space_is_only_clipped():
+    box = dict(BOX, space='image', x=150, y=5, width=100, height=10)
+    assert canvas_to_pixels(box, 200, 300) == pytest.approx((150, 5, 50, 10))
+
+
+def test_circle_uses_its_bounding_square():
+    circle = dict(BOX, type='circle', width=40, height=80)
+    assert canvas_to_pixels(circle, 200, 300) == pytest.approx((0, 20, 40, 40))
+
+
+def test_pixels_to_canvas_round_trips():
+    x, y, w, h = pixels_to_canvas((10, 20, 30, 40), 200, 300)
+    box = dict(BOX, x=x, y=y, width=w, height=h)
+    assert canvas_to_pixels(box, 200, 300) == pytest.approx((10, 20, 30, 40))
+
+
+def test_vectorized_records_match_canvas_to_pixels():
+    anns = [
+        BOX,
+        dict(BOX, id=2, x=20, y=-110, zoom=2),
+        dict(BOX, id=3, x=100, y=-50, width=700, height=100),
+        dict(BOX, id=4, space='image', x=150, y=5, width=100, height=10),
+        dict(BOX, id=5, type='circle', width=40, height=80),
+    ]
+    wide = [dict(BOX, id=6, x=0, y=100, label='dog')]
+    records = list(detection_records({'a.png': anns, 'b.png': wide},
+                                     sizes(a_png=(200, 300), b_png=(400, 200))))
+    assert [r.file_name for r in records] == ['a.png', 'b.png']
+    for record, group in zip(records, [anns, wide]):
+        assert len(record.objects) == len(group)
+        for obj, ann in zip(record.objects, group):
+            assert obj.label == ann['label']
+            assert obj.bbox == pytest.approx(
+                canvas_to_pixels(ann, record.width, record.height))
+
+
+def test_polygon_outline_and_unknown_images():
+    polygon = {'id': 1, 'type': 'polygon', 'label': 'cat',
+               'points': [[220, 40], [280, 40], [250, 120]]}
+    table = AnnotationTable.from_document({'a.png': [polygon], 'gone.png': [BOX]})
+    records = list(annotation_records(table, sizes(a_png=(200, 300))))
+    assert len(records) == 1
+    obj = records[0].objects[0]
+    assert obj.bbox == pytest.approx((10, 20, 30, 40))
+    assert obj.segmentation == pytest.approx([10, 20, 40, 20, 25, 60])
+
+
+def test_yolo_is_normalized_to_the_image(tmp_path):
+    document = {'a.png': [BOX, dict(BOX, id=2, label='dog', x=200, y=0, width=400, height=600)]}
+    counts = write_yolo(detection_records(document, sizes(a_png=(200, 300))),
+                        str(tmp_path), workers=1)
+    assert counts == {'images': 1, 'annotations': 2, 'categories': 2}
+    lines = (tmp_path / 'a.txt').read_text().splitlines()
+    assert lines == ['0 0.125000 0.133333 0.150000 0.133333',
+                     '1 0.500000 0.500000 1.000000 1.000000']
+    assert (tmp_path / 'classes.txt').read_text() == 'cat\ndog\n'
+
+
+def test_single_image_export_uses_its_recorded_size(tmp_path):
+    path = tmp_path / 'export.json'
+    path.write_text(json.dumps({'imageName': 'a.png', 'imageWidth': 200,
+                                'imageHeight': 300, 'annotations': [BOX]}))
+    records = list(load_records(str(path), lambda key: None))
+    assert [(r.file_name, r.width, r.height) for r in records] == [('a.png', 200, 300)]
+    assert records[0].objects[0].bbox == pytest.approx((10, 20, 30, 40))
+
+    # A file found in the dataset folder still wins
+    found = load_records(str(path), lambda key: (os.path.join('sub', key), 200, 300))
+    assert next(iter(found)).file_name == os.path.join('sub', 'a.png')
@@ -0,0 +1,85 @@
+import os
+
+from annotation_web.history import HISTORY_NAME, EditHistory
+
+
+def command(n):
+    add = {'op': 'add', 'image': 'a.jpg', 'annotation': {'id': str(n)}}
+    return [add], [{'op': 'delete', 'image': 'a.jpg', 'id': str(n)}]
+
+
+def test_undo_and_redo_survive_a_restart(tmp_path):
+    history = EditHistory(str(tmp_path))
+    for n in range(3):
+        history.record('a.jpg', *command(n))
+    assert history.undo()['do'] == command(2)[0]
+    assert history.undo()['do'] == command(1)[0]
+    history.close()
+
+    history = EditHistory(str(tmp_path))
+    try:
+        assert history.counts()['undo'] == 1
+        assert history.counts()['redo'] == 2
+        assert history.redo()['do'] == command(1)[0]
+        assert history.undo()['do'] == command(1)[0]
+        assert history.undo()['do'] == command(0)[0]
+        assert history.undo() is None
+    finally:
+        history.close()
+
+
+def test_recording_after_undo_discards_redo_across_restart(tmp_path):
+    history = EditHistory(str(tmp_path))
+    history.record('a.jpg', *command(0))
+    history.record('a.jpg', *command(1))
+    history.undo()
+    history.record('a.jpg', *command(2))
+    history.close()
+
+    history = EditHistory(str(tmp_path))
+    try:
+        assert history.redo() is None
+        assert history.undo()['do'] == command(2)[0]
+        assert history.undo()['do'] == command(0)[0]
+    finally:
+        history.close()
+
+
+def test_torn_tail_is_ignored(tmp_path):
+    history = EditHistory(str(tmp_path))
+    history.record('a.jpg', *command(0))
+    history.close()
+    with open(os.path.join(str(tmp_path), HISTORY_NAME), 'ab') as f:
+        f.write(b'{"op": "do", "comm')
+
+    history = EditHistory(str(tmp_path))
+    assert history.counts()['undo'] == 1
+    history.record('a.jpg', *command(1))
+    history.close()
+
+    # The record after the crash must not be glued onto the torn one
+    history = EditHistory(str(tmp_path))
+    try:
+        assert history.undo()['do'] == command(1)[0]
+        assert history.undo()['do'] == command(0)[0]
+    finally:
+        history.close()
+
+
+def test_compaction_replays_to_the_same_stacks(tmp_path):
+    history = EditHistory(str(tmp_path), max_bytes=400)
+    for n in range(40):
+        history.record('a.jpg', *command(n))
+    history.undo()
+    counts = history.counts()
+    history.close()
+    # Old commands were dropped from the stack and compacted out of the log
+    assert counts['undo'] < 39
+    assert os.path.getsize(os.path.join(str(tmp_path), HISTORY_NAME)) < 4 * 400 * 2
+
+    history = EditHistory(str(tmp_path), max_bytes=400)
+    try:
+        assert history.counts() == counts
+        assert history.redo()['do'] == command(39)[0]
+    finally:
+        history.close()
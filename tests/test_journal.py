@@ -0,0 +1,73 @@
+import os
+
+from annotation_web.journal import AnnotationJournal
+
+
+def box(ann_id, x=10):
+    return {'id': ann_id, 'type': 'box', 'label': 'cat', 'x': x, 'y': 20,
+            'width': 30, 'height': 40}
+
+
+def last_segment(directory):
+    names = sorted(n for n in os.listdir(directory) if n.startswith('journal-'))
+    return os.path.join(directory, names[-1])
+
+
+def test_replay_restores_events(tmp_path):
+    journal = AnnotationJournal(str(tmp_path))
+    journal.append({'op': 'add', 'image': 'a.jpg', 'annotation': box('1')})
+    journal.append({'op': 'add', 'image': 'a.jpg', 'annotation': box('2')})
+    journal.append({'op': 'update', 'image': 'a.jpg', 'id': '1', 'changes': {'x': 50}})
+    journal.append({'op': 'delete', 'image': 'a.jpg', 'id': '2'})
+    journal.append({'op': 'label', 'image': 'a.jpg', 'label': 'cat', 'verified': True})
+    journal.close()
+
+    journal = AnnotationJournal(str(tmp_path))
+    try:
+        anns = journal.annotations('a.jpg')
+        assert [ann['id'] for ann in anns] == ['1']
+        assert anns[0]['x'] == 50
+        assert journal.label('a.jpg') == {'label': 'cat', 'verified': True}
+    finally:
+        journal.close()
+
+
+def test_torn_tail_is_ignored(tmp_path):
+    journal = AnnotationJournal(str(tmp_path))
+    journal.append({'op': 'add', 'image': 'a.jpg', 'annotation': box('1')})
+    journal.append({'op': 'add', 'image': 'a.jpg', 'annotation': box('2')})
+    journal.close()
+    # A crash in the middle of writing the third event
+    with open(last_segment(str(tmp_path)), 'ab') as f:
+        f.write(b'{"op": "add", "image": "a.jpg", "annot')
+
+    journal = AnnotationJournal(str(tmp_path))
+    assert [ann['id'] for ann in journal.annotations('a.jpg')] == ['1', '2']
+    # New events go to a fresh segment, so the torn line cannot swallow them
+    journal.append({'op': 'add', 'image': 'b.jpg', 'annotation': box('3')})
+    journal.close()
+
+    journal = AnnotationJournal(str(tmp_path))
+    try:
+        assert [ann['id'] for ann in journal.annotations('a.jpg')] == ['1', '2']
+        assert [ann['id'] for ann in journal.annotations('b.jpg')] == ['3']
+    finally:
+        journal.close()
+
+
+def test_compaction_keeps_state_and_drops_segments(tmp_path):
+    journal = AnnotationJournal(str(tmp_path))
+    for n in range(5):
+        journal.append({'op': 'add', 'image': 'a.jpg', 'annotation': box(str(n), x=n)})
+    journal.append({'op': 'labels', 'images': ['a.jpg', 'b.jpg'], 'label': 'dog'})
+    journal.compact()
+    journal.append({'op': 'delete', 'image': 'a.jpg', 'id': '0'})
+    journal.close()
+    assert os.path.exists(os.path.join(str(tmp_path), 'snapshot.json'))
+
+    journal = AnnotationJournal(str(tmp_path))
+    try:
+        assert [ann['id'] for ann in journal.annotations('a.jpg')] == ['1', '2', '3', '4']
+        assert journal.label('b.jpg')['label'] == 'dog'
+    finally:
+        journal.close()